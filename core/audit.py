@@ -0,0 +1,105 @@
+"""
+Sink for ActivityLog entries.
+
+In the 'buffered' mode (AUDIT_LOG_MODE) entries are queued in-process once
+their transaction commits and written with one bulk_create when
+AUDIT_LOG_BATCH_SIZE entries are waiting or every AUDIT_LOG_FLUSH_INTERVAL
+seconds, by a background thread. When the worker process exits (gunicorn
+worker_exit hook, atexit) stop() ends the thread and writes whatever is
+still queued. The 'sync' mode writes every entry right away,
+which is what tests use.
+"""
+import atexit
+import logging
+import threading
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+class AuditSink:
+    def __init__(self):
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def log(self, **fields):
+        """Record one ActivityLog entry (user, action, object_id, object_type, description, ip_address)."""
+        self.log_many([fields])
+
+    def log_many(self, entries):
+        ActivityLog = apps.get_model('core', 'ActivityLog')
+        # Stamped now, not when the buffer gets written
+        now = timezone.now()
+        entries = [ActivityLog(timestamp=now, **fields) for fields in entries]
+        if not entries:
+            return
+
+        if settings.AUDIT_LOG_MODE == 'sync':
+            ActivityLog.objects.bulk_create(entries)
+            return
+
+        # Entries of rolled back transactions are never queued
+        transaction.on_commit(lambda: self._enqueue(entries))
+
+    def flush(self):
+        """Write everything that is queued."""
+        with self._lock:
+            entries, self._buffer = self._buffer, []
+        if not entries:
+            return
+
+        try:
+            apps.get_model('core', 'ActivityLog').objects.bulk_create(entries, batch_size=settings.AUDIT_LOG_BATCH_SIZE)
+        except Exception:
+            logger.exception('Could not write %s audit log entries', len(entries))
+            with self._lock:
+                # Keep them for the next attempt, unless the database has been failing for a while
+                if len(self._buffer) + len(entries) <= settings.AUDIT_LOG_BATCH_SIZE * 10:
+                    self._buffer = entries + self._buffer
+
+    def stop(self, timeout=10):
+        """Stop the writer thread and write everything that is queued."""
+        self._stopped.set()
+        self._wakeup.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        self.flush()
+
+    def _enqueue(self, entries):
+        if self._stopped.is_set():
+            # The writer thread is gone
+            apps.get_model('core', 'ActivityLog').objects.bulk_create(entries)
+            return
+
+        with self._lock:
+            self._buffer += entries
+            full = len(self._buffer) >= settings.AUDIT_LOG_BATCH_SIZE
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='audit-log-writer', daemon=True)
+                self._thread.start()
+        if full:
+            self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(settings.AUDIT_LOG_FLUSH_INTERVAL)
+            self._wakeup.clear()
+            if self._stopped.is_set():
+                # stop() writes the rest
+                break
+            self.flush()
+            # This thread is not a request, so nothing else closes its connection
+            connections.close_all()
+
+
+audit_log = AuditSink()
+
+atexit.register(audit_log.stop)
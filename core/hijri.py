@@ -0,0 +1,47 @@
+"""
+Gregorian <-> Hijri dates by the tabular (arithmetic) Islamic calendar.
+
+Months alternate between 30 and 29 days and 11 of every 30 years are leap
+years with a 30 day Dhu al-Hijjah (civil epoch, the Kuwaiti intercalation
+used by most software). The dates can differ by a day or two from the
+moon sighting calendar announced locally, they are meant for grouping
+reports by Hijri month and year.
+"""
+import datetime
+
+# Day number (date.toordinal()) of 1 Muharram 1 AH: 16 July 622 in the Julian calendar
+EPOCH = 227015
+
+
+def to_ordinal(year, month, day):
+    """Day number of a Hijri date"""
+    return (
+        EPOCH - 1 + day + 29 * (month - 1) + (6 * month - 1) // 11
+        + (year - 1) * 354 + (3 + 11 * year) // 30
+    )
+
+
+def from_gregorian(date):
+    """(year, month, day) of the Hijri date of a datetime.date"""
+    ordinal = date.toordinal()
+    year = (30 * (ordinal - EPOCH) + 10646) // 10631
+    month = min(12, (11 * (ordinal - to_ordinal(year, 1, 1)) + 330) // 325)
+    day = ordinal - to_ordinal(year, month, 1) + 1
+    return year, month, day
+
+
+def to_gregorian(year, month, day):
+    """datetime.date of a Hijri date"""
+    return datetime.date.fromordinal(to_ordinal(year, month, day))
+
+
+def month_start(date):
+    """Gregorian date of the first day of the Hijri month of the date"""
+    year, month, _ = from_gregorian(date)
+    return to_gregorian(year, month, 1)
+
+
+def year_start(date):
+    """Gregorian date of 1 Muharram of the Hijri year of the date"""
+    year, _, _ = from_gregorian(date)
+    return to_gregorian(year, 1, 1)
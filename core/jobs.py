@@ -0,0 +1,271 @@
+"""
+Background jobs without a broker.
+
+A Job row is the queue entry. Depending on JOB_EXECUTOR the job is run by a
+thread pool of the web process ('thread'), only by the `run_jobs` management
+command ('worker', so jobs survive web worker restarts), or right away in
+the caller ('sync', which is what tests use). Whoever runs a job claims it
+with a conditional update first, so a job never runs twice.
+
+A running job has a heartbeat. Jobs whose heartbeat stopped for
+JOB_STALE_AFTER seconds went down with the process running them and are
+failed by fail_stale(). With the 'thread' executor every web process runs
+a supervisor (see resume()) that does so and picks up the pending jobs
+left over by a restart, `run_jobs` does the same between jobs.
+
+Handlers are looked up in HANDLERS by the kind of the job and are called
+with a JobContext to report progress and store the result file.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import DatabaseError, close_old_connections, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from core import replica
+from core.models import Job
+
+logger = logging.getLogger(__name__)
+
+HANDLERS = {
+    Job.Kind.PLACE_IMPORT: 'place.excel.run_import_job',
+    Job.Kind.RECORD_IMPORT: 'record.jobs.run_import_job',
+    Job.Kind.RECORD_EXPORT_CSV: 'record.jobs.run_export_csv_job',
+    Job.Kind.RECORD_EXPORT_XLSX: 'record.jobs.run_export_xlsx_job',
+    Job.Kind.REPORT_HIERARCHICALLY_XLSX: 'record.jobs.run_report_hierarchically_job',
+}
+
+# Seconds between two progress writes of a job
+PROGRESS_INTERVAL = 1
+# Seconds between two heartbeats of a job that made no progress, and between two supervisor rounds
+HEARTBEAT_INTERVAL = 30
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobContext:
+    """
+    What a handler gets to report progress and store its result. Progress is written
+    and cancellation checked by a heartbeat thread on a connection of its own, so the
+    progress shows while the handler is inside a transaction (the place import runs
+    in one) and the job row is never locked by it.
+    """
+
+    def __init__(self, job):
+        self.job = job
+        self._cancelled = threading.Event()
+        self._finished = threading.Event()
+
+    def progress(self, done, total=None):
+        """Report progress, stops the job with JobCancelled if it was cancelled in the meantime"""
+        self.job.progress = done
+        if total is not None:
+            self.job.total = total
+        if self._cancelled.is_set():
+            raise JobCancelled()
+
+    @contextmanager
+    def heartbeat(self):
+        """Write progress and the heartbeat while the block runs"""
+        thread = threading.Thread(target=self._beat, name=f'job-{self.job.pk}-heartbeat', daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            self._finished.set()
+            thread.join()
+
+    def _beat(self):
+        written, written_at = (self.job.progress, self.job.total), time.monotonic()
+        try:
+            while not self._finished.wait(PROGRESS_INTERVAL):
+                progress = (self.job.progress, self.job.total)
+                try:
+                    if progress != written or time.monotonic() - written_at >= HEARTBEAT_INTERVAL:
+                        Job.objects.filter(pk=self.job.pk, status=Job.Status.RUNNING).update(
+                            progress=progress[0], total=progress[1], heartbeat_at=timezone.now()
+                        )
+                        written, written_at = progress, time.monotonic()
+                    if Job.objects.filter(pk=self.job.pk, cancel_requested=True).exists():
+                        self._cancelled.set()
+                except DatabaseError:
+                    # E.g. SQLite locked by the transaction of the handler, the next beat tries again
+                    logger.warning('Could not write the heartbeat of job %s', self.job.pk, exc_info=True)
+        finally:
+            connection.close()
+
+    def save_result_file(self, name, file_obj):
+        """Store the file as the result of the job"""
+        self.job.result_file.save(name, File(file_obj), save=False)
+        self.set_result_file(self.job.result_file.name)
+
+    def set_result_file(self, storage_name):
+        """Make a file that is in the storage already the result of the job"""
+        self.job.result_file.name = storage_name
+        Job.objects.filter(pk=self.job.pk).update(result_file=storage_name)
+
+
+def is_requested(request):
+    """Did the request ask to run in the background (?background=true)"""
+    return request.query_params.get('background', '').lower() in ('1', 'true')
+
+
+def claim(job_id):
+    """Mark a pending job as running, returns the job or None if someone else got it or it was cancelled"""
+    now = timezone.now()
+    claimed = Job.objects.filter(pk=job_id, status=Job.Status.PENDING, cancel_requested=False).update(
+        status=Job.Status.RUNNING, started_at=now, heartbeat_at=now
+    )
+    return Job.objects.get(pk=job_id) if claimed else None
+
+
+def claim_next():
+    """Claim the oldest pending job, returns None when there is none"""
+    while True:
+        job_id = Job.objects.filter(status=Job.Status.PENDING).order_by('created_at', 'id').values_list(
+            'id', flat=True
+        ).first()
+        if job_id is None:
+            return None
+        job = claim(job_id)
+        if job is not None:
+            return job
+
+
+def fail_stale():
+    """Fail the running jobs without a heartbeat for JOB_STALE_AFTER seconds, returns how many"""
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.JOB_STALE_AFTER)
+    # Jobs started before heartbeats were written have none
+    return Job.objects.filter(
+        Q(heartbeat_at__lt=stale) | Q(heartbeat_at__isnull=True, started_at__lt=stale), status=Job.Status.RUNNING
+    ).update(status=Job.Status.FAILED, error='The process running the job stopped', finished_at=now)
+
+
+def run(job):
+    """Run a claimed job to its end, whatever happens"""
+    context = JobContext(job)
+    try:
+        handler = import_string(HANDLERS[job.kind])
+        with context.heartbeat():
+            result = handler(job, context)
+    except JobCancelled:
+        fields = {'status': Job.Status.CANCELLED}
+    except Exception as e:
+        logger.exception('Job %s failed', job.pk)
+        fields = {'status': Job.Status.FAILED, 'error': str(e)}
+    else:
+        fields = {
+            'status': Job.Status.SUCCEEDED, 'result': result, 'progress': job.total or job.progress, 'total': job.total,
+        }
+
+    fields['finished_at'] = timezone.now()
+    Job.objects.filter(pk=job.pk).update(**fields)
+    for name, value in fields.items():
+        setattr(job, name, value)
+    return job
+
+
+def run_pending(job_id):
+    """Run the job if it is still pending"""
+    # A job submitted by a request that reads from the replica is not there yet
+    with replica.primary():
+        job = claim(job_id)
+        if job is not None:
+            run(job)
+
+
+def _run_in_thread(job_id):
+    close_old_connections()
+    try:
+        run_pending(job_id)
+    finally:
+        with _lock:
+            _queued.discard(job_id)
+        # Pool threads outlive requests, nothing else closes their connection
+        connection.close()
+
+
+_lock = threading.Lock()
+_executor = None
+_queued = set()  # Ids of the jobs handed to the pool and not done yet
+_supervisor = None
+
+
+def _submit_to_pool(job_id):
+    global _executor
+    with _lock:
+        if job_id in _queued:
+            return
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.JOB_WORKERS, thread_name_prefix='job')
+        _queued.add(job_id)
+    _executor.submit(_run_in_thread, job_id)
+
+
+def _supervise():
+    while True:
+        close_old_connections()
+        try:
+            if failed := fail_stale():
+                logger.warning('Failed %s jobs without a heartbeat', failed)
+            with replica.primary():
+                pending = list(Job.objects.filter(status=Job.Status.PENDING).order_by('created_at', 'id').values_list(
+                    'id', flat=True
+                ))
+            for job_id in pending:
+                _submit_to_pool(job_id)
+        except Exception:
+            logger.exception('Could not check the pending and stale jobs')
+        finally:
+            connection.close()
+        time.sleep(HEARTBEAT_INTERVAL)
+
+
+def resume():
+    """
+    Start the supervisor of the 'thread' executor in this process (see the gunicorn
+    post_worker_init hook): it runs the jobs left pending by a restart and fails
+    the ones that went down with it.
+    """
+    global _supervisor
+    if settings.JOB_EXECUTOR != 'thread':
+        return
+    with _lock:
+        if _supervisor is None:
+            _supervisor = threading.Thread(target=_supervise, name='job-supervisor', daemon=True)
+            _supervisor.start()
+
+
+def submit(kind, user=None, params=None, input_file=None):
+    """Create a job and hand it to the executor once the current transaction commits"""
+    job = Job(kind=kind, created_by=user, params=params or {})
+    if input_file is not None:
+        job.input_file.save(input_file.name, input_file, save=False)
+    job.save()
+
+    if settings.JOB_EXECUTOR == 'sync':
+        run_pending(job.pk)
+        job.refresh_from_db()
+    elif settings.JOB_EXECUTOR == 'thread':
+        transaction.on_commit(lambda: _submit_to_pool(job.pk))
+    return job
+
+
+def cancel(job):
+    """Cancel a pending job right away, ask a running one to stop. Returns whether the job was not finished."""
+    if Job.objects.filter(pk=job.pk, status=Job.Status.PENDING).update(
+        status=Job.Status.CANCELLED, cancel_requested=True, finished_at=timezone.now()
+    ):
+        return True
+    return bool(Job.objects.filter(pk=job.pk, status=Job.Status.RUNNING).update(cancel_requested=True))
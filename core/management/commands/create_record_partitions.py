@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from core import partitions
+
+
+class Command(BaseCommand):
+    help = (
+        'Create the yearly Record partitions for this year and the years ahead, and for the years '
+        'that ended up in the default partition (PostgreSQL only). Meant to run from cron.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--years-ahead', type=int, default=1, help='Number of years after this one')
+
+    def handle(self, *args, years_ahead=1, **options):
+        if connection.vendor != 'postgresql':
+            self.stdout.write(f'Record is not partitioned on {connection.vendor}, nothing to do')
+            return
+        if not partitions.is_partitioned():
+            raise CommandError(f'{partitions.TABLE} is not partitioned, run migrate first')
+
+        this_year = timezone.localdate().year
+        wanted = set(range(this_year, this_year + years_ahead + 1)) | partitions.default_partition_years()
+        missing = sorted(wanted - partitions.partition_years())
+        for year in missing:
+            with transaction.atomic():
+                moved = partitions.create_year_partition(year)
+            self.stdout.write(f'Created {partitions.partition_name(year)}, moved {moved} records into it')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {len(missing)} partitions' if missing else 'All partitions exist already'
+        ))
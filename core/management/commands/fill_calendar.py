@@ -0,0 +1,28 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.db.models import Min
+from django.utils import timezone
+
+from core.models import CalendarDay, Record
+
+
+class Command(BaseCommand):
+    help = (
+        'Create the calendar days from the first record to the end of the years ahead, so reports '
+        'find them on the replica too. Meant to run from cron, like create_record_partitions.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--years-ahead', type=int, default=1, help='Number of years after this one')
+
+    def handle(self, *args, years_ahead=1, **options):
+        today = timezone.localdate()
+        start = min(Record.objects.aggregate(first=Min('date'))['first'] or today, today)
+        end = datetime.date(today.year + years_ahead, 12, 31)
+
+        before = CalendarDay.objects.count()
+        CalendarDay.objects.fill(start, end)
+        self.stdout.write(self.style.SUCCESS(
+            f'Calendar covers {start} to {end}, created {CalendarDay.objects.count() - before} days'
+        ))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core import report_cache
+from core.models import PlaceBalance, Record
+
+
+class Command(BaseCommand):
+    help = 'Rebuild or verify the per-place balances from Record'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true', help='Only compare the balances with Record, do not write')
+
+    def handle(self, *args, verify=False, **options):
+        if not verify:
+            PlaceBalance.objects.rebuild()
+            # Reports cached from the old balances
+            report_cache.invalidate_all()
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt {PlaceBalance.objects.count()} place balances'))
+            return
+
+        fields = ('income', 'expense', 'net', 'record_count')
+        expected = {
+            row.place_id: tuple(getattr(row, field) for field in fields)
+            for row in PlaceBalance.objects.balance_rows(Record.objects.all())
+        }
+        actual = {row[0]: row[1:] for row in PlaceBalance.objects.values_list('place_id', *fields)}
+
+        mismatches = 0
+        for place_id in expected.keys() | actual.keys():
+            expected_values = expected.get(place_id, (0, 0, 0, 0))
+            actual_values = actual.get(place_id, (0, 0, 0, 0))
+            if expected_values != actual_values:
+                mismatches += 1
+                self.stderr.write(f'Place {place_id}: expected {expected_values}, found {actual_values}')
+
+        if mismatches:
+            raise CommandError(f'{mismatches} place balances do not match the records')
+        self.stdout.write(self.style.SUCCESS('Place balances are up to date'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import PlaceClosure
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the Place ancestor/descendant index from Place.parent'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            PlaceClosure.objects.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {PlaceClosure.objects.count()} place links'))
@@ -0,0 +1,71 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from core import report_cache
+from core.models import Place, Record, RecordDailyRollup
+
+
+class Command(BaseCommand):
+    help = 'Rebuild or verify the daily Record rollup, a chunk of places at a time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true', help='Only compare the rollup with Record, do not write')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Number of places per chunk')
+
+    def handle(self, *args, verify=False, chunk_size=500, **options):
+        place_ids = list(Place.objects.order_by('id').values_list('id', flat=True))
+        chunks = [place_ids[index:index + chunk_size] for index in range(0, len(place_ids), chunk_size)]
+        # Records without a place are rolled up as a chunk of their own
+        chunks.append(None)
+
+        mismatches = 0
+        for number, chunk in enumerate(chunks, start=1):
+            if chunk is None:
+                records = Record.objects.filter(place__isnull=True)
+                rollups = RecordDailyRollup.objects.filter(place__isnull=True)
+            else:
+                records = Record.objects.filter(place_id__in=chunk)
+                rollups = RecordDailyRollup.objects.filter(place_id__in=chunk)
+
+            if verify:
+                mismatches += self._verify(records, rollups)
+            else:
+                with transaction.atomic():
+                    rollups.delete()
+                    RecordDailyRollup.objects.bulk_create(
+                        RecordDailyRollup.objects.rollup_rows(records), batch_size=5000
+                    )
+
+            self.stdout.write(f'Chunk {number}/{len(chunks)} done')
+
+        if mismatches:
+            raise CommandError(f'{mismatches} rollup rows do not match the records')
+        if not verify:
+            # Reports cached from the old rollup rows
+            report_cache.invalidate_all()
+
+        self.stdout.write(self.style.SUCCESS('Rollup is up to date' if verify else 'Rollup rebuilt'))
+
+    def _verify(self, records, rollups):
+        expected = {
+            (row.place_id, row.category_id, row.date): (row.amount, row.quantity, row.record_count)
+            for row in RecordDailyRollup.objects.rollup_rows(records)
+        }
+
+        actual = defaultdict(lambda: [0, 0, 0])
+        for row in rollups.values_list('place_id', 'category_id', 'date', 'amount', 'quantity', 'record_count'):
+            totals = actual[row[:3]]
+            totals[0] += row[3]
+            totals[1] += row[4]
+            totals[2] += row[5]
+
+        mismatches = 0
+        for key in expected.keys() | actual.keys():
+            expected_totals = expected.get(key, (0, 0, 0))
+            actual_totals = tuple(actual.get(key, (0, 0, 0)))
+            if expected_totals != actual_totals:
+                mismatches += 1
+                self.stderr.write(f'{key}: expected {expected_totals}, found {actual_totals}')
+        return mismatches
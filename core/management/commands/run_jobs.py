@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core import jobs
+
+
+class Command(BaseCommand):
+    help = 'Run pending background jobs, see JOB_EXECUTOR. Several workers can run side by side.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Exit when no job is pending instead of waiting')
+        parser.add_argument('--interval', type=float, default=2, help='Seconds to wait when no job is pending')
+
+    def handle(self, *args, once=False, interval=2, **options):
+        while True:
+            close_old_connections()
+            if failed := jobs.fail_stale():
+                self.stdout.write(f'Failed {failed} jobs without a heartbeat')
+            job = jobs.claim_next()
+            if job is None:
+                if once:
+                    break
+                time.sleep(interval)
+                continue
+
+            self.stdout.write(f'Running job {job.pk} ({job.kind})')
+            job = jobs.run(job)
+            self.stdout.write(f'Job {job.pk}: {job.status}')
@@ -0,0 +1,168 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:08
+
+import datetime
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_alter_place_created_at_alter_record_created_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Position',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(blank=True, db_index=True, max_length=50, null=True, verbose_name='Лавозим номи')),
+            ],
+            options={
+                'verbose_name': 'Лавозим',
+                'verbose_name_plural': 'Лавозимлар',
+            },
+        ),
+        migrations.AlterModelOptions(
+            name='activitylog',
+            options={'verbose_name': 'Лог', 'verbose_name_plural': 'Логлар'},
+        ),
+        migrations.AlterModelOptions(
+            name='category',
+            options={'verbose_name': 'Категория', 'verbose_name_plural': 'Категориялар'},
+        ),
+        migrations.AlterModelOptions(
+            name='place',
+            options={'verbose_name': 'Жой', 'verbose_name_plural': 'Жойлар'},
+        ),
+        migrations.AlterModelOptions(
+            name='record',
+            options={'ordering': ['-created_at'], 'verbose_name': 'Кирим/Чиким', 'verbose_name_plural': 'Киримлар/Чикимлар'},
+        ),
+        migrations.AlterModelOptions(
+            name='unit',
+            options={'verbose_name': 'Улчов бирлиги', 'verbose_name_plural': 'Улчов бирликлари'},
+        ),
+        migrations.AlterModelOptions(
+            name='user',
+            options={'verbose_name': 'Фойдаланувчи', 'verbose_name_plural': 'Фойдаланувчилар'},
+        ),
+        migrations.RemoveField(
+            model_name='place',
+            name='place_type',
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='is_communal',
+            field=models.BooleanField(default=False, verbose_name='Коммунал'),
+        ),
+        migrations.AddField(
+            model_name='place',
+            name='employee_count',
+            field=models.IntegerField(default=0, verbose_name='Ишчилар сони'),
+        ),
+        migrations.AddField(
+            model_name='place',
+            name='inn',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=255, verbose_name='ИНН'),
+        ),
+        migrations.AddField(
+            model_name='place',
+            name='is_mosque',
+            field=models.BooleanField(default=False, verbose_name='Масжид'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='objective_file',
+            field=models.FileField(blank=True, null=True, upload_to='files/objectives', verbose_name='Объективка'),
+        ),
+        migrations.AlterField(
+            model_name='category',
+            name='name',
+            field=models.CharField(db_index=True, max_length=255, verbose_name='Номи'),
+        ),
+        migrations.AlterField(
+            model_name='category',
+            name='operation_type',
+            field=models.CharField(choices=[('income', 'Кирим'), ('expense', 'Чиким')], default='expense', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='category',
+            name='percentage',
+            field=models.DecimalField(decimal_places=2, default=None, max_digits=10, null=True, verbose_name='Процент'),
+        ),
+        migrations.AlterField(
+            model_name='category',
+            name='unit',
+            field=models.ForeignKey(blank=True, default=None, null=True, on_delete=django.db.models.deletion.CASCADE, to='core.unit', verbose_name='Улчов бирлиги'),
+        ),
+        migrations.AlterField(
+            model_name='place',
+            name='name',
+            field=models.CharField(db_index=True, max_length=255, verbose_name='Номи'),
+        ),
+        migrations.AlterField(
+            model_name='place',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='core.place', verbose_name='Тегишли'),
+        ),
+        migrations.AlterField(
+            model_name='record',
+            name='amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10, verbose_name='Сумма'),
+        ),
+        migrations.AlterField(
+            model_name='record',
+            name='category',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.category', verbose_name='Категория'),
+        ),
+        migrations.AlterField(
+            model_name='record',
+            name='date',
+            field=models.DateField(blank=True, default=datetime.datetime(2026, 10, 18, 12, 8, 55, 440548, tzinfo=datetime.timezone.utc), null=True, verbose_name='Вакти'),
+        ),
+        migrations.AlterField(
+            model_name='record',
+            name='description',
+            field=models.CharField(blank=True, max_length=500, null=True, verbose_name='Изох'),
+        ),
+        migrations.AlterField(
+            model_name='record',
+            name='place',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='core.place', verbose_name='Жой'),
+        ),
+        migrations.AlterField(
+            model_name='record',
+            name='quantity',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True, verbose_name='Микдор'),
+        ),
+        migrations.AlterField(
+            model_name='unit',
+            name='name',
+            field=models.CharField(db_index=True, max_length=50, verbose_name='Номи'),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='place',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='core.place', verbose_name='Жой'),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='role',
+            field=models.CharField(blank=True, choices=[('admin', 'СуперАдмин'), ('region_admin', 'Вилоят Админи'), ('mosque_admin', 'Масжид Админи')], default='mosque_admin', max_length=20, null=True),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='username',
+            field=models.CharField(db_index=True, max_length=255, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='place',
+            index=models.Index(fields=['name', 'inn'], name='core_place_name_178801_idx'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='position',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.position', verbose_name='Лавозими'),
+        ),
+    ]
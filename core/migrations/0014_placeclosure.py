@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:09
+
+from collections import defaultdict
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def build_place_closure(apps, schema_editor):
+    Place = apps.get_model('core', 'Place')
+    PlaceClosure = apps.get_model('core', 'PlaceClosure')
+    db_alias = schema_editor.connection.alias
+
+    children = defaultdict(list)
+    for place_id, parent_id in Place.objects.using(db_alias).values_list('id', 'parent_id'):
+        children[parent_id].append(place_id)
+
+    links = []
+    stack = [(place_id, [place_id]) for place_id in children[None]]
+    while stack:
+        place_id, path = stack.pop()
+        links += [
+            PlaceClosure(ancestor_id=ancestor_id, descendant_id=place_id, depth=len(path) - index - 1)
+            for index, ancestor_id in enumerate(path)
+        ]
+        stack += [(child_id, path + [child_id]) for child_id in children[place_id]]
+    PlaceClosure.objects.using(db_alias).bulk_create(links, batch_size=5000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_position_alter_activitylog_options_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlaceClosure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveIntegerField(default=0)),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_links', to='core.place')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_links', to='core.place')),
+            ],
+            options={
+                'verbose_name': 'Жой иерархияси',
+                'verbose_name_plural': 'Жой иерархияси',
+                'indexes': [models.Index(fields=['descendant', 'depth'], name='core_placec_descend_53cbf9_idx')],
+                'constraints': [models.UniqueConstraint(fields=('ancestor', 'descendant'), name='core_placeclosure_unique_link')],
+            },
+        ),
+        migrations.RunPython(build_place_closure, migrations.RunPython.noop),
+    ]
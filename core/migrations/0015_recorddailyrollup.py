@@ -0,0 +1,67 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:11
+
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Case, Count, F, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+
+def build_record_rollup(apps, schema_editor):
+    Record = apps.get_model('core', 'Record')
+    RecordDailyRollup = apps.get_model('core', 'RecordDailyRollup')
+    db_alias = schema_editor.connection.alias
+
+    signed_amount = Case(
+        When(category__operation_type='expense', then=-F('amount')),
+        default=F('amount'),
+    )
+    rows = Record.objects.using(db_alias).order_by().values('place_id', 'category_id', 'date').annotate(
+        total_amount=Coalesce(Sum(signed_amount), Value(Decimal(0))),
+        total_quantity=Coalesce(Sum('quantity'), Value(Decimal(0))),
+        total_count=Count('id'),
+    )
+    RecordDailyRollup.objects.using(db_alias).bulk_create(
+        (
+            RecordDailyRollup(
+                place_id=row['place_id'],
+                category_id=row['category_id'],
+                date=row['date'],
+                amount=row['total_amount'],
+                quantity=row['total_quantity'],
+                record_count=row['total_count'],
+            )
+            for row in rows.iterator(chunk_size=5000)
+        ),
+        batch_size=5000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_placeclosure'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecordDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(blank=True, null=True)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=18)),
+                ('quantity', models.DecimalField(decimal_places=2, default=0, max_digits=18)),
+                ('record_count', models.IntegerField(default=0)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_rollups', to='core.category')),
+                ('place', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='daily_rollups', to='core.place')),
+            ],
+            options={
+                'verbose_name': 'Кунлик жамланма',
+                'verbose_name_plural': 'Кунлик жамланмалар',
+                'indexes': [models.Index(fields=['place', 'date'], name='core_record_place_i_21d539_idx')],
+                'constraints': [models.UniqueConstraint(fields=('place', 'category', 'date'), name='core_recorddailyrollup_unique_day')],
+            },
+        ),
+        migrations.RunPython(build_record_rollup, migrations.RunPython.noop),
+    ]
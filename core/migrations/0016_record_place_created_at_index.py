@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_recorddailyrollup'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='record',
+            index=models.Index(fields=['place', 'created_at', 'id'], name='core_record_place_i_e27fa6_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:27
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_activitylog_timestamp'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('place_import', 'Place import'), ('record_import', 'Record import'), ('record_export_csv', 'Record export (CSV)'), ('record_export_xlsx', 'Record export (XLSX)'), ('report_hierarchically_xlsx', 'Hierarchical report (XLSX)')], max_length=50)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('succeeded', 'Succeeded'), ('failed', 'Failed'), ('cancelled', 'Cancelled')], default='pending', max_length=20)),
+                ('params', models.JSONField(blank=True, default=dict)),
+                ('input_file', models.FileField(blank=True, null=True, upload_to='jobs/input')),
+                ('result_file', models.FileField(blank=True, null=True, upload_to='jobs/results')),
+                ('result', models.JSONField(blank=True, null=True)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('progress', models.PositiveIntegerField(default=0)),
+                ('total', models.PositiveIntegerField(blank=True, null=True)),
+                ('cancel_requested', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Вазифа',
+                'verbose_name_plural': 'Вазифалар',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'created_at'], name='core_job_status_38dcf0_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:34
+
+from decimal import Decimal
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+
+def build_place_balances(apps, schema_editor):
+    Record = apps.get_model('core', 'Record')
+    PlaceBalance = apps.get_model('core', 'PlaceBalance')
+    db_alias = schema_editor.connection.alias
+
+    zero = Value(Decimal(0))
+    expense = Q(category__operation_type='expense')
+    rows = Record.objects.using(db_alias).filter(place__isnull=False).order_by().values('place_id').annotate(
+        total_income=Coalesce(Sum('amount', filter=~expense), zero),
+        total_expense=Coalesce(Sum('amount', filter=expense), zero),
+        total_count=Count('id'),
+    )
+    now = timezone.now()
+    PlaceBalance.objects.using(db_alias).bulk_create(
+        (
+            PlaceBalance(
+                place_id=row['place_id'],
+                income=row['total_income'],
+                expense=row['total_expense'],
+                net=row['total_income'] - row['total_expense'],
+                record_count=row['total_count'],
+                updated_at=now,
+            )
+            for row in rows.iterator()
+        ),
+        batch_size=5000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlaceBalance',
+            fields=[
+                ('place', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='balance', serialize=False, to='core.place')),
+                ('income', models.DecimalField(decimal_places=2, default=0, max_digits=18)),
+                ('expense', models.DecimalField(decimal_places=2, default=0, max_digits=18)),
+                ('net', models.DecimalField(decimal_places=2, default=0, max_digits=18)),
+                ('record_count', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Баланс',
+                'verbose_name_plural': 'Баланслар',
+            },
+        ),
+        migrations.RunPython(build_place_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,144 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:37
+
+from collections import defaultdict
+from decimal import Decimal
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F
+from django.utils import timezone
+
+TABLE = 'core_record'
+
+
+def fill_record_dates(apps, schema_editor):
+    """Records without a date get the day they were created on, their rollup rows move along"""
+    Record = apps.get_model('core', 'Record')
+    RecordDailyRollup = apps.get_model('core', 'RecordDailyRollup')
+    db_alias = schema_editor.connection.alias
+
+    totals = defaultdict(lambda: [Decimal(0), Decimal(0), 0])
+    records = Record.objects.using(db_alias).filter(date__isnull=True).select_related('category')
+    for record in records.iterator():
+        record.date = timezone.localdate(record.created_at)
+        Record.objects.using(db_alias).filter(pk=record.pk).update(date=record.date)
+
+        row = totals[(record.place_id, record.category_id, record.date)]
+        row[0] += -record.amount if record.category.operation_type == 'expense' else record.amount
+        row[1] += record.quantity or 0
+        row[2] += 1
+
+    if not totals:
+        return
+    RecordDailyRollup.objects.using(db_alias).filter(date__isnull=True).delete()
+    for (place_id, category_id, date), (amount, quantity, count) in totals.items():
+        updated = RecordDailyRollup.objects.using(db_alias).filter(
+            place_id=place_id, category_id=category_id, date=date
+        ).update(amount=F('amount') + amount, quantity=F('quantity') + quantity, record_count=F('record_count') + count)
+        if not updated:
+            RecordDailyRollup.objects.using(db_alias).create(
+                place_id=place_id, category_id=category_id, date=date,
+                amount=amount, quantity=quantity, record_count=count,
+            )
+
+
+def _indexes_and_foreign_keys(cursor, table):
+    """Statements that create the indexes (but the primary key) and foreign keys of the table again"""
+    cursor.execute(
+        'SELECT pg_get_indexdef(indexrelid) FROM pg_index WHERE indrelid = %s::regclass AND NOT indisprimary',
+        [table]
+    )
+    # Indexes of a partitioned table are defined ON ONLY the table itself
+    statements = [definition.replace(' ON ONLY ', ' ON ') for definition, in cursor.fetchall()]
+    cursor.execute(
+        "SELECT quote_ident(conname), pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'",
+        [table]
+    )
+    statements += [
+        f'ALTER TABLE {TABLE} ADD CONSTRAINT {name} {definition}' for name, definition in cursor.fetchall()
+    ]
+    return statements
+
+
+def _replace_table(cursor, partition_by, primary_key):
+    """
+    Copy core_record into a new table with the same columns, indexes and foreign keys,
+    either partitioned (partition_by is a callable that creates the partitions) or not
+    """
+    statements = _indexes_and_foreign_keys(cursor, TABLE)
+    cursor.execute(f'ALTER TABLE {TABLE} RENAME TO {TABLE}_old')
+    # The id sequence has to outlive the old table
+    cursor.execute(f'ALTER SEQUENCE IF EXISTS {TABLE}_id_seq OWNED BY NONE')
+    cursor.execute(
+        f'CREATE TABLE {TABLE} (LIKE {TABLE}_old INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'
+        + (' PARTITION BY RANGE (date)' if partition_by else '')
+    )
+    if partition_by:
+        partition_by(cursor)
+    cursor.execute(f'INSERT INTO {TABLE} SELECT * FROM {TABLE}_old')
+    cursor.execute(f'DROP TABLE {TABLE}_old')
+
+    cursor.execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_pkey PRIMARY KEY ({primary_key})')
+    for statement in statements:
+        cursor.execute(statement)
+
+    cursor.execute(f'CREATE SEQUENCE IF NOT EXISTS {TABLE}_id_seq')
+    cursor.execute(f'ALTER SEQUENCE {TABLE}_id_seq OWNED BY {TABLE}.id')
+    cursor.execute(f"ALTER TABLE {TABLE} ALTER COLUMN id SET DEFAULT nextval('{TABLE}_id_seq')")
+    cursor.execute(f"SELECT setval('{TABLE}_id_seq', COALESCE((SELECT MAX(id) FROM {TABLE}), 0) + 1, false)")
+
+
+def _create_partitions(cursor):
+    """A partition per year that has records, this year and next year, and the default partition"""
+    cursor.execute(f'SELECT DISTINCT EXTRACT(YEAR FROM date)::integer FROM {TABLE}_old')
+    this_year = timezone.localdate().year
+    for year in sorted({year for year, in cursor.fetchall()} | {this_year, this_year + 1}):
+        cursor.execute(
+            f'CREATE TABLE {TABLE}_y{year} PARTITION OF {TABLE} '
+            f"FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')"
+        )
+    cursor.execute(f'CREATE TABLE {TABLE}_default PARTITION OF {TABLE} DEFAULT')
+
+
+def partition_records(apps, schema_editor):
+    """
+    Range partition core_record by year on PostgreSQL. The primary key of a partitioned
+    table has to include the partition key, so it becomes (id, date); ids still come
+    from a single sequence. Identity columns are not supported on partitioned tables
+    before PostgreSQL 17, hence the plain sequence.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        # The old identity column would take its sequence along with the table
+        cursor.execute(f'ALTER TABLE {TABLE} ALTER COLUMN id DROP IDENTITY IF EXISTS')
+        cursor.execute(f'CREATE SEQUENCE IF NOT EXISTS {TABLE}_id_seq')
+        _replace_table(cursor, _create_partitions, 'id, date')
+
+
+def unpartition_records(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        _replace_table(cursor, None, 'id')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_placebalance'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_record_dates, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='record',
+            name='date',
+            field=models.DateField(default=django.utils.timezone.localdate, verbose_name='Вакти'),
+        ),
+        migrations.AddIndex(
+            model_name='record',
+            index=models.Index(fields=['place', 'date'], include=('category', 'amount', 'quantity'), name='core_record_place_date_idx'),
+        ),
+        migrations.RunPython(partition_records, unpartition_records),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:42
+
+import datetime
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Min
+from django.utils import timezone
+
+
+def fill_calendar(apps, schema_editor):
+    """Days from the first record to the end of next year, later days are added by the fill_calendar command"""
+    Record = apps.get_model('core', 'Record')
+    CalendarDay = apps.get_model('core', 'CalendarDay')
+    db_alias = schema_editor.connection.alias
+
+    today = timezone.localdate()
+    start = min(Record.objects.using(db_alias).aggregate(first=Min('date'))['first'] or today, today)
+    end = datetime.date(today.year + 1, 12, 31)
+    days = (start + datetime.timedelta(days=offset) for offset in range((end - start).days + 1))
+    CalendarDay.objects.using(db_alias).bulk_create(
+        (
+            CalendarDay(
+                date=day,
+                week=day - datetime.timedelta(days=day.weekday()),
+                month=day.replace(day=1),
+                quarter=day.replace(month=(day.month - 1) // 3 * 3 + 1, day=1),
+                year=day.replace(month=1, day=1),
+            )
+            for day in days
+        ),
+        batch_size=5000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_record_date_partitioning'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CalendarDay',
+            fields=[
+                ('date', models.DateField(primary_key=True, serialize=False)),
+                ('week', models.DateField()),
+                ('month', models.DateField()),
+                ('quarter', models.DateField()),
+                ('year', models.DateField()),
+            ],
+            options={
+                'verbose_name': 'Тақвим куни',
+                'verbose_name_plural': 'Тақвим кунлари',
+            },
+        ),
+        migrations.AddField(
+            model_name='recorddailyrollup',
+            name='calendar',
+            field=models.ForeignObject(from_fields=['date'], null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='core.calendarday', to_fields=['date']),
+        ),
+        migrations.RunPython(fill_calendar, migrations.RunPython.noop),
+    ]
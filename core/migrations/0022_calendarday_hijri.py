@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:58
+
+from django.db import migrations, models
+
+from core import hijri
+
+
+def fill_hijri(apps, schema_editor):
+    CalendarDay = apps.get_model('core', 'CalendarDay')
+    db_alias = schema_editor.connection.alias
+
+    days = list(CalendarDay.objects.using(db_alias).order_by('date'))
+    for day in days:
+        day.hijri_month = hijri.month_start(day.date)
+        day.hijri_year = hijri.year_start(day.date)
+    CalendarDay.objects.using(db_alias).bulk_update(days, ['hijri_month', 'hijri_year'], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0021_calendarday'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='calendarday',
+            name='hijri_month',
+            field=models.DateField(null=True),
+        ),
+        migrations.AddField(
+            model_name='calendarday',
+            name='hijri_year',
+            field=models.DateField(null=True),
+        ),
+        migrations.RunPython(fill_hijri, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='calendarday',
+            name='hijri_month',
+            field=models.DateField(),
+        ),
+        migrations.AlterField(
+            model_name='calendarday',
+            name='hijri_year',
+            field=models.DateField(),
+        ),
+    ]
@@ -1,5 +1,7 @@
-from django.contrib.sitemaps.views import index
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import models, transaction, IntegrityError, connections
+from django.db.models import Exists, OuterRef, F, Q, Sum, Case, When, Count, Value
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import (
     AbstractBaseUser,
     BaseUserManager,
@@ -7,6 +9,12 @@ from django.contrib.auth.models import (
 )
 from django.utils import timezone
 
+from core import hijri
+from core.audit import audit_log
+from collections import defaultdict
+import datetime
+from decimal import Decimal
+
 class UserManager(BaseUserManager):
     """Manager for users."""
 
@@ -78,7 +86,7 @@ class ActivityLog(models.Model):
     ]
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
     action = models.CharField(max_length=20, choices=ACTION_CHOICES)
-    timestamp = models.DateTimeField(auto_now_add=True)  # Automatically set the timestamp when the log is created
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)  # Set when the activity happens, entries may be written later
     object_id = models.PositiveIntegerField(null=True, blank=True)  # ID of the affected object, if applicable
     object_type = models.CharField(max_length=100, null=True, blank=True)  # The model name or type of the affected object
     description = models.TextField(null=True, blank=True)  # Optional details about the activity
@@ -127,7 +135,7 @@ class AuditableModel(models.Model):
 
         super().save(*args, **kwargs)
         # Log the action
-        ActivityLog.objects.create(
+        audit_log.log(
             user=user,  # Pass request from view
             action=action,
             object_id=self.pk,
@@ -145,7 +153,7 @@ class AuditableModel(models.Model):
             user = request.user
             remote_addr = request.META.get('REMOTE_ADDR')
         # Log the delete action
-        ActivityLog.objects.create(
+        audit_log.log(
             user=user,  # Pass request from view
             action='delete',
             object_id=self.pk,
@@ -197,6 +205,82 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_operation_type = instance.__dict__.get('operation_type')
+        return instance
+
+    def save(self, *args, **kwargs):
+        kwargs.pop('request', None)
+        loaded_operation_type = None
+        if not self._state.adding:
+            loaded_operation_type = getattr(self, '_loaded_operation_type', None) or \
+                Category.objects.filter(pk=self.pk).values_list('operation_type', flat=True).first()
+
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+            if loaded_operation_type and loaded_operation_type != self.operation_type:
+                # Rollups keep signed amounts, switching income/expense flips them
+                RecordDailyRollup.objects.filter(category_id=self.pk).update(amount=-F('amount'))
+                # and moves the amounts between income and expense of the balances
+                PlaceBalance.objects.rebuild(
+                    Record.objects.filter(category_id=self.pk, place__isnull=False).values('place_id')
+                )
+
+        self._loaded_operation_type = self.operation_type
+
+class PlaceManager(models.Manager):
+    """Hierarchy lookups backed by the PlaceClosure index."""
+
+    def descendants_of(self, place_id, include_self=True):
+        """All places under place_id (the place itself included by default)."""
+        return self.filter(
+            ancestor_links__ancestor_id=place_id,
+            ancestor_links__depth__gte=0 if include_self else 1,
+        )
+
+    def with_profit(self, start=None, end=None):
+        """
+        Places annotated with income, expense and net of their whole subtree,
+        optionally within a date range, aggregated from RecordDailyRollup.
+        """
+        rollup = 'descendant_links__descendant__daily_rollups'
+        in_range = Q()
+        if start is not None:
+            in_range &= Q(**{f'{rollup}__date__gte': start})
+        if end is not None:
+            in_range &= Q(**{f'{rollup}__date__lte': end})
+        is_expense = Q(**{f'{rollup}__category__operation_type': Category.OperationType.EXPENSE})
+        zero = Value(Decimal(0))
+
+        return self.annotate(
+            income=Coalesce(Sum(f'{rollup}__amount', filter=in_range & ~is_expense), zero),
+            # Expense rollups are negative
+            expense=Coalesce(-Sum(f'{rollup}__amount', filter=in_range & is_expense), zero),
+        ).annotate(net=F('income') - F('expense'))
+
+    def descendant_ids(self, place_id, include_self=True):
+        return self.descendants_of(place_id, include_self).values_list('id', flat=True)
+
+    def leaves_of(self, place_id):
+        """Places under place_id that have no children of their own."""
+        return self.descendants_of(place_id).filter(
+            ~Exists(self.model.objects.filter(parent_id=OuterRef('pk')))
+        )
+
+    def ancestors_of(self, place_id, include_self=True):
+        """All places above place_id, nearest first."""
+        return self.filter(
+            descendant_links__descendant_id=place_id,
+            descendant_links__depth__gte=0 if include_self else 1,
+        ).order_by('descendant_links__depth')
+
+    def is_descendant(self, place_id, ancestor_id):
+        """Is place_id equal to or located under ancestor_id."""
+        return PlaceClosure.objects.filter(ancestor_id=ancestor_id, descendant_id=place_id).exists()
+
+
 class Place(AuditableModel):
     class Meta:
         verbose_name = 'Жой'
@@ -211,24 +295,695 @@ class Place(AuditableModel):
     is_mosque = models.BooleanField(null=False, default=False, verbose_name="Масжид")
     employee_count = models.IntegerField(null=False, default=0, verbose_name="Ишчилар сони")
 
+    objects = PlaceManager()
+
     def __str__(self):
         return f"{self.name}, ({ self.inn or 'No Inn' })"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored parent so save() can tell a re-parent from a plain update
+        instance._loaded_parent_id = instance.__dict__.get('parent_id', models.DEFERRED)
+        return instance
+
+    def clean(self):
+        super().clean()
+        if self.pk is not None and self.parent_id is not None \
+                and PlaceClosure.objects.filter(ancestor_id=self.pk, descendant_id=self.parent_id).exists():
+            raise ValidationError({'parent': 'Place can not be moved under itself or its descendants.'})
+
+    def save(self, *args, **kwargs):
+        is_new = self.pk is None
+        loaded_parent_id = getattr(self, '_loaded_parent_id', models.DEFERRED)
+        parent_changed = 'parent_id' in self.__dict__ and loaded_parent_id != self.parent_id
+
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+            if is_new:
+                PlaceClosure.objects.attach(self)
+            elif parent_changed:
+                PlaceClosure.objects.move(self)
+
+        self._loaded_parent_id = self.parent_id
+
+
+class PlaceClosureManager(models.Manager):
+    def attach(self, place):
+        """Index a freshly created leaf place under its parent."""
+        self.attach_many([place])
+
+    def attach_many(self, places):
+        """
+        Index freshly created places, e.g. after Place.objects.bulk_create().
+        Parents must either be indexed already or come earlier in `places`.
+        """
+        places = list(places)
+        created_ids = {place.pk for place in places}
+        parent_ids = {place.parent_id for place in places if place.parent_id and place.parent_id not in created_ids}
+
+        ancestors = defaultdict(list)
+        for ancestor_id, descendant_id, depth in self.filter(descendant_id__in=parent_ids) \
+                .values_list('ancestor_id', 'descendant_id', 'depth'):
+            ancestors[descendant_id].append((ancestor_id, depth))
+
+        links = []
+        for place in places:
+            chain = [(place.pk, 0)]
+            if place.parent_id is not None:
+                chain += [(ancestor_id, depth + 1) for ancestor_id, depth in ancestors[place.parent_id]]
+            ancestors[place.pk] = chain
+            links += [
+                self.model(ancestor_id=ancestor_id, descendant_id=place.pk, depth=depth)
+                for ancestor_id, depth in chain
+            ]
+        self.bulk_create(links, ignore_conflicts=True)
+
+    def move(self, place):
+        """Re-index the subtree of `place` after its parent has changed."""
+        subtree = list(self.filter(ancestor_id=place.pk).values_list('descendant_id', 'depth'))
+        if not subtree:
+            subtree = [(place.pk, 0)]
+            self.create(ancestor_id=place.pk, descendant_id=place.pk, depth=0)
+        subtree_ids = [descendant_id for descendant_id, _ in subtree]
+
+        if place.parent_id in subtree_ids:
+            raise ValueError('Place can not be moved under itself or its descendants.')
+
+        # Cut the subtree from its old ancestors...
+        self.filter(descendant_id__in=subtree_ids).exclude(ancestor_id__in=subtree_ids).delete()
+
+        if place.parent_id is None:
+            return
+
+        # ...and hang it under every ancestor of the new parent
+        new_ancestors = self.filter(descendant_id=place.parent_id).values_list('ancestor_id', 'depth')
+        self.bulk_create([
+            self.model(ancestor_id=ancestor_id, descendant_id=descendant_id, depth=ancestor_depth + depth + 1)
+            for ancestor_id, ancestor_depth in new_ancestors
+            for descendant_id, depth in subtree
+        ])
+
+    def rebuild(self):
+        """Recompute the whole index from Place.parent."""
+        children = defaultdict(list)
+        for place_id, parent_id in Place.objects.values_list('id', 'parent_id'):
+            children[parent_id].append(place_id)
+
+        self.all().delete()
+        links = []
+        stack = [(place_id, [place_id]) for place_id in children[None]]
+        while stack:
+            place_id, path = stack.pop()
+            links += [
+                self.model(ancestor_id=ancestor_id, descendant_id=place_id, depth=len(path) - position - 1)
+                for position, ancestor_id in enumerate(path)
+            ]
+            stack += [(child_id, path + [child_id]) for child_id in children[place_id]]
+        self.bulk_create(links, batch_size=5000)
+
+
+class PlaceClosure(models.Model):
+    """
+    Ancestor/descendant pairs of the Place tree (every place is also linked to itself with depth 0).
+    Kept in sync by Place.save(); rows go away with the place through the cascade.
+    """
+    class Meta:
+        verbose_name = 'Жой иерархияси'
+        verbose_name_plural = "Жой иерархияси"
+        constraints = [
+            models.UniqueConstraint(fields=['ancestor', 'descendant'], name='core_placeclosure_unique_link')
+        ]
+        indexes = [
+            models.Index(fields=['descendant', 'depth'])
+        ]
+
+    ancestor = models.ForeignKey(Place, on_delete=models.CASCADE, related_name='descendant_links')
+    descendant = models.ForeignKey(Place, on_delete=models.CASCADE, related_name='ancestor_links')
+    depth = models.PositiveIntegerField(default=0)
+
+    objects = PlaceClosureManager()
+
+    def __str__(self):
+        return f"{self.ancestor_id} -> {self.descendant_id} ({self.depth})"
+
 class Record(AuditableModel):
     class Meta:
         verbose_name = 'Кирим/Чиким'
         verbose_name_plural = "Киримлар/Чикимлар"
         ordering = ['-created_at']
+        indexes = [
+            # Keyset pagination of a place's records
+            models.Index(fields=['place', 'created_at', 'id']),
+            # Date ranges of a place's records (exports, reports); the other columns
+            # are included for index-only scans on PostgreSQL
+            models.Index(
+                fields=['place', 'date'], include=['category', 'amount', 'quantity'],
+                name='core_record_place_date_idx'
+            ),
+        ]
 
     """Main document for accounting expenses and incomes"""
-    date = models.DateField(null=True, blank=True, default=timezone.now(), verbose_name="Вакти")
+    # Not nullable: on PostgreSQL the table is range partitioned by date, see migration 0020
+    date = models.DateField(default=timezone.localdate, verbose_name="Вакти")
     category = models.ForeignKey(Category, on_delete=models.CASCADE, verbose_name="Категория", db_index=True)
     amount = models.DecimalField(max_digits=10, decimal_places=2, null=False, default=0, verbose_name="Сумма")
     quantity = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, verbose_name="Микдор")
     description = models.CharField(max_length=500, null=True, blank=True, verbose_name="Изох")
     place = models.ForeignKey(Place, on_delete=models.CASCADE, null=True, blank=True, verbose_name="Жой", db_index=True)
 
+    # Fields that the daily rollup depends on
+    ROLLUP_FIELDS = ('place_id', 'category_id', 'date', 'amount', 'quantity')
+
     def __str__(self):
         return f"{self.place}, {self.category}, {self.amount}, {self.description}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = instance.rollup_values()
+        return instance
+
+    def rollup_values(self):
+        if any(field not in self.__dict__ for field in self.ROLLUP_FIELDS):
+            return None
+        return {field: self.__dict__[field] for field in self.ROLLUP_FIELDS}
+
+    def save(self, *args, **kwargs):
+        previous = None
+        if not self._state.adding:
+            previous = getattr(self, '_loaded_values', None) or \
+                Record.objects.filter(pk=self.pk).values(*self.ROLLUP_FIELDS).first()
+
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+            if previous != self.rollup_values():
+                RecordDailyRollup.objects.apply_records(added=[self], removed=[previous] if previous else [])
+
+        self._loaded_values = self.rollup_values()
+
+
+class RecordDailyRollupManager(models.Manager):
+    def signed_amount(self, prefix=''):
+        """Record amount with the sign of its category: income is positive, expense negative."""
+        return Case(
+            When(**{f'{prefix}category__operation_type': Category.OperationType.EXPENSE}, then=-F(f'{prefix}amount')),
+            default=F(f'{prefix}amount'),
+        )
+
+    def category_period_totals(self, period, **filters):
+        """
+        Amounts of the filtered rollup per (category name, period), per category, per period
+        and in total, from a single query: GROUPING SETS on PostgreSQL, UNION ALL elsewhere.
+        period is the expression of 'date' to group by, e.g. F('calendar__month').
+        Returns (cells, category_totals, period_totals, total), periods as dates.
+        """
+        detail = self.filter(**filters).annotate(
+            category_name=F('category__name'), period=period, value=F('amount')
+        ).values('category_name', 'period', 'value')
+        detail_sql, detail_params = detail.query.sql_with_params()
+
+        connection = connections[self.db]
+        if connection.vendor == 'postgresql':
+            sql = (
+                f'SELECT category_name, period, SUM(value), GROUPING(category_name, period) FROM ({detail_sql}) detail '
+                'GROUP BY GROUPING SETS ((category_name, period), (category_name), (period), ())'
+            )
+            params = detail_params
+        else:
+            # Same rows and GROUPING() values as the query above
+            sql = ' UNION ALL '.join(
+                f'SELECT {columns}, SUM(value), {grouping} FROM ({detail_sql}) detail{group_by}'
+                for columns, grouping, group_by in (
+                    ('category_name, period', 0, ' GROUP BY category_name, period'),
+                    ('category_name, NULL', 1, ' GROUP BY category_name'),
+                    ('NULL, period', 2, ' GROUP BY period'),
+                    ('NULL, NULL', 3, ''),
+                )
+            )
+            params = detail_params * 4
+
+        cells, category_totals, period_totals, total = {}, {}, {}, Decimal(0)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            for category_name, period_value, amount, grouping in cursor.fetchall():
+                amount = _to_decimal(amount or 0)
+                if isinstance(period_value, str):
+                    # Raw rows skip the ORM converters, SQLite returns dates as text
+                    period_value = datetime.date.fromisoformat(period_value[:10])
+                elif isinstance(period_value, datetime.datetime):
+                    period_value = period_value.date()
+
+                if grouping == 0:
+                    cells[(category_name, period_value)] = amount
+                elif grouping == 1:
+                    category_totals[category_name] = amount
+                elif grouping == 2:
+                    period_totals[period_value] = amount
+                else:
+                    total = amount
+        return cells, category_totals, period_totals, total
+
+    def apply_records(self, added=(), removed=()):
+        """
+        Add and/or subtract records from the rollup.
+        Items are Record instances or dicts with Record.ROLLUP_FIELDS.
+        """
+        added = [self._rollup_values(record) for record in added]
+        removed = [self._rollup_values(record) for record in removed]
+        signs = self._category_signs(added + removed)
+
+        deltas = defaultdict(lambda: [Decimal(0), Decimal(0), 0])
+        for sign, values_list in ((1, added), (-1, removed)):
+            for values in values_list:
+                delta = deltas[(values['place_id'], values['category_id'], values['date'])]
+                delta[0] += sign * signs.get(values['category_id'], 1) * _to_decimal(values['amount'])
+                delta[1] += sign * _to_decimal(values['quantity'])
+                delta[2] += sign
+
+        deltas = {key: delta for key, delta in deltas.items() if any(delta)}
+        _apply_row_deltas(self, ('place_id', 'category_id', 'date'), {
+            key: dict(amount=amount, quantity=quantity, record_count=count)
+            for key, (amount, quantity, count) in deltas.items()
+        })
+        if any(count < 0 for _, _, count in deltas.values()):
+            self.filter(_key_filter(('place_id', 'category_id', 'date'), deltas), record_count__lte=0).delete()
+
+        balances = defaultdict(lambda: [Decimal(0), Decimal(0), 0])
+        for (place_id, category_id, date), (amount, quantity, count) in deltas.items():
+            if place_id is not None:
+                balance = balances[place_id]
+                if signs.get(category_id, 1) < 0:
+                    balance[1] -= amount
+                else:
+                    balance[0] += amount
+                balance[2] += count
+
+        PlaceBalance.objects.apply_deltas(balances)
+
+    def rollup_rows(self, records):
+        """Aggregate a Record queryset into unsaved rollup rows."""
+        rows = records.order_by().values('place_id', 'category_id', 'date').annotate(
+            total_amount=Coalesce(Sum(self.signed_amount()), Value(Decimal(0))),
+            total_quantity=Coalesce(Sum('quantity'), Value(Decimal(0))),
+            total_count=Count('id'),
+        )
+        for row in rows:
+            yield self.model(
+                place_id=row['place_id'],
+                category_id=row['category_id'],
+                date=row['date'],
+                amount=row['total_amount'],
+                quantity=row['total_quantity'],
+                record_count=row['total_count'],
+            )
+
+    @staticmethod
+    def _rollup_values(record):
+        if isinstance(record, dict):
+            values = dict(record)
+        else:
+            values = record.rollup_values()
+            if Record.category.is_cached(record):
+                values['operation_type'] = record.category.operation_type
+        values['date'] = Record._meta.get_field('date').to_python(values['date'])
+        return values
+
+    @staticmethod
+    def _category_signs(values_list):
+        operation_types = {values['category_id']: values.get('operation_type') for values in values_list}
+        missing = [category_id for category_id, operation_type in operation_types.items() if operation_type is None]
+        if missing:
+            operation_types.update(Category.objects.filter(pk__in=missing).values_list('id', 'operation_type'))
+        return {
+            category_id: -1 if operation_type == Category.OperationType.EXPENSE else 1
+            for category_id, operation_type in operation_types.items()
+        }
+
+
+def _key_filter(key_fields, keys):
+    """Q matching the rows of the keys (tuples of the key_fields values), and possibly a few more"""
+    condition = Q()
+    for position, field in enumerate(key_fields):
+        values = {key[position] for key in keys}
+        field_condition = Q(**{f'{field}__in': values - {None}})
+        if None in values:
+            field_condition |= Q(**{f'{field}__isnull': True})
+        condition &= field_condition
+    return condition
+
+
+def _apply_row_deltas(manager, key_fields, deltas, assign=None):
+    """
+    Add deltas ({key: {field: delta}}, key a tuple of the key_fields values) to the rows
+    of the manager's model and set the assign values on them. Missing rows are created
+    for positive record counts, negative ones have nothing to take the records away from
+    (e.g. the place is being deleted). A few statements for any number of keys:
+    INSERT ... ON CONFLICT and UPDATE ... FROM VALUES on PostgreSQL, SELECT FOR UPDATE,
+    bulk_update and bulk_create elsewhere.
+    """
+    if not deltas:
+        return
+    assign = assign or {}
+
+    connection = connections[manager.db]
+    if connection.vendor == 'postgresql':
+        # NULLs are not covered by the unique constraint, ON CONFLICT cannot find those rows
+        _pg_apply_row_deltas(
+            manager.model, connection, key_fields,
+            {key: delta for key, delta in deltas.items() if None not in key}, assign
+        )
+        deltas = {key: delta for key, delta in deltas.items() if None in key}
+        if not deltas:
+            return
+
+    with transaction.atomic(using=manager.db, savepoint=False):
+        rows = {}
+        for row in manager.select_for_update().filter(_key_filter(key_fields, deltas)):
+            # Keys with a NULL can have several rows, the first one takes the delta
+            rows.setdefault(tuple(getattr(row, field) for field in key_fields), row)
+
+        updated, created = [], {}
+        for key, delta in deltas.items():
+            row = rows.get(key)
+            if row is None:
+                if delta['record_count'] > 0:
+                    created[key] = manager.model(**dict(zip(key_fields, key)), **delta, **assign)
+                continue
+            for field, value in delta.items():
+                setattr(row, field, getattr(row, field) + value)
+            for field, value in assign.items():
+                setattr(row, field, value)
+            updated.append(row)
+
+        if updated:
+            manager.bulk_update(updated, [*next(iter(deltas.values())), *assign])
+        if created:
+            try:
+                with transaction.atomic(using=manager.db):
+                    manager.bulk_create(created.values())
+            except IntegrityError:
+                # A concurrent transaction created some of them since the SELECT, they can be locked now
+                _apply_row_deltas(manager, key_fields, {key: deltas[key] for key in created}, assign)
+
+
+def _pg_apply_row_deltas(model, connection, key_fields, deltas, assign, batch_size=1000):
+    if not deltas:
+        return
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+
+    def columns(fields):
+        return [quote(model._meta.get_field(field).column) for field in fields]
+
+    key_columns = columns(key_fields)
+    delta_columns = columns(next(iter(deltas.values())))
+    assign_columns = columns(assign)
+    all_columns = ', '.join(key_columns + delta_columns + assign_columns)
+
+    def changes(source):
+        return ', '.join(
+            [f'{column} = {table}.{column} + {source}.{column}' for column in delta_columns]
+            + [f'{column} = {source}.{column}' for column in assign_columns]
+        )
+
+    # Only rows of positive record counts get created, see _apply_row_deltas
+    inserts, updates = [], []
+    for key, delta in deltas.items():
+        (inserts if delta['record_count'] > 0 else updates).append([*key, *delta.values(), *assign.values()])
+
+    with connection.cursor() as cursor:
+        for rows, sql in (
+            (inserts, (
+                f'INSERT INTO {table} ({all_columns}) VALUES {{values}} '
+                f'ON CONFLICT ({", ".join(key_columns)}) DO UPDATE SET {changes("EXCLUDED")}'
+            )),
+            (updates, (
+                f'UPDATE {table} SET {changes("delta")} FROM (VALUES {{values}}) AS delta ({all_columns}) '
+                f'WHERE {" AND ".join(f"{table}.{column} = delta.{column}" for column in key_columns)}'
+            )),
+        ):
+            for start in range(0, len(rows), batch_size):
+                batch = rows[start:start + batch_size]
+                placeholders = '(' + ', '.join(['%s'] * len(batch[0])) + ')'
+                cursor.execute(
+                    sql.format(values=', '.join([placeholders] * len(batch))),
+                    [value for row in batch for value in row]
+                )
+
+
+def _to_decimal(value):
+    if value is None:
+        return Decimal(0)
+    if isinstance(value, Decimal):
+        return value
+    return Decimal(str(value))
+
+
+class RecordDailyRollup(models.Model):
+    """
+    Signed daily totals of Record per place and category (income positive, expense negative).
+    Maintained by Record.save() and the Record post_delete signal, see `rollup_records` command.
+    Every change to it is also applied to PlaceBalance.
+    """
+    class Meta:
+        verbose_name = 'Кунлик жамланма'
+        verbose_name_plural = "Кунлик жамланмалар"
+        constraints = [
+            models.UniqueConstraint(fields=['place', 'category', 'date'], name='core_recorddailyrollup_unique_day')
+        ]
+        indexes = [
+            models.Index(fields=['place', 'date'])
+        ]
+
+    place = models.ForeignKey(Place, on_delete=models.CASCADE, null=True, blank=True, related_name='daily_rollups')
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='daily_rollups')
+    date = models.DateField(null=True, blank=True)
+    amount = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    quantity = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    record_count = models.IntegerField(default=0)
+    # Join to the calendar dimension on date, there is no column of its own
+    calendar = models.ForeignObject(
+        'CalendarDay', on_delete=models.DO_NOTHING, from_fields=['date'], to_fields=['date'], null=True, related_name='+'
+    )
+
+    objects = RecordDailyRollupManager()
+
+    def __str__(self):
+        return f"{self.place_id}, {self.category_id}, {self.date}: {self.amount}"
+
+
+
+
+class PlaceBalanceManager(models.Manager):
+    def apply_deltas(self, deltas):
+        """deltas: {place_id: (income, expense, record count)} to add to the balances"""
+        _apply_row_deltas(self, ('place_id',), {
+            (place_id,): dict(income=income, expense=expense, net=income - expense, record_count=count)
+            for place_id, (income, expense, count) in deltas.items()
+            if income or expense or count
+        }, assign=dict(updated_at=timezone.now()))
+
+    def balance_rows(self, records):
+        """Aggregate a Record queryset into unsaved balance rows, one per place."""
+        zero = Value(Decimal(0))
+        rows = records.filter(place__isnull=False).order_by().values('place_id').annotate(
+            total_income=Coalesce(Sum('amount', filter=~Q(category__operation_type=Category.OperationType.EXPENSE)), zero),
+            total_expense=Coalesce(Sum('amount', filter=Q(category__operation_type=Category.OperationType.EXPENSE)), zero),
+            total_count=Count('id'),
+        )
+        now = timezone.now()
+        for row in rows:
+            yield self.model(
+                place_id=row['place_id'],
+                income=row['total_income'],
+                expense=row['total_expense'],
+                net=row['total_income'] - row['total_expense'],
+                record_count=row['total_count'],
+                updated_at=now,
+            )
+
+    def rebuild(self, place_ids=None):
+        """Recompute the balances of the places (all places when None) from Record."""
+        balances, records = self.all(), Record.objects.all()
+        if place_ids is not None:
+            balances, records = balances.filter(place_id__in=place_ids), records.filter(place_id__in=place_ids)
+        with transaction.atomic():
+            balances.delete()
+            self.bulk_create(self.balance_rows(records), batch_size=5000)
+
+    def subtree_total(self, place_id):
+        """Summed balances of the place and every place under it."""
+        zero = Value(Decimal(0))
+        return self.filter(place__in=Place.objects.descendants_of(place_id).values('id')).aggregate(
+            income=Coalesce(Sum('income'), zero),
+            expense=Coalesce(Sum('expense'), zero),
+            net=Coalesce(Sum('net'), zero),
+            record_count=Coalesce(Sum('record_count'), 0),
+        )
+
+
+class PlaceBalance(models.Model):
+    """
+    Running totals of the records of a place, kept in step with RecordDailyRollup.
+    See `rebuild_place_balances` command.
+    """
+    class Meta:
+        verbose_name = 'Баланс'
+        verbose_name_plural = "Баланслар"
+
+    place = models.OneToOneField(Place, on_delete=models.CASCADE, primary_key=True, related_name='balance')
+    income = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    expense = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    net = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    record_count = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    objects = PlaceBalanceManager()
+
+    def __str__(self):
+        return f"{self.place_id}: {self.net}"
+
+
+class Job(models.Model):
+    """
+    A long running import, export or report, executed outside of the request by core.jobs.
+    Cancellation is cooperative: the running job stops at its next progress report.
+    """
+    class Meta:
+        verbose_name = 'Вазифа'
+        verbose_name_plural = "Вазифалар"
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at'])
+        ]
+
+    class Kind(models.TextChoices):
+        PLACE_IMPORT = 'place_import', 'Place import'
+        RECORD_IMPORT = 'record_import', 'Record import'
+        RECORD_EXPORT_CSV = 'record_export_csv', 'Record export (CSV)'
+        RECORD_EXPORT_XLSX = 'record_export_xlsx', 'Record export (XLSX)'
+        REPORT_HIERARCHICALLY_XLSX = 'report_hierarchically_xlsx', 'Hierarchical report (XLSX)'
+
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'Pending'
+        RUNNING = 'running', 'Running'
+        SUCCEEDED = 'succeeded', 'Succeeded'
+        FAILED = 'failed', 'Failed'
+        CANCELLED = 'cancelled', 'Cancelled'
+
+    kind = models.CharField(max_length=50, choices=Kind.choices)
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDING)
+    params = models.JSONField(default=dict, blank=True)
+    input_file = models.FileField(upload_to='jobs/input', null=True, blank=True)
+    result_file = models.FileField(upload_to='jobs/results', null=True, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(null=True, blank=True)
+    progress = models.PositiveIntegerField(default=0)  # Rows (or steps) done
+    total = models.PositiveIntegerField(null=True, blank=True)  # Rows (or steps) expected, when known
+    cancel_requested = models.BooleanField(default=False)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='jobs')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # Written regularly while the job runs, see core.jobs.fail_stale
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    FINISHED_STATUSES = (Status.SUCCEEDED, Status.FAILED, Status.CANCELLED)
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk}: {self.status}"
+
+
+class CalendarDayManager(models.Manager):
+    def fill(self, start, end):
+        """Create the missing days from start to end"""
+        days = (start + datetime.timedelta(days=offset) for offset in range((end - start).days + 1))
+        self.bulk_create((self.model.for_date(day) for day in days), batch_size=5000, ignore_conflicts=True)
+
+    def periods(self, period, start, end):
+        """
+        Start dates of the buckets of the period that have a day from start to end, in order:
+        the gap-free columns of a report. Only reads, the buckets of days missing from the
+        calendar are worked out in Python, the `fill_calendar` command creates them ahead of time.
+        """
+        days = self.filter(date__range=(start, end))
+        field = self.model.PERIOD_FIELDS[period]
+        buckets = set(days.values_list(field, flat=True).distinct())
+        if days.count() != (end - start).days + 1:
+            covered = set(days.values_list('date', flat=True))
+            for offset in range((end - start).days + 1):
+                day = start + datetime.timedelta(days=offset)
+                if day not in covered:
+                    buckets.add(self.model.bucket(period, day))
+        return sorted(buckets)
+
+
+class CalendarDay(models.Model):
+    """
+    Calendar dimension: every day with the start of its week (Monday), month, quarter
+    and year, and of its Hijri month and year (tabular calendar, see core.hijri),
+    for grouping and gap filling report periods in SQL. Rollups join it on date.
+    """
+    class Meta:
+        verbose_name = 'Тақвим куни'
+        verbose_name_plural = "Тақвим кунлари"
+
+    # Report period -> field with the start of the day's bucket
+    PERIOD_FIELDS = {
+        'daily': 'date',
+        'weekly': 'week',
+        'monthly': 'month',
+        'quarterly': 'quarter',
+        'yearly': 'year',
+        'hijri_monthly': 'hijri_month',
+        'hijri_yearly': 'hijri_year',
+    }
+
+    date = models.DateField(primary_key=True)
+    week = models.DateField()
+    month = models.DateField()
+    quarter = models.DateField()
+    year = models.DateField()
+    # Gregorian dates of the first day of the Hijri month and year
+    hijri_month = models.DateField()
+    hijri_year = models.DateField()
+
+    objects = CalendarDayManager()
+
+    def __str__(self):
+        return str(self.date)
+
+    @classmethod
+    def for_date(cls, day):
+        return cls(
+            date=day,
+            week=day - datetime.timedelta(days=day.weekday()),
+            month=day.replace(day=1),
+            quarter=day.replace(month=(day.month - 1) // 3 * 3 + 1, day=1),
+            year=day.replace(month=1, day=1),
+            hijri_month=hijri.month_start(day),
+            hijri_year=hijri.year_start(day),
+        )
 
+    @classmethod
+    def bucket(cls, period, day):
+        """Start date of the bucket of the period the day falls in, for days missing from the calendar"""
+        return getattr(cls.for_date(day), cls.PERIOD_FIELDS[period])
+
+    @staticmethod
+    def period_label(period, start):
+        """Label of the bucket of the period that begins on start"""
+        if period == 'quarterly':
+            return f'{start.year}-Q{(start.month - 1) // 3 + 1}'
+        if period == 'hijri_monthly':
+            year, month, _ = hijri.from_gregorian(start)
+            return f'{year}-{month:02d}'
+        if period == 'hijri_yearly':
+            return str(hijri.from_gregorian(start)[0])
+        return start.strftime({
+            'daily': '%Y-%m-%d',
+            'weekly': '%Y-%W',
+            'monthly': '%Y-%m',
+            'yearly': '%Y',
+        }[period])
@@ -1,7 +1,102 @@
+import base64
+import binascii
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
 from rest_framework.exceptions import NotFound
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import PageNumberPagination, BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 class CustomPagination(PageNumberPagination):
     page_size = 50  # Number of items per page
     page_size_query_param = 'page_size'  # Allow client to set page size via query param
     max_page_size = 200
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on the (created_at, id) key, newest first.
+    Every page is one range scan of the index, no COUNT(*) and no OFFSET, so
+    deep pages cost the same as the first one. Only forward links are given.
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    cursor_query_param = 'cursor'
+    mode_query_param = 'pagination'
+    invalid_cursor_message = 'Invalid cursor'
+
+    @classmethod
+    def is_requested(cls, request):
+        return request.query_params.get(cls.mode_query_param) == 'cursor' or cls.cursor_query_param in request.query_params
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+
+        queryset = queryset.order_by('-created_at', '-id')
+        position = self.decode_cursor(request)
+        if position is not None:
+            created_at, pk = position
+            # The redundant created_at__lte keeps the condition an index range
+            queryset = queryset.filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk),
+                created_at__lte=created_at,
+            )
+
+        results = list(queryset[:page_size + 1])
+        self.page = results[:page_size]
+        self.has_next = len(results) > page_size
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+                cutoff=self.max_page_size
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(last.created_at, last.pk))
+
+    @staticmethod
+    def encode_cursor(created_at, pk):
+        return base64.urlsafe_b64encode(f'{created_at.isoformat()}|{pk}'.encode()).decode()
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            created_at, pk = base64.urlsafe_b64decode(encoded.encode()).decode().split('|')
+            created_at = parse_datetime(created_at)
+            pk = int(pk)
+        except (TypeError, ValueError, binascii.Error, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if created_at is None:
+            raise NotFound(self.invalid_cursor_message)
+        return created_at, pk
@@ -0,0 +1,70 @@
+"""
+Yearly range partitions of the Record table on PostgreSQL.
+
+Migration 0020 turns core_record into a table partitioned by date with a
+partition per year that had records and a default partition that takes
+every date without one. Partitions for the coming years are created ahead
+of time with the `create_record_partitions` command; creating one also moves
+its rows out of the default partition. Other backends are not partitioned.
+"""
+from django.db import connection
+
+TABLE = 'core_record'
+DEFAULT_PARTITION = f'{TABLE}_default'
+
+
+def partition_name(year):
+    return f'{TABLE}_y{year}'
+
+
+def is_partitioned():
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(%s)", [TABLE])
+        row = cursor.fetchone()
+    return bool(row and row[0])
+
+
+def partition_years():
+    """Years that have a partition of their own"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT child.relname FROM pg_inherits '
+            'JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+            'WHERE pg_inherits.inhparent = to_regclass(%s)',
+            [TABLE]
+        )
+        prefix = partition_name('')
+        return {
+            int(name[len(prefix):]) for name, in cursor.fetchall()
+            if name.startswith(prefix) and name[len(prefix):].isdigit()
+        }
+
+
+def default_partition_years():
+    """Years of the records that are in the default partition"""
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT DISTINCT EXTRACT(YEAR FROM date)::integer FROM {DEFAULT_PARTITION}')
+        return {year for year, in cursor.fetchall()}
+
+
+def create_year_partition(year):
+    """
+    Create the partition of the year. Its records are moved over from the default
+    partition, which is detached meanwhile: PostgreSQL refuses a new partition
+    while the default one has rows in its range.
+    """
+    start, end = f'{year}-01-01', f'{year + 1}-01-01'
+    name = partition_name(year)
+    with connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE {TABLE} DETACH PARTITION {DEFAULT_PARTITION}')
+        cursor.execute(f"CREATE TABLE {name} PARTITION OF {TABLE} FOR VALUES FROM ('{start}') TO ('{end}')")
+        cursor.execute(
+            f'WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE date >= %s AND date < %s RETURNING *) '
+            f'INSERT INTO {name} SELECT * FROM moved',
+            [start, end]
+        )
+        moved = cursor.rowcount
+        cursor.execute(f'ALTER TABLE {TABLE} ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT')
+    return moved
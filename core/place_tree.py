@@ -0,0 +1,164 @@
+"""
+Process-wide, read-mostly copy of the Place hierarchy.
+
+The tree is built from a single scan of Place and stored in flat arrays in
+DFS (Euler tour) order: the subtree of a node occupies a contiguous range of
+positions, so subtree membership is a range check and descendant and leaf
+lists are slices. Place change signals bump a version in the cache and every
+process rebuilds its copy on the next access.
+"""
+import threading
+import time
+from array import array
+from collections import defaultdict
+
+from django.core.cache import cache
+from django.db import transaction
+
+from core import replica
+from core.models import Place
+
+VERSION_KEY = 'place_tree:version'
+
+
+class PlaceTree:
+    def __init__(self, rows):
+        """rows: iterable of (place_id, parent_id)"""
+        children = defaultdict(list)
+        place_ids = set()
+        for place_id, parent_id in rows:
+            place_ids.add(place_id)
+            children[parent_id].append(place_id)
+        # Places whose parent is missing are treated as roots
+        roots = sorted(children[None] + [
+            place_id for parent_id, child_ids in children.items()
+            if parent_id is not None and parent_id not in place_ids for place_id in child_ids
+        ])
+
+        self._ids = array('q')       # place id at each position
+        self._parents = array('q')   # position of the parent, -1 for roots
+        self._depths = array('l')
+        self._ends = array('q')      # end (exclusive) of the subtree range
+        self._leaves = array('q')    # leaf ids in DFS order
+        self._leaf_starts = array('q')
+        self._positions = {}
+
+        stack = [(place_id, -1, 0) for place_id in reversed(roots)]
+        while stack:
+            place_id, parent_position, depth = stack.pop()
+            if place_id < 0:
+                # Closing marker of the subtree of the node at position ~place_id
+                self._ends[~place_id] = len(self._ids)
+                continue
+            position = len(self._ids)
+            self._positions[place_id] = position
+            self._ids.append(place_id)
+            self._parents.append(parent_position)
+            self._depths.append(depth)
+            self._ends.append(position + 1)
+            self._leaf_starts.append(len(self._leaves))
+
+            child_ids = sorted(children.get(place_id, ()))
+            if not child_ids:
+                self._leaves.append(place_id)
+                continue
+            stack.append((~position, -1, 0))
+            stack += [(child_id, position, depth + 1) for child_id in reversed(child_ids)]
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _position(self, place_id):
+        if place_id is None:
+            return None
+        return self._positions.get(int(place_id))
+
+    def _leaf_end(self, position):
+        end = self._ends[position]
+        return self._leaf_starts[end] if end < len(self._ids) else len(self._leaves)
+
+    def contains(self, place_id):
+        return self._position(place_id) is not None
+
+    def is_descendant(self, place_id, ancestor_id):
+        """Is place_id equal to or located under ancestor_id."""
+        position = self._position(place_id)
+        ancestor_position = self._position(ancestor_id)
+        if position is None or ancestor_position is None:
+            return False
+        return ancestor_position <= position < self._ends[ancestor_position]
+
+    def descendants(self, place_id, include_self=True):
+        position = self._position(place_id)
+        if position is None:
+            return []
+        start = position if include_self else position + 1
+        return self._ids[start:self._ends[position]].tolist()
+
+    def leaves(self, place_id):
+        position = self._position(place_id)
+        if position is None:
+            return []
+        return self._leaves[self._leaf_starts[position]:self._leaf_end(position)].tolist()
+
+    def ancestors(self, place_id, include_self=True):
+        """Ids from the place (or its parent) up to the root."""
+        position = self._position(place_id)
+        if position is None:
+            return []
+        if not include_self:
+            position = self._parents[position]
+        ancestor_ids = []
+        while position != -1:
+            ancestor_ids.append(self._ids[position])
+            position = self._parents[position]
+        return ancestor_ids
+
+    def parent(self, place_id):
+        position = self._position(place_id)
+        if position is None or self._parents[position] == -1:
+            return None
+        return self._ids[self._parents[position]]
+
+    def depth(self, place_id):
+        position = self._position(place_id)
+        return None if position is None else self._depths[position]
+
+
+_lock = threading.Lock()
+_cached = (None, None)  # (tree, version it was built at)
+
+
+def get_place_tree():
+    """The current PlaceTree, rebuilt if a place changed in any process since it was built."""
+    global _cached
+
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(VERSION_KEY)
+
+    tree, tree_version = _cached
+    if tree is None or tree_version != version:
+        with _lock:
+            tree, tree_version = _cached
+            if tree is None or tree_version != version:
+                # Every request of the process uses the tree, it must not miss a place the replica lags behind on
+                with replica.primary():
+                    tree = PlaceTree(Place.objects.values_list('id', 'parent_id').iterator(chunk_size=5000))
+                _cached = (tree, version)
+    return tree
+
+
+def invalidate():
+    """
+    Make every process rebuild its tree. This process drops its copy right away,
+    so the current transaction sees its own changes, the others once it commits.
+    """
+    def bump():
+        global _cached
+        cache.set(VERSION_KEY, time.time_ns(), timeout=None)
+        _cached = (None, None)
+
+    bump()
+    transaction.on_commit(bump)
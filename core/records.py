@@ -0,0 +1,37 @@
+"""
+Bulk write paths for Record.
+
+bulk_create() skips Record.save() and the model signals, so everything that
+normally hangs off them (rollup, report cache, audit log) is done here in
+batches instead.
+"""
+from django.db import transaction
+
+from core import report_cache
+from core.audit import audit_log
+from core.models import Record, RecordDailyRollup
+
+
+def bulk_create_records(records, user=None, ip_address=None, batch_size=1000):
+    """Insert records in one transaction together with their rollup and audit entries."""
+    records = list(records)
+    if not records:
+        return records
+
+    with transaction.atomic():
+        records = Record.objects.bulk_create(records, batch_size=batch_size)
+        RecordDailyRollup.objects.apply_records(added=records)
+        audit_log.log_many([
+            dict(
+                user=user,
+                action='create',
+                object_id=record.pk,
+                object_type=Record.__name__,
+                description=f'{Record.__name__} create',
+                ip_address=ip_address,
+            )
+            for record in records
+        ])
+        report_cache.invalidate_places({record.place_id for record in records})
+
+    return records
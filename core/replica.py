@@ -0,0 +1,99 @@
+"""
+Read replica routing.
+
+When REPLICA_DATABASE_URL is set, the safe (GET/HEAD/OPTIONS) requests of
+views with ReplicaReadsMixin read from the 'replica' database. Everything
+else stays on 'default': writes, reads inside a transaction, instances that
+came from the primary, and every request of a user for REPLICA_MAX_LAG
+seconds after they changed something, so they always see their own writes.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from rest_framework.permissions import SAFE_METHODS
+
+REPLICA = 'replica'
+
+_reading_from_replica = ContextVar('reading_from_replica', default=False)
+
+
+def is_configured():
+    return settings.REPLICA_READS and REPLICA in settings.DATABASES
+
+
+def reads_from_replica():
+    """Do the reads of the current request go to the replica"""
+    return _reading_from_replica.get()
+
+
+@contextmanager
+def primary():
+    """Reads within the block go to the primary"""
+    token = _reading_from_replica.set(False)
+    try:
+        yield
+    finally:
+        _reading_from_replica.reset(token)
+
+
+def _pin_key(user_id):
+    return f'replica:pin:{user_id}'
+
+
+def pin_to_primary(user):
+    """Send the reads of the user to the primary until the replica has caught up with their writes"""
+    if is_configured() and user is not None and user.is_authenticated:
+        cache.set(_pin_key(user.pk), True, timeout=settings.REPLICA_MAX_LAG)
+
+
+def is_pinned(user):
+    return user is not None and user.is_authenticated and cache.get(_pin_key(user.pk)) is not None
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        if reads_from_replica() and not connections['default'].in_atomic_block:
+            return REPLICA
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Same data on both databases
+        return True
+
+
+class ReplicaReadsMixin:
+    """Safe requests of the view read from the replica, unless the user just wrote something"""
+
+    def dispatch(self, request, *args, **kwargs):
+        # initial() switches to the replica for the rest of the request
+        with primary():
+            return super().dispatch(request, *args, **kwargs)
+
+    def initial(self, request, *args, **kwargs):
+        # Authentication and permission checks run on the primary
+        super().initial(request, *args, **kwargs)
+        if is_configured() and request.method in SAFE_METHODS and not is_pinned(request.user):
+            _reading_from_replica.set(True)
+
+
+class ReplicaPinMiddleware:
+    """Pins the user of every successful unsafe request to the primary, see pin_to_primary"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        # DRF puts the user it authenticated (e.g. from the JWT) on the Django request
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            pin_to_primary(getattr(request, 'user', None))
+        return response
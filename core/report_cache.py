@@ -0,0 +1,194 @@
+"""
+Cache of report results with per-place version counters.
+
+A cached report is stored under a key that contains the version of its place
+and a global version. Changing a Record bumps the version of its place and of
+every ancestor of that place, so reports of the affected subtrees stop being
+found while reports of unrelated regions stay cached. Changes to places and
+categories (names, tree shape, income/expense) bump the global version.
+
+Identical reports requested at the same time are computed once per process:
+while one request computes a key, the others wait up to
+REPORT_COALESCE_TIMEOUT seconds for its result (single flight). How often
+that happens is counted per process and, through the cache, across the
+processes sharing it (see coalescing_stats), and logged every
+REPORT_STATS_LOG_INTERVAL seconds.
+"""
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from core import replica
+from core.place_tree import get_place_tree
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_VERSION_KEY = 'report:version:global'
+STATS = ('computed', 'coalesced', 'timed_out')
+
+
+class _Flight:
+    """A computation in progress, for the requests that wait for it"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+_flights = {}
+_flights_lock = threading.Lock()
+# computed: by the request that got the key first, coalesced: handed to a waiting request,
+# timed_out: computed again by a request that gave up waiting
+_stats = Counter()
+_stats_logged_at = time.monotonic()
+
+
+def _cache():
+    return caches[settings.REPORT_CACHE_ALIAS]
+
+
+def _place_version_key(place_id):
+    return f'report:version:place:{place_id}'
+
+
+def _new_version():
+    # Versions are unique tokens rather than counters starting at 0, so that
+    # an evicted version key can never bring back reports cached before it
+    return time.time_ns()
+
+
+def _get_versions(keys):
+    cache = _cache()
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, _new_version(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def _bump(keys):
+    cache = _cache()
+    cache.set_many({key: _new_version() for key in keys}, timeout=None)
+
+
+def get_or_compute(endpoint, place_id, params, compute):
+    """Return the cached result of `compute()` for the endpoint, place and params."""
+    global_version, place_version = _get_versions([GLOBAL_VERSION_KEY, _place_version_key(place_id)])
+    key = ':'.join(
+        ['report', endpoint, str(place_id)] + [str(param) for param in params] + [f'{global_version}.{place_version}']
+    )
+
+    cache = _cache()
+    result = cache.get(key)
+    if result is not None:
+        return result
+
+    # A request pinned to the primary must not get a result read from the replica
+    flight_key = (key, replica.reads_from_replica())
+    with _flights_lock:
+        flight = _flights.get(flight_key)
+        leader = flight is None
+        if leader:
+            flight = _flights[flight_key] = _Flight()
+
+    if not leader:
+        if flight.done.wait(settings.REPORT_COALESCE_TIMEOUT):
+            _count('coalesced')
+            logger.debug('Report %s coalesced', key)
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        _count('timed_out')
+        logger.warning('Gave up waiting for report %s after %s seconds', key, settings.REPORT_COALESCE_TIMEOUT)
+        return _compute(key, global_version, place_version, compute)
+
+    try:
+        flight.result = _compute(key, global_version, place_version, compute)
+        _count('computed')
+        return flight.result
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        with _flights_lock:
+            del _flights[flight_key]
+        flight.done.set()
+
+
+def _compute(key, global_version, place_version, compute):
+    result = compute()
+    timeout = settings.REPORT_CACHE_TIMEOUT
+    if replica.reads_from_replica() and \
+            time.time_ns() - max(global_version, place_version) < settings.REPLICA_MAX_LAG * 10 ** 9:
+        # The replica may not have the change behind the versions yet, keep the result only briefly
+        timeout = settings.REPLICA_MAX_LAG
+    _cache().set(key, result, timeout=timeout)
+    return result
+
+
+def _stats_key(name):
+    return f'report:stats:{name}'
+
+
+def _count(name):
+    global _stats_logged_at
+    with _flights_lock:
+        _stats[name] += 1
+        log = time.monotonic() - _stats_logged_at >= settings.REPORT_STATS_LOG_INTERVAL
+        if log:
+            _stats_logged_at = time.monotonic()
+
+    cache = _cache()
+    try:
+        cache.incr(_stats_key(name))
+    except ValueError:
+        # Not there yet (or evicted), counting starts again
+        if not cache.add(_stats_key(name), 1, timeout=None):
+            cache.incr(_stats_key(name))
+
+    if log:
+        logger.info('Report computations, this process: %s, all processes: %s', *coalescing_stats().values())
+
+
+def coalescing_stats():
+    """
+    Reports computed, coalesced into another request and waits that timed out:
+    counts of this process and of every process sharing the cache
+    """
+    with _flights_lock:
+        process = {name: _stats[name] for name in STATS}
+    shared = _cache().get_many([_stats_key(name) for name in STATS])
+    return {
+        'process': process,
+        'total': {name: shared.get(_stats_key(name), 0) for name in STATS},
+    }
+
+
+def invalidate_places(place_ids):
+    """
+    Bump the versions of the places and all of their ancestors, right away and
+    again once the transaction commits. The second bump drops whatever was cached
+    from a read that did not see the transaction yet.
+    """
+    place_ids = {place_id for place_id in place_ids if place_id is not None}
+    if not place_ids:
+        return
+
+    tree = get_place_tree()
+    ancestor_ids = {ancestor_id for place_id in place_ids for ancestor_id in tree.ancestors(place_id)}
+    keys = [_place_version_key(place_id) for place_id in ancestor_ids | place_ids]
+    _bump(keys)
+    transaction.on_commit(lambda: _bump(keys))
+
+
+def invalidate_all():
+    """Bump the global version, right away and again once the transaction commits."""
+    _bump([GLOBAL_VERSION_KEY])
+    transaction.on_commit(lambda: _bump([GLOBAL_VERSION_KEY]))
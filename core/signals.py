@@ -0,0 +1,67 @@
+import threading
+
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from core import place_tree, report_cache
+from core.models import Record, RecordDailyRollup, Place, Category
+
+# The records of the deletion in progress in this thread, see remove_records_from_rollup
+_deleting = threading.local()
+
+
+@receiver(pre_delete, sender=Record)
+def collect_deleted_record(sender, instance, origin=None, **kwargs):
+    # A deletion sends the pre_delete of all its records before the first post_delete
+    batch = getattr(_deleting, 'batch', None)
+    if batch is None or batch['origin'] is not origin:
+        # A new deletion, whatever a failed one left behind is dropped
+        batch = _deleting.batch = {'origin': origin, 'pending': set(), 'removed': [], 'place_ids': set()}
+    batch['pending'].add(id(instance))
+
+
+@receiver(post_delete, sender=Record)
+def remove_records_from_rollup(sender, instance, origin=None, **kwargs):
+    """
+    Covers instance deletes as well as queryset and cascade deletes. The records of
+    one deletion are taken out of the rollup, the balances and the report cache
+    together after the last of them is gone, with a few statements however many there are.
+    """
+    batch = getattr(_deleting, 'batch', None)
+    if batch is None or batch['origin'] is not origin or id(instance) not in batch['pending']:
+        batch = {'pending': {id(instance)}, 'removed': [], 'place_ids': set()}
+
+    values = getattr(instance, '_loaded_values', None) or instance.rollup_values()
+    if values is not None:
+        batch['removed'].append(values)
+    batch['place_ids'].add(instance.place_id)
+    batch['pending'].discard(id(instance))
+    if batch['pending']:
+        return
+
+    _deleting.batch = None
+    if batch['removed']:
+        RecordDailyRollup.objects.apply_records(removed=batch['removed'])
+    report_cache.invalidate_places(batch['place_ids'])
+
+
+@receiver(post_save, sender=Record)
+def invalidate_record_reports(sender, instance, **kwargs):
+    # Record.save() refreshes _loaded_values only after this signal, so it still holds the old place
+    previous = getattr(instance, '_loaded_values', None) or {}
+    report_cache.invalidate_places([instance.place_id, previous.get('place_id')])
+
+
+@receiver(post_save, sender=Place)
+@receiver(post_delete, sender=Place)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_all_reports(sender, **kwargs):
+    # Names, tree shape and income/expense types show up in every report
+    report_cache.invalidate_all()
+
+
+@receiver(post_save, sender=Place)
+@receiver(post_delete, sender=Place)
+def invalidate_place_tree(sender, **kwargs):
+    place_tree.invalidate()
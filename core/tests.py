@@ -1,3 +1,1218 @@
-from django.test import TestCase
+import datetime
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.core.cache import cache
+from django.db import connection, connections, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from openpyxl import Workbook, load_workbook
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from core import jobs, replica, report_cache
+from core.audit import AuditSink
+from core.models import (
+    ActivityLog, CalendarDay, Category, Job, Place, PlaceBalance, PlaceClosure, Record,
+    RecordDailyRollup, User,
+)
+from core.place_tree import get_place_tree
+from core.records import bulk_create_records
+from place.excel import import_places
+from record.importer import import_records
+from record.report_excel import write_hierarchical_report
+from record.report_matrix import ReportMatrix, to_tiyin
+
+
+@override_settings(AUDIT_LOG_MODE='sync')
+class PlaceClosureTest(TestCase):
+    """Place.save() keeps the closure index equal to one rebuilt from Place.parent."""
+
+    def setUp(self):
+        self.region = Place.objects.create(name='Region')
+        self.other_region = Place.objects.create(name='Other region')
+        self.city = Place.objects.create(name='City', parent=self.region)
+        self.mosque = Place.objects.create(name='Mosque', parent=self.city, is_mosque=True)
+
+    def assert_closure_rebuilt(self):
+        links = set(PlaceClosure.objects.values_list('ancestor_id', 'descendant_id', 'depth'))
+        PlaceClosure.objects.rebuild()
+        self.assertEqual(links, set(PlaceClosure.objects.values_list('ancestor_id', 'descendant_id', 'depth')))
+
+    def _ancestors(self, place):
+        return list(Place.objects.ancestors_of(place.id).values_list('id', flat=True))
+
+    def test_create(self):
+        self.assert_closure_rebuilt()
+        self.assertEqual(self._ancestors(self.mosque), [self.mosque.id, self.city.id, self.region.id])
+
+    def test_reparent(self):
+        self.city.parent = self.other_region
+        self.city.save()
+
+        self.assert_closure_rebuilt()
+        self.assertEqual(self._ancestors(self.mosque), [self.mosque.id, self.city.id, self.other_region.id])
+        self.assertEqual(set(Place.objects.descendant_ids(self.region.id)), {self.region.id})
+
+    def test_reparent_deferred_parent(self):
+        city = Place.objects.only('name').get(pk=self.city.pk)
+        city.parent = self.other_region
+        city.save()
+
+        self.assert_closure_rebuilt()
+        self.assertEqual(self._ancestors(self.mosque), [self.mosque.id, self.city.id, self.other_region.id])
+
+    def test_subtree_delete(self):
+        self.region.delete()
+
+        self.assertEqual(list(Place.objects.values_list('id', flat=True)), [self.other_region.id])
+        self.assertEqual(
+            set(PlaceClosure.objects.values_list('ancestor_id', 'descendant_id', 'depth')),
+            {(self.other_region.id, self.other_region.id, 0)}
+        )
+
+    def test_cycle_rejected(self):
+        self.region.parent = self.mosque
+        with self.assertRaises(ValidationError):
+            self.region.full_clean()
+        with self.assertRaises(ValueError):
+            self.region.save()
+
+        self.assertIsNone(Place.objects.get(pk=self.region.pk).parent_id)
+        self.assert_closure_rebuilt()
+
+
+@override_settings(AUDIT_LOG_MODE='sync')
+class HierarchicalReportTest(TestCase):
+    """Every place of the hierarchical report carries the totals of its whole subtree."""
+
+    def setUp(self):
+        self.region = Place.objects.create(name='Region')
+        self.city = Place.objects.create(name='City', parent=self.region)
+        self.mosque = Place.objects.create(name='Mosque 1', parent=self.city, is_mosque=True)
+        self.other_mosque = Place.objects.create(name='Mosque 2', parent=self.city, is_mosque=True)
+        self.region_mosque = Place.objects.create(name='Mosque 3', parent=self.region, is_mosque=True)
+        donation = Category.objects.create(name='Donation', operation_type=Category.OperationType.INCOME)
+        zakat = Category.objects.create(name='Zakat', operation_type=Category.OperationType.INCOME)
+        for place, category, amount, date in (
+            (self.mosque, donation, 10, '2025-01-05'),
+            (self.other_mosque, donation, 20, '2025-02-03'),
+            # Only one mosque has this category
+            (self.other_mosque, zakat, 5, '2025-01-10'),
+            (self.region_mosque, donation, 1, '2025-01-06'),
+        ):
+            Record.objects.create(place=place, category=category, amount=amount, date=date)
+        self.client = APIClient()
+        self.client.force_authenticate(
+            User.objects.create_user('region_admin', 'password', role='region_admin', place=self.region)
+        )
+
+    def _rows(self, node):
+        return {row[0]: row[1:] for row in node['data']['data']}
+
+    def _sum_rows(self, *nodes):
+        totals = defaultdict(lambda: [0.0] * 3)
+        for node in nodes:
+            for category, amounts in self._rows(node).items():
+                totals[category] = [total + amount for total, amount in zip(totals[category], amounts)]
+        return dict(totals)
+
+    def test_subtree_totals(self):
+        response = self.client.get('/api/record/report-hierarchicallly/monthly/', {
+            'place_id': self.region.id, 'start': '2025-01-01', 'end': '2025-02-28',
+        })
+        self.assertEqual(response.status_code, 200, response.content)
+        region = response.json()['Region']
+        city = region['City']
+
+        self.assertEqual(region['data']['periods'], ['2025-01', '2025-02'])
+        self.assertEqual(self._rows(city), self._sum_rows(city['Mosque 1'], city['Mosque 2']))
+        self.assertEqual(self._rows(region), self._sum_rows(city['Mosque 1'], city['Mosque 2'], region['Mosque 3']))
+        self.assertEqual(self._rows(region), {
+            'Donation': [11.0, 20.0, 31.0],
+            'Zakat': [5.0, 0.0, 5.0],
+            'Жами': [16.0, 20.0, 36.0],
+        })
+        self.assertEqual(self._rows(city['Mosque 1']), {'Donation': [10.0, 0.0, 10.0], 'Жами': [10.0, 0.0, 10.0]})
+
+
+@override_settings(AUDIT_LOG_MODE='sync')
+class RecordRollupTest(TestCase):
+    """The daily rollup follows every change to the records, as `rollup_records --verify` confirms."""
+
+    def setUp(self):
+        self.region = Place.objects.create(name='Region')
+        self.mosque = Place.objects.create(name='Mosque', parent=self.region, is_mosque=True)
+        self.other_mosque = Place.objects.create(name='Other mosque', parent=self.region, is_mosque=True)
+        self.income = Category.objects.create(name='Donation', operation_type=Category.OperationType.INCOME)
+        self.expense = Category.objects.create(name='Rent', operation_type=Category.OperationType.EXPENSE)
+        self.record = Record.objects.create(
+            place=self.mosque, category=self.income, amount=100, quantity=2, date=datetime.date(2025, 1, 1)
+        )
+        Record.objects.create(place=self.mosque, category=self.expense, amount=30, date=datetime.date(2025, 1, 1))
+
+    def assert_rollup_verified(self):
+        # Raises CommandError when a rollup row does not match the records
+        call_command('rollup_records', verify=True, stdout=io.StringIO())
+
+    def _rollup(self):
+        return set(RecordDailyRollup.objects.values_list('place_id', 'category_id', 'date', 'amount', 'record_count'))
+
+    def test_create(self):
+        self.assert_rollup_verified()
+        self.assertEqual(self._rollup(), {
+            (self.mosque.id, self.income.id, datetime.date(2025, 1, 1), 100, 1),
+            (self.mosque.id, self.expense.id, datetime.date(2025, 1, 1), -30, 1),
+        })
+
+    def test_update_amount(self):
+        self.record.amount = 150
+        self.record.save()
+
+        self.assert_rollup_verified()
+        self.assertIn((self.mosque.id, self.income.id, datetime.date(2025, 1, 1), 150, 1), self._rollup())
+
+    def test_update_date(self):
+        self.record.date = datetime.date(2025, 2, 1)
+        self.record.save()
+
+        self.assert_rollup_verified()
+        # The emptied day is gone
+        self.assertEqual(self._rollup(), {
+            (self.mosque.id, self.income.id, datetime.date(2025, 2, 1), 100, 1),
+            (self.mosque.id, self.expense.id, datetime.date(2025, 1, 1), -30, 1),
+        })
+
+    def test_update_place(self):
+        self.record.place = self.other_mosque
+        self.record.save()
+
+        self.assert_rollup_verified()
+        self.assertIn((self.other_mosque.id, self.income.id, datetime.date(2025, 1, 1), 100, 1), self._rollup())
+
+    def test_delete(self):
+        self.record.delete()
+
+        self.assert_rollup_verified()
+        self.assertEqual(self._rollup(), {(self.mosque.id, self.expense.id, datetime.date(2025, 1, 1), -30, 1)})
+
+    def test_queryset_delete(self):
+        Record.objects.filter(place=self.mosque).delete()
+
+        self.assert_rollup_verified()
+        self.assertFalse(RecordDailyRollup.objects.exists())
+
+    def test_cascade_delete(self):
+        Record.objects.create(place=self.other_mosque, category=self.income, amount=5, date=datetime.date(2025, 1, 1))
+
+        self.region.delete()
+
+        self.assert_rollup_verified()
+        self.assertFalse(RecordDailyRollup.objects.exists())
+
+    def test_cascade_delete_applies_once(self):
+        for day in range(2, 6):
+            Record.objects.create(place=self.other_mosque, category=self.income, amount=day, date=datetime.date(2025, 1, day))
+
+        with mock.patch.object(
+            RecordDailyRollup.objects, 'apply_records', wraps=RecordDailyRollup.objects.apply_records
+        ) as apply_records:
+            self.region.delete()
+
+        # One call for the six records of the two mosques
+        self.assertEqual(apply_records.call_count, 1)
+        self.assertEqual(len(apply_records.call_args.kwargs['removed']), 6)
+        self.assert_rollup_verified()
+        self.assertFalse(PlaceBalance.objects.exists())
+
+    def test_rebuild_invalidates_reports(self):
+        computed = []
+        for command in ('rollup_records', 'rebuild_place_balances'):
+            report_cache.get_or_compute('test', self.region.id, (self.id(), command), lambda: computed.append(command) or command)
+            call_command(command, stdout=io.StringIO())
+            report_cache.get_or_compute('test', self.region.id, (self.id(), command), lambda: computed.append(command) or command)
+
+        self.assertEqual(computed, ['rollup_records'] * 2 + ['rebuild_place_balances'] * 2)
+
+    def test_category_operation_type_flip(self):
+        self.income.operation_type = Category.OperationType.EXPENSE
+        self.income.save()
+
+        self.assert_rollup_verified()
+        self.assertIn((self.mosque.id, self.income.id, datetime.date(2025, 1, 1), -100, 1), self._rollup())
+
+
+@override_settings(AUDIT_LOG_MODE='sync')
+class ReportCacheTest(TestCase):
+    """A record change drops the cached reports of its place and ancestors, other regions stay cached."""
+    cache_backend = 'django.core.cache.backends.locmem.LocMemCache'
+
+    def setUp(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        settings_override = self.settings(CACHES={'default': {'BACKEND': self.cache_backend, 'LOCATION': location}})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.region = Place.objects.create(name='Region')
+        self.mosque = Place.objects.create(name='Mosque', parent=self.region, is_mosque=True)
+        self.other_region = Place.objects.create(name='Other region')
+        self.category = Category.objects.create(name='Donation', operation_type=Category.OperationType.INCOME)
+        self.computed = []
+
+    def _report(self, place):
+        def compute():
+            self.computed.append(place.name)
+            return {'place': place.name}
+        return report_cache.get_or_compute('report', place.id, ('monthly',), compute)
+
+    def test_record_change_invalidates_ancestors_only(self):
+        self._report(self.region)
+        self._report(self.other_region)
+        self.assertEqual(self._report(self.region), {'place': 'Region'})
+
+        # Versions are bumped once the transaction commits
+        with self.captureOnCommitCallbacks(execute=True):
+            Record.objects.create(place=self.mosque, category=self.category, amount=10)
+        self._report(self.region)
+        self._report(self.other_region)
+
+        self.assertEqual(self.computed, ['Region', 'Other region', 'Region'])
+
+    def test_category_change_invalidates_everything(self):
+        self._report(self.region)
+        self._report(self.other_region)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.name = 'Donations'
+            self.category.save()
+        self._report(self.region)
+        self._report(self.other_region)
+
+        self.assertEqual(self.computed, ['Region', 'Other region'] * 2)
+
+
+class FileBasedReportCacheTest(ReportCacheTest):
+    cache_backend = 'django.core.cache.backends.filebased.FileBasedCache'
+
+
+@override_settings(AUDIT_LOG_MODE='sync')
+class PlaceTreeTest(TestCase):
+    """The in-process place tree agrees with the closure index and follows every change of the places."""
+
+    def setUp(self):
+        self.client = APIClient()
+        # Changes reach the tree once their transaction commits
+        with self.captureOnCommitCallbacks(execute=True):
+            self.region = Place.objects.create(name='Region')
+            self.other_region = Place.objects.create(name='Other region')
+            self.city = Place.objects.create(name='City', parent=self.region)
+            self.mosque = Place.objects.create(name='Mosque', parent=self.city, is_mosque=True)
+            self.region_mosque = Place.objects.create(name='Region mosque', parent=self.region, is_mosque=True)
+
+    def assert_tree_matches_closure(self):
+        tree = get_place_tree()
+        place_ids = list(Place.objects.values_list('id', flat=True))
+        self.assertEqual(len(tree), len(place_ids))
+        for place_id in place_ids:
+            descendant_ids = tree.descendants(place_id)
+            self.assertEqual(sorted(descendant_ids), sorted(Place.objects.descendant_ids(place_id)))
+            self.assertEqual(descendant_ids[0], place_id)
+            self.assertEqual(
+                sorted(tree.leaves(place_id)), sorted(Place.objects.leaves_of(place_id).values_list('id', flat=True))
+            )
+            self.assertEqual(
+                tree.ancestors(place_id), list(Place.objects.ancestors_of(place_id).values_list('id', flat=True))
+            )
+            for other_id in place_ids:
+                self.assertEqual(tree.is_descendant(other_id, place_id), other_id in descendant_ids)
+
+    def test_tree(self):
+        self.assert_tree_matches_closure()
+        tree = get_place_tree()
+        self.assertEqual(tree.descendants(self.region.id, include_self=False), [self.city.id, self.mosque.id, self.region_mosque.id])
+        self.assertEqual(tree.leaves(self.region.id), [self.mosque.id, self.region_mosque.id])
+        self.assertEqual(tree.ancestors(self.mosque.id, include_self=False), [self.city.id, self.region.id])
+        self.assertEqual((tree.parent(self.mosque.id), tree.depth(self.mosque.id)), (self.city.id, 2))
+        self.assertEqual(tree.descendants(0), [])
+
+    def test_create(self):
+        get_place_tree()
+        with self.captureOnCommitCallbacks(execute=True):
+            mosque = Place.objects.create(name='New mosque', parent=self.other_region, is_mosque=True)
+
+        self.assert_tree_matches_closure()
+        self.assertTrue(get_place_tree().is_descendant(mosque.id, self.other_region.id))
+
+    def test_reparent(self):
+        get_place_tree()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.city.parent = self.other_region
+            self.city.save()
+
+        self.assert_tree_matches_closure()
+        self.assertEqual(get_place_tree().leaves(self.region.id), [self.region_mosque.id])
+        self.assertTrue(get_place_tree().is_descendant(self.mosque.id, self.other_region.id))
+
+    def test_import(self):
+        get_place_tree()
+        workbook = Workbook()
+        sheet = workbook.create_sheet()
+        for row, (name, inn) in enumerate([('Imported region', None), ('Imported mosque', '111')], start=4):
+            sheet.cell(row=row, column=3, value=name)
+            sheet.cell(row=row, column=4, value=inn)
+        file_obj = io.BytesIO()
+        workbook.save(file_obj)
+
+        self.client.force_authenticate(User.objects.create_user('admin', 'password', role='admin'))
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/place/excel-upload/', {
+                'file': SimpleUploadedFile('places.xlsx', file_obj.getvalue()),
+            }, format='multipart')
+        self.assertEqual(response.status_code, 201, response.content)
+
+        self.assert_tree_matches_closure()
+        region = Place.objects.get(name='Imported region')
+        self.assertEqual(get_place_tree().leaves(region.id), [Place.objects.get(name='Imported mosque').id])
+
+
+@override_settings(AUDIT_LOG_MODE='sync')
+class RecordKeysetPaginationTest(TestCase):
+    """Cursor pages of the record list cover every record once, also when records share created_at."""
+
+    def setUp(self):
+        self.mosque = Place.objects.create(name='Mosque', is_mosque=True)
+        category = Category.objects.create(name='Donation', operation_type=Category.OperationType.INCOME)
+        records = [Record.objects.create(place=self.mosque, category=category, amount=index) for index in range(7)]
+        created_at = timezone.now()
+        # Three records of the same moment across the page boundaries
+        Record.objects.filter(pk__in=[record.pk for record in records[2:5]]).update(created_at=created_at)
+        self.record_ids = [record.pk for record in records]
+        self.client = APIClient()
+        self.client.force_authenticate(
+            User.objects.create_user('mosque_admin', 'password', role='mosque_admin', place=self.mosque)
+        )
+
+    def test_walk_pages(self):
+        expected = list(Record.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        ids, url, pages = [], '/api/record/?pagination=cursor&page_size=2', 0
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, response.content)
+            self.assertNotIn('count', response.data)
+            ids += [record['id'] for record in response.data['results']]
+            url = response.data['next']
+            pages += 1
+
+        self.assertEqual(pages, 4)
+        self.assertEqual(ids, expected)
+        self.assertEqual(sorted(ids), sorted(self.record_ids))
+
+    def test_page_numbers_by_default(self):
+        response = self.client.get('/api/record/', {'page_size': 2, 'page': 2})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 7)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIsNotNone(response.data['previous'])
+
+    def test_invalid_cursor(self):
+        for cursor in ('not-a-cursor', 'MjAyNS0wMS0wMXx4'):
+            response = self.client.get('/api/record/', {'cursor': cursor})
+            self.assertEqual(response.status_code, 404, cursor)
+
+
+@override_settings(AUDIT_LOG_MODE='sync')
+class RecordListQueriesTest(TestCase):
+    """A page of records costs the same number of queries however many records it has."""
+
+    def setUp(self):
+        self.mosque = Place.objects.create(name='Mosque', is_mosque=True)
+        self.user = User.objects.create_user('mosque_admin', 'password', role='mosque_admin', place=self.mosque)
+        self.categories = []
+        for index in range(6):
+            category = Category.objects.create(name=f'Category {index}', operation_type=Category.OperationType.INCOME)
+            author = User.objects.create_user(f'author_{index % 3}_{index}', 'password', role='mosque_admin')
+            Record.objects.create(place=self.mosque, category=category, amount=10, created_by=author)
+            self.categories.append(category)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _list(self, **params):
+        # The place tree is cached per process, build it before counting
+        get_place_tree()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/record/', params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response, len(context.captured_queries)
+
+    def test_queries_do_not_depend_on_page_size(self):
+        for params in ({}, {'format': 'compact'}, {'pagination': 'cursor'}, {'pagination': 'cursor', 'format': 'compact'}):
+            _, small_page = self._list(page_size=2, **params)
+            response, full_page = self._list(page_size=6, **params)
+            self.assertEqual(len(response.data['results']), 6)
+            self.assertEqual(small_page, full_page, params)
+
+    def test_compact_side_tables(self):
+        response, _ = self._list(format='compact', page_size=2)
+
+        results = response.data['results']
+        self.assertEqual(len(results), 2)
+        # Related objects are ids, each of them described once in the side tables
+        self.assertEqual(set(response.data['categories']), {record['category'] for record in results})
+        self.assertEqual(set(response.data['places']), {self.mosque.id})
+        self.assertEqual(set(response.data['users']), {record['created_by'] for record in results})
+        category = response.data['categories'][results[0]['category']]
+        self.assertEqual((category['id'], category['name']), (results[0]['category'], Category.objects.get(pk=results[0]['category']).name))
+        self.assertEqual(response.data['places'][self.mosque.id]['name'], 'Mosque')
+
+    def test_retrieve_compact(self):
+        record = Record.objects.filter(place=self.mosque).first()
+
+        response = self.client.get(f'/api/record/{record.id}/', {'format': 'compact'})
+
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual((response.data['id'], response.data['category']), (record.id, record.category_id))
+        self.assertEqual(set(response.data['categories']), {record.category_id})
+        self.assertEqual(set(response.data['places']), {self.mosque.id})
+        self.assertEqual(set(response.data['users']), {record.created_by_id})
+
+        # The nested shape stays the default
+        response = self.client.get(f'/api/record/{record.id}/')
+        self.assertEqual(response.data['category']['id'], record.category_id)
+        self.assertNotIn('categories', response.data)
+
+
+@override_settings(AUDIT_LOG_MODE='sync')
+class RecordBulkTest(TestCase):
+    """Bulk records are checked against the places of the caller one by one."""
+
+    def setUp(self):
+        self.region = Place.objects.create(name='Region')
+        self.mosque = Place.objects.create(name='Mosque', parent=self.region, is_mosque=True)
+        self.category = Category.objects.create(name='Donation', operation_type=Category.OperationType.INCOME)
+        self.client = APIClient()
+
+    def test_mosque_admin_other_mosque(self):
+        other_mosque = Place.objects.create(name='Other mosque', parent=self.region, is_mosque=True)
+        user = User.objects.create_user('mosque_admin', 'password', role='mosque_admin', place=self.mosque)
+        self.client.force_authenticate(user)
+
+        response = self.client.post('/api/record/bulk/', [
+            {'category_id': self.category.id, 'amount': '10.00'},
+            {'category_id': self.category.id, 'place_id': other_mosque.id, 'amount': '20.00'},
+        ], format='json')
+
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual([error['index'] for error in response.data['errors']], [1])
+        self.assertEqual(list(Record.objects.values_list('place_id', 'amount')), [(self.mosque.id, 10)])
+
+
+@override_settings(AUDIT_LOG_MODE='sync')
+class RecordCreateQueriesTest(TestCase):
+    """Creating a record is a single insert plus a single audit row."""
+
+    def setUp(self):
+        self.region = Place.objects.create(name='Region')
+        self.mosque = Place.objects.create(name='Mosque', parent=self.region, is_mosque=True)
+        self.category = Category.objects.create(name='Donation', operation_type=Category.OperationType.INCOME)
+        self.client = APIClient()
+
+    def _post_record(self, user):
+        self.client.force_authenticate(user)
+        # The place tree is cached per process, build it before counting
+        get_place_tree()
+        payload = {
+            'category': {'id': self.category.id, 'name': self.category.name, 'operation_type': 'income'},
+            'place': {'id': self.mosque.id, 'name': self.mosque.name},
+            'amount': '100.00',
+            'date': '2024-09-01',
+        }
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post('/api/record/', payload, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        return [query['sql'] for query in context.captured_queries]
+
+    def _assert_single_write(self, queries):
+        self.assertEqual(len([sql for sql in queries if sql.startswith('INSERT INTO "core_record"')]), 1)
+        self.assertEqual(len([sql for sql in queries if sql.startswith('UPDATE "core_record"')]), 0)
+        self.assertEqual(len([sql for sql in queries if sql.startswith('INSERT INTO "core_activitylog"')]), 1)
+
+        record = Record.objects.get()
+        self.assertEqual(record.place_id, self.mosque.id)
+        log = ActivityLog.objects.get(object_type='Record')
+        self.assertEqual((log.action, log.object_id), ('create', record.id))
+        balance = PlaceBalance.objects.get(place=self.mosque)
+        self.assertEqual((balance.net, balance.record_count), (100, 1))
+
+    def test_mosque_admin_create(self):
+        user = User.objects.create_user('mosque_admin', 'password', role='mosque_admin', place=self.mosque)
+
+        queries = self._post_record(user)
+
+        self._assert_single_write(queries)
+        self.assertEqual(len(queries), 15, '\n'.join(queries))
+
+    def test_region_admin_create(self):
+        user = User.objects.create_user('region_admin', 'password', role='region_admin', place=self.region)
+
+        queries = self._post_record(user)
+
+        self._assert_single_write(queries)
+        self.assertEqual(len(queries), 16, '\n'.join(queries))
+
+    def test_region_admin_outside_area(self):
+        other_region = Place.objects.create(name='Other region')
+        user = User.objects.create_user('region_admin', 'password', role='region_admin', place=other_region)
+        self.client.force_authenticate(user)
+
+        response = self.client.post('/api/record/', {
+            'category': {'id': self.category.id, 'name': self.category.name},
+            'place': {'id': self.mosque.id, 'name': self.mosque.name},
+            'amount': '100.00',
+        }, format='json')
+
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Record.objects.exists())
+
+
+@override_settings(AUDIT_LOG_MODE='buffered', AUDIT_LOG_FLUSH_INTERVAL=60)
+class AuditSinkTest(TestCase):
+    """Buffered activity log entries are written when the process stops."""
+
+    def test_stop_writes_queued_entries(self):
+        sink = AuditSink()
+        with self.captureOnCommitCallbacks(execute=True):
+            sink.log(action='create', object_id=1, object_type='Record', description='Record create')
+        self.assertFalse(ActivityLog.objects.exists())
+
+        sink.stop()
+
+        self.assertFalse(sink._thread.is_alive())
+        self.assertEqual(list(ActivityLog.objects.values_list('action', 'object_id')), [('create', 1)])
+
+        # Entries after the stop are written right away
+        with self.captureOnCommitCallbacks(execute=True):
+            sink.log(action='delete', object_id=1, object_type='Record', description='Record delete')
+        self.assertEqual(ActivityLog.objects.count(), 2)
+
+
+@override_settings(AUDIT_LOG_MODE='sync')
+class PlaceImportTest(TestCase):
+    """Importing the same place file again matches every row to the places it created."""
+
+    def setUp(self):
+        self.region = Place.objects.create(name='Region A')
+        # Same name as a parent of the file, but not at the top
+        self.city = Place.objects.create(name='Region B', parent=self.region)
+
+    def _file(self):
+        workbook = Workbook()
+        sheet = workbook.create_sheet()
+        for row, (name, inn) in enumerate([
+            ('Region A', None), ('Mosque 1', '111'), ('Mosque 2', 222), ('Region B', None), ('Mosque 3', '333'),
+        ], start=4):
+            sheet.cell(row=row, column=3, value=name)
+            sheet.cell(row=row, column=4, value=inn)
+        file_obj = io.BytesIO()
+        workbook.save(file_obj)
+        file_obj.seek(0)
+        return file_obj
+
+    def _places(self):
+        return set(Place.objects.values_list('name', 'inn', 'parent__name', 'is_mosque'))
+
+    def test_import_twice(self):
+        self.assertEqual(import_places(self._file()), {'inserted': 4, 'updated': 0, 'skipped': 1})
+        places = self._places()
+        self.assertEqual(places, {
+            ('Region A', '', None, False),
+            ('Region B', '', 'Region A', False),
+            ('Mosque 1', '111', 'Region A', True),
+            ('Mosque 2', '222', 'Region A', True),
+            ('Region B', '', None, False),
+            ('Mosque 3', '333', 'Region B', True),
+        })
+
+        self.assertEqual(import_places(self._file()), {'inserted': 0, 'updated': 0, 'skipped': 5})
+        self.assertEqual(self._places(), places)
+        self.assertEqual(Place.objects.count(), 6)
+
+
+@override_settings(AUDIT_LOG_MODE='sync')
+class RecordImportTest(TestCase):
+    """Imported rows become records, the rejected ones end up in the error file with the reason."""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = self.settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.region = Place.objects.create(name='Region')
+        self.mosque = Place.objects.create(name='Mosque', parent=self.region, is_mosque=True, inn='111')
+        self.other_mosque = Place.objects.create(name='Other mosque', parent=self.region, is_mosque=True, inn='222')
+        self.category = Category.objects.create(name='Donation', operation_type=Category.OperationType.INCOME)
+        self.client = APIClient()
+
+    def _errors(self):
+        _, file_names = default_storage.listdir('imports/errors')
+        self.assertEqual(len(file_names), 1)
+        with default_storage.open(f'imports/errors/{file_names[0]}') as file_obj:
+            return file_names[0], [line.split(',') for line in file_obj.read().decode().splitlines()]
+
+    def test_import_csv(self):
+        self.client.force_authenticate(
+            User.objects.create_user('region_admin', 'password', role='region_admin', place=self.region)
+        )
+        content = (
+            'inn,date,category,amount,quantity,description\n'
+            '111,2025-01-05,donation,10.50,,First\n'
+            '999,2025-01-05,Donation,5,,\n'
+            '222,2025-01-06,Donation,abc,,\n'
+        )
+
+        response = self.client.post('/api/record/import/', {
+            'file': SimpleUploadedFile('records.csv', content.encode()),
+        }, format='multipart')
+
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual((response.data['imported'], response.data['failed']), (1, 2))
+        record = Record.objects.get()
+        self.assertEqual(
+            (record.place_id, record.category_id, record.date, record.amount, record.description),
+            (self.mosque.id, self.category.id, datetime.date(2025, 1, 5), Decimal('10.50'), 'First')
+        )
+
+        file_name, errors = self._errors()
+        self.assertTrue(response.data['errors_file'].endswith(file_name))
+        self.assertEqual(errors, [
+            ['row', 'inn', 'date', 'category', 'amount', 'quantity', 'description', 'error'],
+            ['3', '999', '2025-01-05', 'Donation', '5', '', '', 'inn: Unknown mosque INN'],
+            ['4', '222', '2025-01-06', 'Donation', 'abc', '', '', 'amount: A valid number is required.'],
+        ])
+
+    def test_ambiguous_inn(self):
+        Place.objects.create(name='Mosque with the same INN', parent=self.region, is_mosque=True, inn='111')
+        content = (
+            'inn,date,category,amount,quantity,description\n'
+            '111,2025-01-05,Donation,10,,\n'
+            '222,2025-01-05,Donation,20,,\n'
+        )
+
+        imported, failed, _ = import_records(io.BytesIO(content.encode()), 'records.csv')
+
+        self.assertEqual((imported, failed), (1, 1))
+        self.assertEqual(list(Record.objects.values_list('place_id', flat=True)), [self.other_mosque.id])
+        _, errors = self._errors()
+        self.assertEqual(errors[1], ['2', '111', '2025-01-05', 'Donation', '10', '', '', 'inn: Several mosques have this INN'])
+
+    def test_import_command(self):
+        User.objects.create_user('mosque_admin', 'password', role='mosque_admin', place=self.mosque)
+        workbook = Workbook()
+        sheet = workbook.active
+        sheet.append(['INN', 'Date', 'Category', 'Amount', 'Quantity', 'Description'])
+        sheet.append([111, datetime.datetime(2025, 1, 5), 'Donation', 10, 2, None])
+        # A mosque admin imports the records of their own mosque only
+        sheet.append(['222', datetime.datetime(2025, 1, 5), 'Donation', 20, None, None])
+        sheet.append(['111', None, 'Donation', 30, None, None])
+        path = os.path.join(default_storage.location, 'records.xlsx')
+        workbook.save(path)
+
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command('import_records', path, user='mosque_admin', stdout=stdout, stderr=stderr)
+
+        self.assertIn('Imported 1 records', stdout.getvalue())
+        self.assertIn('2 rows failed', stderr.getvalue())
+        self.assertEqual(list(Record.objects.values_list('place_id', 'amount', 'quantity')), [(self.mosque.id, 10, 2)])
+        _, errors = self._errors()
+        self.assertEqual([(row[0], row[-1]) for row in errors[1:]], [
+            ('3', 'place_id: Place id does not belong to your area'),
+            ('4', 'date: This field is required.'),
+        ])
+
+
+@override_settings(AUDIT_LOG_MODE='sync')
+class RecordExportTest(TestCase):
+    """Exports stream the records of the place subtree within the dates."""
+
+    def setUp(self):
+        self.region = Place.objects.create(name='Region')
+        self.city = Place.objects.create(name='City', parent=self.region)
+        self.mosque = Place.objects.create(name='Mosque', parent=self.city, is_mosque=True)
+        other_mosque = Place.objects.create(name='Other mosque', parent=Place.objects.create(name='Other region'), is_mosque=True)
+        donation = Category.objects.create(name='Donation', operation_type=Category.OperationType.INCOME)
+        rent = Category.objects.create(name='Rent', operation_type=Category.OperationType.EXPENSE)
+        self.records = [
+            Record.objects.create(place=self.mosque, category=donation, amount=10, quantity=2, date='2025-01-05', description='Friday'),
+            Record.objects.create(place=self.mosque, category=rent, amount=30, date='2025-01-02'),
+            # Outside of the dates and of the subtree
+            Record.objects.create(place=self.mosque, category=donation, amount=5, date='2025-02-01'),
+            Record.objects.create(place=other_mosque, category=donation, amount=7, date='2025-01-05'),
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(
+            User.objects.create_user('region_admin', 'password', role='region_admin', place=self.region)
+        )
+
+    def test_csv(self):
+        response = self.client.get('/api/record/export/csv/', {
+            'place_id': self.city.id, 'start': '2025-01-01', 'end': '2025-01-31',
+        })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertIn('attachment', response['Content-Disposition'])
+        self.assertEqual(b''.join(response.streaming_content).decode().splitlines(), [
+            'ID,Date,Place,Category,Operation type,Unit,Amount,Quantity,Description',
+            f'{self.records[1].id},2025-01-02,Mosque,Rent,expense,,30.00,,',
+            f'{self.records[0].id},2025-01-05,Mosque,Donation,income,,10.00,2.00,Friday',
+        ])
+
+    def test_csv_without_dates(self):
+        response = self.client.get('/api/record/export/csv/', {'place_id': self.region.id})
+
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([line.split(',')[0] for line in lines[1:]], [str(record.id) for record in self.records[1::-1] + [self.records[2]]])
+
+    def test_invalid_dates(self):
+        response = self.client.get('/api/record/export/csv/', {
+            'place_id': self.region.id, 'start': '2025-02-01', 'end': '2025-01-01',
+        })
+        self.assertEqual(response.status_code, 400)
+
+
+class HierarchicalReportExcelTest(TestCase):
+    """The workbook has a sheet per region, a region of its own is a single sheet."""
+
+    def _node(self, amount, **children):
+        return {'data': {'periods': ['2025-01'], 'data': [['Donation', amount, amount], ['Жами', amount, amount]]},
+                **children}
+
+    def _region(self):
+        return self._node(30, **{
+            'City 1': self._node(10, **{'Mosque 1': self._node(10)}),
+            'City 2': self._node(20, **{'Mosque 2': self._node(20)}),
+        })
+
+    def _workbook(self, report):
+        with write_hierarchical_report(report) as file_obj:
+            return load_workbook(file_obj)
+
+    def test_region(self):
+        workbook = self._workbook({'Region': self._region()})
+
+        self.assertEqual(workbook.sheetnames, ['Region'])
+        rows = [row[0] for row in workbook['Region'].iter_rows(max_col=1, values_only=True)]
+        # The header row names the region, no row of its own repeats it
+        self.assertEqual(rows[:3], ['Region', 'City 1', 'Mosque 1'])
+        self.assertEqual(rows[-1], 'Region: жами')
+
+    def test_above_regions(self):
+        workbook = self._workbook({'Country': self._node(60, **{'Region A': self._region(), 'Region B': self._region()})})
+
+        self.assertEqual(workbook.sheetnames, ['Жами', 'Region A', 'Region B'])
+        self.assertEqual(workbook['Region A']['A2'].value, 'City 1')
+
+
+@override_settings(AUDIT_LOG_MODE='sync', JOB_EXECUTOR='sync')
+class JobTest(TestCase):
+    """Exports submitted with background=true run as jobs, their result can be downloaded."""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = self.settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.region = Place.objects.create(name='Region')
+        self.mosque = Place.objects.create(name='Mosque', parent=self.region, is_mosque=True)
+        self.category = Category.objects.create(name='Donation', operation_type=Category.OperationType.INCOME)
+        Record.objects.create(place=self.mosque, category=self.category, amount=100)
+        self.user = User.objects.create_user('region_admin', 'password', role='region_admin', place=self.region)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_export_job(self):
+        response = self.client.get(f'/api/record/export/csv/?place_id={self.region.id}&background=true')
+        self.assertEqual(response.status_code, 202, response.content)
+
+        job = self.client.get(f'/api/job/{response.data["id"]}/').data
+        self.assertEqual((job['status'], job['progress'], job['total']), ('succeeded', 1, 1))
+
+        download = self.client.get(job['download_url'])
+        content = b''.join(download.streaming_content).decode()
+        self.assertEqual(len(content.splitlines()), 2)
+        self.assertIn('Mosque,Donation', content)
+
+    def test_cancel_pending_job(self):
+        with self.settings(JOB_EXECUTOR='worker'):
+            job = jobs.submit(Job.Kind.RECORD_EXPORT_CSV, user=self.user, params={'place_id': self.region.id})
+
+        response = self.client.post(f'/api/job/{job.id}/cancel/')
+        self.assertEqual(response.data['status'], 'cancelled')
+
+        # A worker does not pick it up any more
+        self.assertIsNone(jobs.claim_next())
+        self.assertEqual(self.client.post(f'/api/job/{job.id}/cancel/').status_code, 400)
+
+    def test_fail_stale(self):
+        lost = Job.objects.create(kind=Job.Kind.RECORD_EXPORT_CSV, status=Job.Status.RUNNING)
+        alive = Job.objects.create(kind=Job.Kind.RECORD_EXPORT_CSV, status=Job.Status.RUNNING)
+        Job.objects.filter(pk=lost.pk).update(heartbeat_at=timezone.now() - datetime.timedelta(hours=1))
+        Job.objects.filter(pk=alive.pk).update(heartbeat_at=timezone.now())
+
+        self.assertEqual(jobs.fail_stale(), 1)
+        lost.refresh_from_db()
+        self.assertEqual((lost.status, lost.error), (Job.Status.FAILED, 'The process running the job stopped'))
+        self.assertEqual(Job.objects.get(pk=alive.pk).status, Job.Status.RUNNING)
+
+
+class ReportMatrixTest(TestCase):
+    """Report cells are summed as integer tiyin and only turned into sums in the table."""
+
+    def test_to_tiyin(self):
+        self.assertEqual(to_tiyin(Decimal('10.005')), 1001)
+        self.assertEqual(to_tiyin(Decimal('-10.005')), -1001)
+        self.assertEqual(to_tiyin(0.1), 10)
+        self.assertEqual(to_tiyin(7), 700)
+
+    def test_table(self):
+        matrix = ReportMatrix(['2025-01', '2025-02'])
+        matrix.add('Donation', '2025-01', Decimal('0.10'))
+        matrix.add('Donation', '2025-01', Decimal('0.20'))
+        matrix.add('Rent', '2025-02', Decimal('-30.05'))
+        # A period outside of the columns still gives the category its row
+        matrix.add('Zakat', '2024-12', Decimal('5'))
+
+        self.assertEqual(matrix.to_table(), {
+            'periods': ['2025-01', '2025-02'],
+            'data': [
+                ['Donation', 0.3, 0.0, 0.3],
+                ['Rent', 0.0, -30.05, -30.05],
+                ['Zakat', 0.0, 0.0, 0.0],
+                ['Жами', 0.3, -30.05, -29.75],
+            ],
+        })
+
+    def test_add_matrix(self):
+        matrix, child = ReportMatrix(['2025-01']), ReportMatrix(['2025-01'])
+        matrix.add('Donation', '2025-01', Decimal('1.01'))
+        child.add('Rent', '2025-01', Decimal('-0.01'))
+        child.add('Donation', '2025-01', Decimal('0.02'))
+
+        matrix.add_matrix(child)
+
+        self.assertEqual(matrix.to_table()['data'], [['Donation', 1.03, 1.03], ['Rent', -0.01, -0.01], ['Жами', 1.02, 1.02]])
+
+
+@override_settings(AUDIT_LOG_MODE='sync')
+class PlaceBalanceTest(TestCase):
+    """Place balances stay equal to a fresh aggregate of the records."""
+
+    def setUp(self):
+        self.region = Place.objects.create(name='Region')
+        self.mosque = Place.objects.create(name='Mosque', parent=self.region, is_mosque=True)
+        self.other_mosque = Place.objects.create(name='Other mosque', parent=self.region, is_mosque=True)
+        self.income = Category.objects.create(name='Donation', operation_type=Category.OperationType.INCOME)
+        self.expense = Category.objects.create(name='Rent', operation_type=Category.OperationType.EXPENSE)
+        self.record = Record.objects.create(place=self.mosque, category=self.income, amount=100)
+        Record.objects.create(place=self.mosque, category=self.expense, amount=30)
+
+    def assert_balances_match(self):
+        fields = ('place_id', 'income', 'expense', 'net', 'record_count')
+        expected = {
+            tuple(getattr(row, field) for field in fields)
+            for row in PlaceBalance.objects.balance_rows(Record.objects.all())
+        }
+        self.assertEqual(set(PlaceBalance.objects.values_list(*fields)), expected)
+        call_command('rebuild_place_balances', verify=True, stdout=io.StringIO())
+
+    def _balance(self, place):
+        balance = PlaceBalance.objects.get(place=place)
+        return balance.income, balance.expense, balance.net, balance.record_count
+
+    def test_create(self):
+        self.assert_balances_match()
+        self.assertEqual(self._balance(self.mosque), (100, 30, 70, 2))
+
+    def test_update(self):
+        self.record.amount = 60
+        self.record.save()
+        self.assertEqual(self._balance(self.mosque), (60, 30, 30, 2))
+
+        self.record.place = self.other_mosque
+        self.record.save()
+
+        self.assert_balances_match()
+        self.assertEqual(self._balance(self.mosque), (0, 30, -30, 1))
+        self.assertEqual(self._balance(self.other_mosque), (60, 0, 60, 1))
+
+    def test_delete(self):
+        self.record.delete()
+
+        self.assert_balances_match()
+        self.assertEqual(self._balance(self.mosque), (0, 30, -30, 1))
+
+    def test_bulk_create(self):
+        bulk_create_records([
+            Record(place=place, category=category, amount=10)
+            for place in (self.mosque, self.other_mosque)
+            for category in (self.income, self.expense, self.income)
+        ])
+
+        self.assert_balances_match()
+        self.assertEqual(self._balance(self.other_mosque), (20, 10, 10, 3))
+
+    def test_subtree_total(self):
+        Record.objects.create(place=self.other_mosque, category=self.income, amount=5)
+
+        self.assertEqual(PlaceBalance.objects.subtree_total(self.region.id), {
+            'income': 105, 'expense': 30, 'net': 75, 'record_count': 3,
+        })
+        self.assertEqual(PlaceBalance.objects.subtree_total(self.other_mosque.id)['net'], 5)
+
+    def test_rebuild(self):
+        PlaceBalance.objects.filter(place=self.mosque).update(net=0)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_place_balances', verify=True, stdout=io.StringIO(), stderr=io.StringIO())
+
+        call_command('rebuild_place_balances', stdout=io.StringIO())
+
+        self.assert_balances_match()
+
+
+@override_settings(AUDIT_LOG_MODE='sync')
+class RecordReportTest(TestCase):
+    """Report periods are the calendar buckets of the dates, gaps included."""
+
+    def setUp(self):
+        self.mosque = Place.objects.create(name='Mosque', is_mosque=True)
+        self.category = Category.objects.create(name='Donation', operation_type=Category.OperationType.INCOME)
+        for date in ('2024-12-30', '2025-01-01', '2025-01-20'):
+            Record.objects.create(place=self.mosque, category=self.category, amount=10, date=date)
+        self.client = APIClient()
+        self.client.force_authenticate(
+            User.objects.create_user('region_admin', 'password', role='region_admin', place=self.mosque)
+        )
+
+    def _report(self, period, start='2025-01-01'):
+        response = self.client.get(f'/api/record/report/{period}/', {
+            'place_id': self.mosque.id, 'start': start, 'end': '2025-01-20',
+        })
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_weekly_across_year_end(self):
+        # The first week starts on Monday 2024-12-30, a record of that day is outside the range
+        report = self._report('weekly')
+
+        self.assertEqual(report['periods'], ['2024-53', '2025-01', '2025-02', '2025-03'])
+        self.assertEqual(report['data'], [
+            ['Donation', 10.0, 0.0, 0.0, 10.0, 20.0],
+            ['Жами', 10.0, 0.0, 0.0, 10.0, 20.0],
+        ])
+
+    def test_quarterly(self):
+        report = self._report('quarterly')
+
+        self.assertEqual(report['periods'], ['2025-Q1'])
+        self.assertEqual(report['data'][-1], ['Жами', 20.0, 20.0])
+
+    def test_hijri_monthly(self):
+        # 2024-12-30 is 28 Jumada al-Akhirah 1446, 2025-01-01 is 1 Rajab
+        report = self._report('hijri_monthly', start='2024-12-30')
+
+        self.assertEqual(report['periods'], ['1446-06', '1446-07'])
+        self.assertEqual(report['data'][-1], ['Жами', 10.0, 20.0, 30.0])
+
+    def test_invalid_dates(self):
+        for start in ('2025-1-x', '2025-02-30', '2025-02-01'):
+            response = self.client.get(f'/api/record/report-profit/{self.mosque.id}/children/', {
+                'start': start, 'end': '2025-01-20',
+            })
+            self.assertEqual(response.status_code, 400, start)
+
+        response = self.client.get('/api/record/report/monthly/', {
+            'place_id': self.mosque.id, 'start': '2025-02-30', 'end': '2025-03-01',
+        })
+        self.assertEqual(response.status_code, 400)
+
+    def test_days_missing_from_calendar(self):
+        # As on a replica the calendar rows of the last days have not reached yet
+        CalendarDay.objects.fill(datetime.date(2025, 1, 1), datetime.date(2025, 1, 14))
+        days = CalendarDay.objects.count()
+        report = self._report('weekly')
+
+        # The days are bucketed without writing, every amount lands in a column of its totals
+        self.assertEqual(CalendarDay.objects.count(), days)
+        self.assertEqual(report['periods'], ['2024-53', '2025-01', '2025-02', '2025-03'])
+        self.assertEqual(report['data'], [
+            ['Donation', 10.0, 0.0, 0.0, 10.0, 20.0],
+            ['Жами', 10.0, 0.0, 0.0, 10.0, 20.0],
+        ])
+
+        response = self.client.get('/api/record/report-hierarchicallly/monthly/', {
+            'place_id': self.mosque.id, 'start': '2025-01-01', 'end': '2025-01-20',
+        })
+        self.assertEqual(response.json()['Mosque']['data']['data'], [['Donation', 20.0, 20.0], ['Жами', 20.0, 20.0]])
+
+    def test_span_too_long(self):
+        days = CalendarDay.objects.count()
+        for url in ('/api/record/report/daily/', '/api/record/report-hierarchicallly/daily/'):
+            response = self.client.get(url, {'place_id': self.mosque.id, 'start': '0001-01-01', 'end': '9999-12-31'})
+            self.assertEqual(response.status_code, 400, url)
+        self.assertEqual(CalendarDay.objects.count(), days)
+
+
+@override_settings(AUDIT_LOG_MODE='sync', REPLICA_READS=True)
+class ReplicaRoutingTest(TransactionTestCase):
+    """Safe report requests read from the replica, everything else stays on the primary."""
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        # Pins of the users of other tests, whose ids come again
+        cache.clear()
+        self.mosque = Place.objects.create(name='Mosque', is_mosque=True)
+        self.category = Category.objects.create(name='Donation', operation_type=Category.OperationType.INCOME)
+        self.user = User.objects.create_user('mosque_admin', 'password', role='mosque_admin', place=self.mosque)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+    def _request(self, method, path, data=None):
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica']) as replica_queries:
+            response = getattr(self.client, method)(path, data, format='json')
+        self.assertLess(response.status_code, 400, response.content)
+        return [query['sql'] for query in primary], [query['sql'] for query in replica_queries]
+
+    def _get_report(self):
+        return self._request('get', '/api/record/report/monthly/?start=2025-01-01&end=2025-01-31')
+
+    def _post_record(self):
+        return self._request('post', '/api/record/', {
+            'category': {'id': self.category.id, 'name': self.category.name},
+            'place': {'id': self.mosque.id, 'name': self.mosque.name},
+            'amount': '10.00',
+            'date': '2025-01-10',
+        })
+
+    def test_get_report_reads_from_replica(self):
+        primary, replica_queries = self._get_report()
+
+        self.assertTrue(any('"core_recorddailyrollup"' in sql for sql in replica_queries), replica_queries)
+        self.assertFalse(any('"core_recorddailyrollup"' in sql for sql in primary), primary)
+        # The user of the token is looked up on the primary
+        self.assertTrue(any('"core_user"' in sql for sql in primary), primary)
+        self.assertFalse(any('"core_user"' in sql for sql in replica_queries), replica_queries)
+
+    def test_post_stays_on_primary(self):
+        primary, replica_queries = self._post_record()
+
+        self.assertEqual(replica_queries, [])
+        self.assertEqual(Record.objects.using('default').count(), 1)
+
+    def test_pinned_user_reads_from_primary(self):
+        self._post_record()
+
+        primary, replica_queries = self._get_report()
+
+        self.assertEqual(replica_queries, [])
+        self.assertTrue(any('"core_recorddailyrollup"' in sql for sql in primary), primary)
+
+    def test_reads_in_transaction_use_primary(self):
+        router = replica.ReplicaRouter()
+        token = replica._reading_from_replica.set(True)
+        try:
+            self.assertEqual(router.db_for_read(Record), 'replica')
+            with transaction.atomic():
+                self.assertEqual(router.db_for_read(Record), 'default')
+            with replica.primary():
+                self.assertEqual(router.db_for_read(Record), 'default')
+        finally:
+            replica._reading_from_replica.reset(token)
+
+
+class ReportCoalescingTest(TestCase):
+    """Identical reports requested at the same time are computed once."""
+
+    def _request(self, compute, results):
+        # The cache outlives the test, every test reports on a place of its own
+        results.append(report_cache.get_or_compute('test', self.id(), (), compute))
+
+    def test_concurrent_requests_share_one_computation(self):
+        started, release, calls, results = threading.Event(), threading.Event(), [], []
+
+        def compute():
+            calls.append(threading.get_ident())
+            started.set()
+            release.wait(5)
+            return {'total': 100}
+
+        stats = report_cache.coalescing_stats()
+        threads = [threading.Thread(target=self._request, args=(compute, results)) for _ in range(4)]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        # Let the others reach the wait for the first one
+        time.sleep(0.2)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'total': 100}] * 4)
+        new_stats = report_cache.coalescing_stats()
+        for scope in ('process', 'total'):
+            self.assertEqual(new_stats[scope]['computed'] - stats[scope]['computed'], 1)
+            self.assertEqual(new_stats[scope]['coalesced'] - stats[scope]['coalesced'], 3)
+
+    def test_stats_endpoint_is_staff_only(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('region_admin', 'password', role='region_admin'))
+        self.assertEqual(client.get('/api/record/report-cache/stats/').status_code, 403)
+
+        client.force_authenticate(User.objects.create_user('staff', 'password', role='admin', is_staff=True))
+        response = client.get('/api/record/report-cache/stats/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.data), {'process', 'total'})
+        self.assertEqual(set(response.data['total']), {'computed', 'coalesced', 'timed_out'})
+
+    @override_settings(REPORT_COALESCE_TIMEOUT=0.05)
+    def test_wait_timeout(self):
+        release, results = threading.Event(), []
+
+        def slow_compute():
+            release.wait(5)
+            return 'slow'
+
+        stats = report_cache.coalescing_stats()
+        leader = threading.Thread(target=self._request, args=(slow_compute, results))
+        leader.start()
+        for _ in range(500):
+            if report_cache._flights:
+                break
+            time.sleep(0.01)
+
+        # Gives up waiting and computes on its own
+        self._request(lambda: 'own', results)
+        release.set()
+        leader.join(5)
+
+        self.assertEqual(results, ['own', 'slow'])
+        self.assertEqual(report_cache.coalescing_stats()['process']['timed_out'] - stats['process']['timed_out'], 1)
@@ -5,10 +5,13 @@ echo "Applying database migrations..."
 poetry run python manage.py migrate &&
              poetry run python manage.py createsuperuser --no-input || true
 
+# Calendar days of the report periods, ahead of the requests that read them from the replica
+poetry run python manage.py fill_calendar
+
 # Collect static files
 echo "Collecting static files..."
 poetry run python manage.py collectstatic --noinput
 
-# Start the Gunicorn server
+# Start the Gunicorn server, threaded workers (see gunicorn.conf.py)
 echo "Starting server..."
-poetry run gunicorn mosques_app.wsgi:application --bind 0.0.0.0:8000
+poetry run gunicorn mosques_app.wsgi:application --config gunicorn.conf.py
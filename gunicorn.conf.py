@@ -0,0 +1,49 @@
+"""
+Gunicorn settings, read from the working directory when the server starts.
+
+Threaded workers serve requests concurrently: a slow hierarchical report
+holds one thread while the other report and lookup requests of the
+dashboard are served next to it. The reports spend most of their time
+waiting on the database, so threads parallelize them well.
+
+The place tree, report cache versions and replica pins live in the Django
+cache. With the default local memory cache every worker process has its
+own copy and would serve stale data after another worker's writes, so run
+one worker and scale with threads, or configure a shared CACHE_BACKEND
+before raising GUNICORN_WORKERS.
+"""
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+worker_class = 'gthread'
+workers = int(os.getenv('GUNICORN_WORKERS', 1))
+threads = int(os.getenv('GUNICORN_THREADS', 16))
+# Large reports and exports outlive the default 30 seconds
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+graceful_timeout = 30
+
+
+def on_starting(server):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mosques_app.settings')
+    from django.conf import settings
+
+    backend = settings.CACHES['default']['BACKEND']
+    if server.cfg.workers > 1 and backend.endswith('.LocMemCache'):
+        raise SystemExit(
+            f'{server.cfg.workers} workers do not share the local memory cache, '
+            'set CACHE_BACKEND to a shared cache or GUNICORN_WORKERS=1'
+        )
+
+
+def post_worker_init(worker):
+    # Jobs left pending or running by the previous workers, see core.jobs.resume
+    from core import jobs
+
+    jobs.resume()
+
+
+def worker_exit(server, worker):
+    # The buffered activity log entries of the worker, see core.audit
+    from core.audit import audit_log
+
+    audit_log.stop()
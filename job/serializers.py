@@ -0,0 +1,22 @@
+from rest_framework import serializers
+
+from core.models import Job
+
+
+class JobSerializer(serializers.ModelSerializer):
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Job
+        fields = [
+            'id', 'kind', 'status', 'progress', 'total', 'result', 'error', 'cancel_requested',
+            'download_url', 'created_at', 'started_at', 'finished_at',
+        ]
+        read_only_fields = fields
+
+    def get_download_url(self, job):
+        if not job.result_file:
+            return None
+        request = self.context.get('request')
+        url = f'/api/job/{job.pk}/download/'
+        return request.build_absolute_uri(url) if request else url
@@ -0,0 +1,16 @@
+"""
+URL mappings for the job API.
+"""
+from django.urls import path, include
+from rest_framework.routers import DefaultRouter
+
+from job import views
+
+app_name = 'job'
+
+router = DefaultRouter()
+router.register('', views.JobView, basename='jobs')
+
+urlpatterns = [
+    path('', include(router.urls)),
+]
@@ -0,0 +1,44 @@
+from django.http import FileResponse
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import extend_schema
+from rest_framework import permissions, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.response import Response
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from core import jobs
+from core.models import Job
+from job.serializers import JobSerializer
+
+
+class JobView(viewsets.ReadOnlyModelViewSet):
+    """
+    Jobs of the current user. Jobs are submitted by the endpoints that support
+    `background=true` (place and record imports, record exports, the hierarchical report workbook).
+    """
+    authentication_classes = [JWTAuthentication]
+    serializer_class = JobSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return Job.objects.filter(created_by=self.request.user)
+
+    @extend_schema(request=None, responses={200: JobSerializer})
+    @action(detail=True, methods=['post'])
+    def cancel(self, request, *args, **kwargs):
+        job = self.get_object()
+        if not jobs.cancel(job):
+            raise ValidationError('Job has finished already')
+        job.refresh_from_db()
+        return Response(self.get_serializer(job).data)
+
+    @extend_schema(responses={(200, 'application/octet-stream'): OpenApiTypes.BINARY})
+    @action(detail=True, methods=['get'])
+    def download(self, request, *args, **kwargs):
+        job = self.get_object()
+        if not job.result_file:
+            raise NotFound('Job has no result file')
+        return FileResponse(
+            job.result_file.open('rb'), as_attachment=True, filename=job.result_file.name.rsplit('/', 1)[-1]
+        )
@@ -52,6 +52,7 @@ INSTALLED_APPS = [
     'drf_spectacular',
     'category',
     'core',
+    'job',
     'place',
     'record',
     'unit',
@@ -66,6 +67,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.replica.ReplicaPinMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -113,6 +115,58 @@ DATABASES = {
     'default': db
 }
 
+# Read replica, see core.replica: safe requests of the report and list views read from it.
+# Without REPLICA_DATABASE_URL the alias is the primary itself and nothing reads from it.
+REPLICA_DATABASE_URL = os.getenv('REPLICA_DATABASE_URL')
+REPLICA_READS = bool(REPLICA_DATABASE_URL)
+DATABASES['replica'] = dj_database_url.parse(REPLICA_DATABASE_URL) if REPLICA_DATABASE_URL else dict(db)
+# Tests use the primary test database through the replica alias
+DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+DATABASE_ROUTERS = ['core.replica.ReplicaRouter']
+# Seconds the replica may lag behind; users read from the primary this long after they changed something
+REPLICA_MAX_LAG = int(os.getenv('REPLICA_MAX_LAG', 5))
+
+# Covering indexes (Index.include) are PostgreSQL only, other backends create them without the extra columns
+SILENCED_SYSTEM_CHECKS = ['models.W040']
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# Local memory is per process, use a shared backend (file based, database, redis) when running
+# several gunicorn workers or a separate run_jobs worker
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'mosques-app'),
+    }
+}
+
+REPORT_CACHE_ALIAS = 'default'
+# Longest date range of a report, its columns and calendar buckets are worked out per day
+REPORT_MAX_DAYS = int(os.getenv('REPORT_MAX_DAYS', 10 * 366))
+REPORT_CACHE_TIMEOUT = int(os.getenv('REPORT_CACHE_TIMEOUT', 60 * 60))
+# Seconds a report request waits for an identical one in progress before computing it itself
+REPORT_COALESCE_TIMEOUT = float(os.getenv('REPORT_COALESCE_TIMEOUT', 30))
+# Seconds between two log lines with the counts of computed and coalesced reports
+REPORT_STATS_LOG_INTERVAL = int(os.getenv('REPORT_STATS_LOG_INTERVAL', 5 * 60))
+
+# Activity log
+# 'buffered' writes entries in batches from a background thread, 'sync' writes them right away
+
+AUDIT_LOG_MODE = os.getenv('AUDIT_LOG_MODE', 'buffered')
+AUDIT_LOG_BATCH_SIZE = int(os.getenv('AUDIT_LOG_BATCH_SIZE', 200))
+AUDIT_LOG_FLUSH_INTERVAL = float(os.getenv('AUDIT_LOG_FLUSH_INTERVAL', 2))
+
+# Background jobs
+# 'thread' runs them in a pool of the web process, 'worker' leaves them to the
+# run_jobs command, 'sync' runs them right away. Jobs lost with a restart are
+# picked up or failed by the web process (gunicorn post_worker_init) or run_jobs.
+
+JOB_EXECUTOR = os.getenv('JOB_EXECUTOR', 'thread')
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 2))
+# Seconds without a heartbeat after which a running job is considered lost with its process and failed
+JOB_STALE_AFTER = int(os.getenv('JOB_STALE_AFTER', 10 * 60))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -36,6 +36,7 @@ urlpatterns = [
     path('api/category/', include('category.urls'), name='category'),
     path('api/place/', include('place.urls'), name='place'),
     path('api/record/', include('record.urls'), name='record'),
+    path('api/job/', include('job.urls'), name='job'),
 ]
 
 if settings.DEBUG:
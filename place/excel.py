@@ -1,14 +1,18 @@
 # views.py
-from drf_spectacular.utils import extend_schema
+from drf_spectacular.utils import extend_schema, OpenApiParameter
 from rest_framework.exceptions import PermissionDenied
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView
 from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
 from rest_framework import status
+from django.db import transaction
 from openpyxl import load_workbook
 
-from core.models import Place
+from core import jobs, place_tree, report_cache
+from core.audit import audit_log
+from core.models import Job, Place, PlaceClosure
+from job.serializers import JobSerializer
 
 
 class UploadExcelView(APIView):
@@ -30,11 +34,26 @@ class UploadExcelView(APIView):
             }
         },
         responses={
-            201: {'type': 'object', 'properties': {'status': {'type': 'string'}}},
+            201: {
+                'type': 'object',
+                'properties': {
+                    'status': {'type': 'string'},
+                    'inserted': {'type': 'integer'},
+                    'updated': {'type': 'integer'},
+                    'skipped': {'type': 'integer'},
+                },
+            },
             400: {'type': 'object', 'properties': {'error': {'type': 'string'}}},
             500: {'type': 'object', 'properties': {'error': {'type': 'string'}}},
         },
-        description='Upload an Excel file to populate the database with hierarchical place data.',
+        description=(
+            'Upload an Excel file to populate the database with hierarchical place data. '
+            'Places that already exist (by INN or name under the same parent) are updated, not duplicated. '
+            'With `background=true` the import runs as a job, see /api/job/.'
+        ),
+        parameters=[
+            OpenApiParameter(name='background', description="'true' to run as a job", required=False, type=bool),
+        ],
         tags=['Place Upload'],
     )
     def post(self, request):
@@ -47,29 +66,180 @@ class UploadExcelView(APIView):
         if not file_obj:
             return Response({'error': 'No file provided.'}, status=status.HTTP_400_BAD_REQUEST)
 
+        if jobs.is_requested(request):
+            job = jobs.submit(
+                Job.Kind.PLACE_IMPORT, user=current_user, input_file=file_obj,
+                params={'ip_address': request.META.get('REMOTE_ADDR')},
+            )
+            return Response(JobSerializer(job, context={'request': request}).data, status=status.HTTP_202_ACCEPTED)
+
         try:
-            # Load the workbook
-            workbook = load_workbook(filename=file_obj)
-            # Select the second sheet (index starts from 0)
-            sheet = workbook.worksheets[1]
-
-            parent_place = None
-
-            # Iterate over the rows starting from C4
-            for row in sheet.iter_rows(min_row=4, min_col=3, max_col=4, values_only=True):
-                place_name, inn = row
-                if place_name:
-                    if not inn:
-                        # This is a parent place
-                        parent_place = Place.objects.create(name=place_name, is_mosque=False)
-                    else:
-                        # This is a child place
-                        Place.objects.create(name=place_name, inn=inn, parent=parent_place, is_mosque=True)
-                else:
-                    # Skip rows without a place name
-                    continue
-
-            return Response({'status': 'Data uploaded successfully.'}, status=status.HTTP_201_CREATED)
+            summary = import_places(file_obj, user=current_user, ip_address=request.META.get('REMOTE_ADDR'))
+
+            return Response({'status': 'Data uploaded successfully.', **summary}, status=status.HTTP_201_CREATED)
 
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class _ParentEntry:
+    """A parent place with its children indexed by INN and by name."""
+
+    def __init__(self, place):
+        self.place = place
+        self.children_by_inn = {}
+        self.children_by_name = {}
+
+    def add_child(self, child):
+        if child.inn:
+            self.children_by_inn.setdefault(child.inn, child)
+        self.children_by_name.setdefault(child.name, child)
+
+
+def _cell_text(value):
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        # INNs typed as numbers come back as floats
+        value = int(value)
+    return str(value).strip()
+
+
+class PlaceImport:
+    """
+    Streams (name, INN) rows into Place. A row without INN is a parent place,
+    rows with INN are mosques under the last parent. Existing places are matched
+    by name among the top-level places (parents) and by INN or name under their
+    parent (mosques), so importing the same file twice changes nothing. Writes are batched with bulk_create/bulk_update.
+    """
+
+    def __init__(self, user=None, ip_address=None, batch_size=500):
+        self.user = user
+        self.ip_address = ip_address
+        self.batch_size = batch_size
+        self.summary = {'inserted': 0, 'updated': 0, 'skipped': 0}
+
+        self._new_parents = []
+        self._new_children = []
+        self._updated_children = {}
+        # Mosques already matched by a row of this file, later duplicates leave them as they are
+        self._seen = set()
+
+        self._parents = {}
+        parents_by_id = {}
+        # Parents are created at the top, a city deeper in the tree with the same name is not one of them
+        for place in Place.objects.filter(is_mosque=False, parent__isnull=True).order_by('-id'):
+            # The oldest place wins when several share a name
+            self._parents[place.name] = parents_by_id[place.id] = _ParentEntry(place)
+        self._root = _ParentEntry(None)
+        for child in Place.objects.filter(is_mosque=True).only('id', 'name', 'inn', 'parent_id').order_by('-id'):
+            entry = self._root if child.parent_id is None else parents_by_id.get(child.parent_id)
+            if entry is not None:
+                entry.add_child(child)
+        self._current = self._root
+
+    def add_row(self, name, inn):
+        name, inn = _cell_text(name), _cell_text(inn)
+        if not name:
+            return
+
+        if not inn:
+            self._add_parent(name)
+        else:
+            self._add_child(name, inn)
+
+        if len(self._new_parents) + len(self._new_children) + len(self._updated_children) >= self.batch_size:
+            self.flush()
+
+    def _add_parent(self, name):
+        entry = self._parents.get(name)
+        if entry is None:
+            entry = self._parents[name] = _ParentEntry(Place(name=name, is_mosque=False))
+            self._new_parents.append(entry.place)
+            self.summary['inserted'] += 1
+        else:
+            self.summary['skipped'] += 1
+        self._current = entry
+
+    def _add_child(self, name, inn):
+        entry = self._current
+        child = entry.children_by_inn.get(inn) or entry.children_by_name.get(name)
+        if child is not None and id(child) in self._seen:
+            self.summary['skipped'] += 1
+            return
+        if child is None:
+            child = Place(name=name, inn=inn, parent=entry.place, is_mosque=True)
+            self._new_children.append(child)
+            self.summary['inserted'] += 1
+        elif child.name != name or child.inn != inn:
+            child.name, child.inn = name, inn
+            self._updated_children[id(child)] = child
+            self.summary['updated'] += 1
+        else:
+            self.summary['skipped'] += 1
+        self._seen.add(id(child))
+        entry.add_child(child)
+
+    def flush(self):
+        if self._new_parents:
+            Place.objects.bulk_create(self._new_parents, batch_size=self.batch_size)
+        if self._new_children:
+            # bulk_create picks up the ids of parents created just above
+            Place.objects.bulk_create(self._new_children, batch_size=self.batch_size)
+        PlaceClosure.objects.attach_many(self._new_parents + self._new_children)
+
+        updated = list(self._updated_children.values())
+        if updated:
+            Place.objects.bulk_update(updated, ['name', 'inn'], batch_size=self.batch_size)
+
+        audit_log.log_many(
+            [self._audit_entry(place, 'create') for place in self._new_parents + self._new_children] +
+            [self._audit_entry(place, 'update') for place in updated]
+        )
+
+        self._new_parents, self._new_children, self._updated_children = [], [], {}
+
+    def _audit_entry(self, place, action):
+        return dict(
+            user=self.user,
+            action=action,
+            object_id=place.pk,
+            object_type=Place.__name__,
+            description=f'{Place.__name__} {action}',
+            ip_address=self.ip_address,
+        )
+
+
+def import_places(file_obj, user=None, ip_address=None, progress=None):
+    """
+    Import places from the second sheet (columns C:D from row 4) in one transaction, returns the summary.
+    progress(rows done, rows total or None) is called for every row.
+    """
+    workbook = load_workbook(filename=file_obj, read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[1]
+        total = sheet.max_row - 3 if sheet.max_row else None
+        with transaction.atomic():
+            place_import = PlaceImport(user=user, ip_address=ip_address)
+            rows = sheet.iter_rows(min_row=4, min_col=3, max_col=4, values_only=True)
+            for done, (place_name, inn) in enumerate(rows, start=1):
+                place_import.add_row(place_name, inn)
+                if progress is not None:
+                    progress(done, total)
+            place_import.flush()
+
+            # bulk_create/bulk_update do not send the signals that usually take care of these
+            place_tree.invalidate()
+            report_cache.invalidate_all()
+    finally:
+        workbook.close()
+
+    return place_import.summary
+
+
+def run_import_job(job, context):
+    """Job handler of Job.Kind.PLACE_IMPORT"""
+    with job.input_file.open('rb') as file_obj:
+        return import_places(
+            file_obj, user=job.created_by, ip_address=job.params.get('ip_address'), progress=context.progress
+        )
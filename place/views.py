@@ -8,6 +8,8 @@ from core.pagination import CustomPagination
 from core.permissions.IsNotMosqueAdmin import IsNotMosqueAdmin
 from place.serializers import PlaceSerializer
 from core.models import Place
+from core.place_tree import get_place_tree
+from core.replica import ReplicaReadsMixin
 
 class PlaceDetailView(generics.RetrieveAPIView):
     queryset = Place.objects.all()
@@ -15,7 +17,7 @@ class PlaceDetailView(generics.RetrieveAPIView):
     permission_classes = [IsAuthenticated]
     lookup_field = 'id'
 
-class PlaceViewMosques(generics.ListAPIView):
+class PlaceViewMosques(ReplicaReadsMixin, generics.ListAPIView):
     serializer_class = PlaceSerializer
     permission_classes = [IsAuthenticated]
     pagination_class = CustomPagination
@@ -48,7 +50,7 @@ class PlaceViewMosques(generics.ListAPIView):
         return queryset
 
 # Create your views here.
-class PlaceView(generics.ListAPIView):
+class PlaceView(ReplicaReadsMixin, generics.ListAPIView):
     serializer_class = PlaceSerializer
     permission_classes = [IsNotMosqueAdmin]
     pagination_class = CustomPagination
@@ -59,22 +61,11 @@ class PlaceView(generics.ListAPIView):
         if place_id == user_place_id:
             return True
 
-        found_place = Place.objects.get(pk = place_id)
-        if found_place is not None:
-            parent = found_place.parent
-            while parent is not None:
-                if parent.id == user_place_id:
-                    return True
-
-        return False
+        return get_place_tree().is_descendant(place_id, user_place_id)
 
     @staticmethod
     def _get_city_parent_id(place_id):
-        place = Place.objects.get(pk=place_id)
-        if place is not None and place.parent is not None:
-            return place.parent.id
-        else:
-            return None
+        return get_place_tree().parent(place_id)
 
     @extend_schema(
         parameters=[
@@ -0,0 +1,77 @@
+"""
+Streaming export of the records under a place.
+
+Rows are read through a server-side cursor with the category, unit and place
+names joined in, and written out as they come, so memory does not depend on
+the number of records.
+"""
+import csv
+import io
+import tempfile
+
+from openpyxl import Workbook
+
+from core.models import Place, Record
+
+HEADER = ('ID', 'Date', 'Place', 'Category', 'Operation type', 'Unit', 'Amount', 'Quantity', 'Description')
+
+CHUNK_SIZE = 2000
+
+
+def export_queryset(place_id, start=None, end=None):
+    """Records of the place and everything under it"""
+    records = Record.objects.filter(place__in=Place.objects.descendants_of(place_id).values('id'))
+    if start is not None:
+        records = records.filter(date__gte=start)
+    if end is not None:
+        records = records.filter(date__lte=end)
+    return records
+
+
+def export_rows(place_id, start=None, end=None):
+    """Records of the place and everything under it, as tuples in HEADER order"""
+    return export_queryset(place_id, start, end).order_by('date', 'id').values_list(
+        'id', 'date', 'place__name', 'category__name', 'category__operation_type', 'category__unit__name',
+        'amount', 'quantity', 'description',
+    ).iterator(chunk_size=CHUNK_SIZE)
+
+
+class _Echo:
+    """File-like object whose write() returns the data, for csv.writer in a generator"""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(HEADER)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def write_csv(rows):
+    """The rows as CSV in a temporary file, positioned at its start"""
+    file_obj = tempfile.TemporaryFile()
+    text = io.TextIOWrapper(file_obj, encoding='utf-8', newline='')
+    writer = csv.writer(text)
+    writer.writerow(HEADER)
+    writer.writerows(rows)
+    text.flush()
+    text.detach()
+    file_obj.seek(0)
+    return file_obj
+
+
+def write_xlsx(rows):
+    """The rows as an xlsx workbook in a temporary file, positioned at its start"""
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Records')
+    sheet.append(HEADER)
+    for row in rows:
+        sheet.append(row)
+
+    file_obj = tempfile.TemporaryFile()
+    workbook.save(file_obj)
+    file_obj.seek(0)
+    return file_obj
@@ -0,0 +1,175 @@
+"""
+Import of historical records from XLSX or CSV.
+
+Rows are (mosque INN, date, category name, amount, quantity, description)
+below a header row. The file is read as a stream and records are written
+with bulk_create in batches, so memory stays flat however long the file is.
+Rows that cannot be imported go to a CSV error file.
+"""
+import csv
+import io
+import tempfile
+import uuid
+from datetime import datetime
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from openpyxl import load_workbook
+
+from core.models import Category, Place, Record
+from core.place_tree import get_place_tree
+from core.records import bulk_create_records
+from record.serializers import RecordBulkItemSerializer
+
+COLUMNS = ('inn', 'date', 'category', 'amount', 'quantity', 'description')
+
+
+def read_rows(file_obj, file_name):
+    """(row number, values) of every row below the header"""
+    if file_name.lower().endswith('.csv'):
+        text = io.TextIOWrapper(file_obj, encoding='utf-8-sig', newline='')
+        try:
+            reader = csv.reader(text)
+            next(reader, None)
+            yield from enumerate(reader, start=2)
+        finally:
+            # Leave closing the file to its owner
+            text.detach()
+        return
+
+    workbook = load_workbook(filename=file_obj, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(min_row=2, max_col=len(COLUMNS), values_only=True)
+        yield from enumerate(rows, start=2)
+    finally:
+        workbook.close()
+
+
+def _cell_text(value):
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+class RecordImport:
+    def __init__(self, user=None, ip_address=None, batch_size=1000):
+        self.user = user
+        self.ip_address = ip_address
+        self.batch_size = batch_size
+        self.imported = 0
+        self.failed = 0
+
+        places = list(Place.objects.filter(is_mosque=True).only('id', 'is_mosque', 'inn'))
+        categories = list(Category.objects.all())
+        self._place_ids = {}
+        # INNs shared by several mosques do not tell which one a row is for
+        self._ambiguous_inns = set()
+        for place in places:
+            inn = place.inn.strip()
+            if inn in self._place_ids:
+                self._ambiguous_inns.add(inn)
+            elif inn:
+                self._place_ids[inn] = place.id
+        self._category_ids = {category.name.strip().lower(): category.id for category in categories}
+        self._context = {
+            'user': user,
+            'places': {place.id: place for place in places},
+            'categories': {category.id: category for category in categories},
+            'tree': get_place_tree(),
+        }
+        self._records = []
+        self._errors_file = self._errors_text = self._errors = None
+
+    def add_row(self, number, values):
+        values = (list(values) + [None] * len(COLUMNS))[:len(COLUMNS)]
+        if all(value in (None, '') for value in values):
+            return
+
+        inn, date, category, amount, quantity, description = values
+        inn, category = _cell_text(inn), _cell_text(category)
+        if isinstance(date, datetime):
+            date = date.date()
+
+        if inn and inn not in self._place_ids:
+            return self._add_error(number, values, {'inn': ['Unknown mosque INN']})
+        if inn in self._ambiguous_inns:
+            return self._add_error(number, values, {'inn': ['Several mosques have this INN']})
+        if category.lower() not in self._category_ids:
+            return self._add_error(number, values, {'category': ['Unknown category']})
+        if not date:
+            # Historical records without a date would all land on today
+            return self._add_error(number, values, {'date': ['This field is required.']})
+
+        serializer = RecordBulkItemSerializer(data={
+            'category_id': self._category_ids[category.lower()],
+            'place_id': self._place_ids.get(inn),
+            'date': date,
+            'amount': amount,
+            'quantity': quantity if quantity not in ('', None) else None,
+            'description': _cell_text(description) or None,
+        }, context=self._context)
+        if not serializer.is_valid():
+            return self._add_error(number, values, serializer.errors)
+
+        data = serializer.validated_data
+        self._records.append(Record(
+            category=self._context['categories'][data['category_id']],
+            place_id=data['place_id'],
+            date=data['date'],
+            amount=data['amount'],
+            quantity=data.get('quantity'),
+            description=data.get('description'),
+            created_by=self.user,
+        ))
+        if len(self._records) >= self.batch_size:
+            self.flush()
+
+    def _add_error(self, number, values, errors):
+        if self._errors is None:
+            self._errors_file = tempfile.TemporaryFile()
+            self._errors_text = io.TextIOWrapper(self._errors_file, encoding='utf-8', newline='')
+            self._errors = csv.writer(self._errors_text)
+            self._errors.writerow(('row',) + COLUMNS + ('error',))
+        message = '; '.join(f'{field}: {" ".join(map(str, messages))}' for field, messages in errors.items())
+        self._errors.writerow([number] + ['' if value is None else value for value in values] + [message])
+        self.failed += 1
+
+    def flush(self):
+        """Write the pending records, each batch in its own transaction."""
+        records, self._records = self._records, []
+        self.imported += len(bulk_create_records(
+            records, user=self.user, ip_address=self.ip_address, batch_size=self.batch_size
+        ))
+
+    def save_errors(self):
+        """Store the error file, returns its storage name or None when every row was imported."""
+        if self._errors is None:
+            return None
+        self._errors_text.flush()
+        self._errors_text.detach()
+        self._errors_file.seek(0)
+        try:
+            return default_storage.save(
+                f'imports/errors/records-{timezone.now():%Y%m%d%H%M%S}-{uuid.uuid4().hex[:8]}.csv',
+                File(self._errors_file)
+            )
+        finally:
+            self._errors_file.close()
+            self._errors_file = self._errors_text = self._errors = None
+
+
+def import_records(file_obj, file_name, user=None, ip_address=None, batch_size=1000, progress=None):
+    """
+    Import the file, returns (imported, failed, storage name of the error file or None).
+    progress(rows done) is called for every row.
+    """
+    record_import = RecordImport(user=user, ip_address=ip_address, batch_size=batch_size)
+    for number, values in read_rows(file_obj, file_name):
+        record_import.add_row(number, values)
+        if progress is not None:
+            progress(number - 1)
+    record_import.flush()
+    return record_import.imported, record_import.failed, record_import.save_errors()
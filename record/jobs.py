@@ -0,0 +1,59 @@
+"""
+Job handlers of the record imports, exports and reports, see core.jobs.
+"""
+from django.utils.dateparse import parse_date
+
+from record.exporter import export_queryset, export_rows, write_csv, write_xlsx
+from record.importer import import_records
+from record.report_excel import write_hierarchical_report
+from record.views import RecordHierarchicallyReportExcelView
+
+
+def run_import_job(job, context):
+    with job.input_file.open('rb') as file_obj:
+        imported, failed, errors_file = import_records(
+            file_obj, job.input_file.name, user=job.created_by, ip_address=job.params.get('ip_address'),
+            progress=context.progress,
+        )
+    if errors_file:
+        context.set_result_file(errors_file)
+    return {'imported': imported, 'failed': failed}
+
+
+def _export_params(job):
+    params = job.params
+    return params['place_id'], params.get('start') and parse_date(params['start']), params.get('end') and parse_date(params['end'])
+
+
+def _reporting(rows, context, total):
+    for done, row in enumerate(rows, start=1):
+        context.progress(done, total)
+        yield row
+
+
+def run_export_csv_job(job, context):
+    params = _export_params(job)
+    total = export_queryset(*params).count()
+    with write_csv(_reporting(export_rows(*params), context, total)) as file_obj:
+        context.save_result_file('records.csv', file_obj)
+    return {'rows': total}
+
+
+def run_export_xlsx_job(job, context):
+    params = _export_params(job)
+    total = export_queryset(*params).count()
+    with write_xlsx(_reporting(export_rows(*params), context, total)) as file_obj:
+        context.save_result_file('records.xlsx', file_obj)
+    return {'rows': total}
+
+
+def run_report_hierarchically_job(job, context):
+    params = job.params
+    context.progress(0, 2)
+    report = RecordHierarchicallyReportExcelView().get_cached_report(
+        params['period'], params['place_id'], parse_date(params['start']), parse_date(params['end'])
+    )
+    context.progress(1, 2)
+    with write_hierarchical_report(report) as file_obj:
+        context.save_result_file(f"report-{params['period']}.xlsx", file_obj)
+    return None
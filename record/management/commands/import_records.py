@@ -0,0 +1,31 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import User
+from record.importer import import_records
+
+
+class Command(BaseCommand):
+    help = 'Import historical records from an XLSX or CSV file (mosque INN, date, category, amount, quantity, description)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Path of the .xlsx or .csv file')
+        parser.add_argument('--user', help='Username the records are created by')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of records per transaction')
+
+    def handle(self, *args, path, user=None, batch_size=1000, **options):
+        if not path.lower().endswith(('.csv', '.xlsx')):
+            raise CommandError('Expected an .xlsx or .csv file')
+
+        if user is not None:
+            try:
+                user = User.objects.get(username=user)
+            except User.DoesNotExist:
+                raise CommandError(f'User "{user}" does not exist')
+
+        with open(path, 'rb') as file_obj:
+            imported, failed, errors_file = import_records(file_obj, path, user=user, batch_size=batch_size)
+
+        self.stdout.write(self.style.SUCCESS(f'Imported {imported} records'))
+        if errors_file:
+            self.stderr.write(f'{failed} rows failed, see {default_storage.path(errors_file)}')
@@ -0,0 +1,6 @@
+from rest_framework.renderers import JSONRenderer
+
+
+class CompactJSONRenderer(JSONRenderer):
+    """Plain JSON, selected with ?format=compact. Views check it to switch to the compact representation."""
+    format = 'compact'
@@ -0,0 +1,125 @@
+"""
+The hierarchical report as an Excel workbook.
+
+Takes the same dict as the JSON endpoint returns ({place name: node}, every
+node holds its children by name and the totals of its subtree under 'data')
+and writes it in openpyxl write-only mode: one sheet per region, rows of
+cities and mosques grouped under their parent, followed by their subtotals.
+A report of a region (region, city, mosque) or of a smaller place is a
+single sheet, a report of the places above the regions gets a summary
+sheet and a sheet per region.
+"""
+import tempfile
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Font
+from openpyxl.utils import get_column_letter
+
+TOTAL_LABEL = 'Жами'
+NUMBER_FORMAT = '#,##0.00'
+# Excel does not group deeper than this
+MAX_OUTLINE_LEVEL = 7
+INVALID_TITLE_CHARACTERS = str.maketrans({character: ' ' for character in '[]:*?/\\'})
+
+
+def _children(node):
+    return [(name, child) for name, child in node.items() if name != 'data']
+
+
+def _sheet_title(name, used):
+    base = (name.translate(INVALID_TITLE_CHARACTERS).strip() or 'Sheet')[:31]
+    title, number = base, 1
+    while title.lower() in used:
+        number += 1
+        suffix = f' ({number})'
+        title = base[:31 - len(suffix)] + suffix
+    used.add(title.lower())
+    return title
+
+
+class _SheetWriter:
+    def __init__(self, workbook, title, periods):
+        self.sheet = workbook.create_sheet(title)
+        self.periods = periods
+        self._row = 0
+
+        # Column styles have to be set before the first row
+        self.sheet.column_dimensions['A'].width = 45
+        for index in range(2, len(periods) + 3):
+            self.sheet.column_dimensions[get_column_letter(index)].width = 14
+        self.sheet.freeze_panes = 'B2'
+
+    def append(self, values, level=0, bold=False, indent=0):
+        self._row += 1
+        if level:
+            self.sheet.row_dimensions[self._row].outlineLevel = min(level, MAX_OUTLINE_LEVEL)
+
+        cells = []
+        for index, value in enumerate(values):
+            cell = WriteOnlyCell(self.sheet, value=value)
+            if bold:
+                cell.font = Font(bold=True)
+            if index == 0 and indent:
+                cell.alignment = Alignment(indent=indent)
+            if isinstance(value, (int, float)):
+                cell.number_format = NUMBER_FORMAT
+            cells.append(cell)
+        self.sheet.append(cells)
+        # Written already, the dimension is not needed any more
+        self.sheet.row_dimensions.pop(self._row, None)
+
+    def header(self, title):
+        self.append([title] + list(self.periods) + [TOTAL_LABEL], bold=True)
+
+    def place(self, name, node, depth=0, title=True):
+        """
+        The place, its children and then its totals by category and its subtotal.
+        The place of the sheet has its name in the header row already, title=False leaves it out.
+        """
+        if title:
+            self.append([name], level=depth, bold=True, indent=depth)
+        for child_name, child in _children(node):
+            self.place(child_name, child, depth + 1)
+
+        *category_rows, total_row = node['data']['data']
+        for row in category_rows:
+            self.append(row, level=depth + 1, indent=depth + 1)
+        self.append([f'{name}: {TOTAL_LABEL.lower()}'] + total_row[1:], level=depth, bold=True, indent=depth)
+
+
+def write_hierarchical_report(report):
+    """The report as an xlsx workbook in a temporary file, positioned at its start"""
+    (root_name, root), = report.items()
+    periods = root['data']['periods']
+    regions = _children(root)
+
+    workbook = Workbook(write_only=True)
+    used_titles = set()
+
+    # Regions hold cities that hold mosques, a root whose grandchildren have children is above them
+    above_regions = any(_children(city) for _, region in regions for _, city in _children(region))
+    if not above_regions:
+        # A region (or a smaller place) itself, it gets a single sheet
+        sheet = _SheetWriter(workbook, _sheet_title(root_name, used_titles), periods)
+        sheet.header(root_name)
+        sheet.place(root_name, root, title=False)
+    else:
+        summary = _SheetWriter(workbook, _sheet_title(TOTAL_LABEL, used_titles), periods)
+        summary.header(root_name)
+        for region_name, region in regions:
+            summary.append([region_name] + region['data']['data'][-1][1:])
+        summary.append([TOTAL_LABEL] + root['data']['data'][-1][1:], bold=True)
+        summary.append([])
+        for row in root['data']['data'][:-1]:
+            summary.append(row)
+
+        for region_name, region in regions:
+            sheet = _SheetWriter(workbook, _sheet_title(region_name, used_titles), periods)
+            sheet.header(region_name)
+            sheet.place(region_name, region, title=False)
+
+    file_obj = tempfile.TemporaryFile()
+    workbook.save(file_obj)
+    file_obj.seek(0)
+    return file_obj
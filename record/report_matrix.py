@@ -0,0 +1,72 @@
+"""
+Category x period matrix of the reports.
+
+Categories and period labels are mapped to row and column indexes and the
+amounts are kept as integer tiyin (1/100 of a sum), so totals add up exactly
+however many places and periods are summed. Amounts are turned back into
+sums only when the {'periods', 'data'} table is emitted.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+from operator import add
+
+TOTAL_LABEL = 'Жами'
+
+
+def to_tiyin(amount):
+    if not isinstance(amount, Decimal):
+        amount = Decimal(str(amount))
+    return int((amount * 100).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def from_tiyin(tiyin):
+    return tiyin / 100
+
+
+class ReportMatrix:
+    def __init__(self, periods):
+        """periods: the gap-filled period labels, one column each"""
+        self.periods = periods
+        self._columns = {period_label: index for index, period_label in enumerate(periods)}
+        self._rows = {}  # category -> index in _cells
+        self._cells = []
+
+    def _row(self, category):
+        index = self._rows.get(category)
+        if index is None:
+            index = self._rows[category] = len(self._cells)
+            self._cells.append([0] * len(self.periods))
+        return self._cells[index]
+
+    def add(self, category, period_label, amount):
+        """Add an amount to a cell. Categories get a row even if the period is not one of the columns."""
+        row = self._row(category)
+        column = self._columns.get(period_label)
+        if column is not None:
+            row[column] += to_tiyin(amount)
+
+    def add_matrix(self, other):
+        """Add the cells of a matrix with the same periods, e.g. of a child place"""
+        for category, index in other._rows.items():
+            row = self._row(category)
+            row[:] = map(add, row, other._cells[index])
+
+    def to_table(self, category_totals=None, period_totals=None, total=None):
+        """
+        The {'periods', 'data'} table: a row per category with its total, then the total row.
+        Totals are summed from the cells unless they are given (in tiyin, period totals by label).
+        """
+        data = []
+        for category, index in self._rows.items():
+            row = self._cells[index]
+            row_total = category_totals[category] if category_totals is not None else sum(row)
+            data.append([category] + [from_tiyin(tiyin) for tiyin in row] + [from_tiyin(row_total)])
+
+        if period_totals is not None:
+            column_totals = [period_totals.get(period_label, 0) for period_label in self.periods]
+        else:
+            column_totals = list(map(sum, zip(*self._cells))) if self._cells else [0] * len(self.periods)
+        if total is None:
+            total = sum(column_totals)
+        data.append([TOTAL_LABEL] + [from_tiyin(tiyin) for tiyin in column_totals] + [from_tiyin(total)])
+
+        return {'periods': self.periods, 'data': data}
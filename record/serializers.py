@@ -4,6 +4,7 @@ from rest_framework.exceptions import ValidationError, PermissionDenied
 from category.serializers import CategorySerializer
 
 from core.models import Record, Place
+from core.place_tree import get_place_tree
 from core.serializers import AuditSerializerMixin
 from place.serializers import PlaceSerializer
 from user.serializers import UserSerializer
@@ -24,21 +25,17 @@ class RecordSerializer(AuditSerializerMixin):
         request = self.context.get('request', None)
         current_user = request.user
         category_data = validated_data.pop('category', None)
-        if category_data is None:
+        if category_data is None or category_data.get('id') is None:
             raise ValidationError('Specify category')
 
-        place_data = validated_data.pop('place', None)
-
-        instance = Record.objects.create(
-            category_id=category_data.get('id'),
-            place_id=place_data.get('id'),
-            created_by=current_user,
-            **validated_data
-        )
-
-        place = Place.objects.get(id=place_data.get('id'))
+        place_data = validated_data.pop('place', None) or {}
+        # Records always get a new id
+        validated_data.pop('id', None)
 
+        # Validate before writing, so a record costs a single insert
+        place_id = place_data.get('id')
         if current_user.role == 'region_admin' or current_user.role == 'admin':
+            place = Place.objects.filter(id=place_id).only('id', 'is_mosque').first()
 
             if place is None:
                 raise ValidationError('Specify place id')
@@ -46,14 +43,91 @@ class RecordSerializer(AuditSerializerMixin):
             if not place.is_mosque:
                 raise ValidationError('Place type should be MOSQUE')
 
+            if current_user.place_id is not None and not get_place_tree().is_descendant(place.id, current_user.place_id):
+                raise PermissionDenied('Place id does not belong to your area')
 
         if current_user.role == 'mosque_admin':
-            instance.place = request.user.place
+            place_id = current_user.place_id
 
+        instance = Record(
+            category_id=category_data.get('id'),
+            place_id=place_id,
+            **validated_data
+        )
+        # Sets created_by and writes the audit entry
         instance.save(request=request)
 
         return instance
 
+class RecordCompactSerializer(serializers.ModelSerializer):
+    """Record with related objects as plain ids, the objects go to `side_tables`"""
+
+    class Meta:
+        model = Record
+        fields = '__all__'
+
+    @staticmethod
+    def side_tables(records):
+        """Deduplicated categories, places and users referenced by the records, keyed by id"""
+        categories, places, users = {}, {}, {}
+        for record in records:
+            categories[record.category_id] = record.category
+            if record.place_id is not None:
+                places[record.place_id] = record.place
+            if record.created_by_id is not None:
+                users[record.created_by_id] = record.created_by
+
+        return {
+            'categories': {pk: CategorySerializer(category).data for pk, category in categories.items()},
+            'places': {pk: PlaceSerializer(place).data for pk, place in places.items()},
+            'users': {pk: UserSerializer(user).data for pk, user in users.items()},
+        }
+
+class RecordBulkItemSerializer(serializers.Serializer):
+    """
+    One record of a bulk upload. Categories and places are checked against
+    the `categories`/`places` maps from the context, so validation does not query.
+    The `user` of the context may be None for imports run outside of a request.
+    """
+    category_id = serializers.IntegerField()
+    place_id = serializers.IntegerField(required=False, allow_null=True)
+    date = serializers.DateField(required=False, allow_null=True)
+    amount = serializers.DecimalField(max_digits=10, decimal_places=2)
+    quantity = serializers.DecimalField(max_digits=10, decimal_places=2, required=False, allow_null=True)
+    description = serializers.CharField(max_length=500, required=False, allow_null=True, allow_blank=True)
+
+    def validate(self, attrs):
+        user = self.context['user']
+
+        if attrs['category_id'] not in self.context['categories']:
+            raise ValidationError({'category_id': 'Category does not exist'})
+
+        if user is not None and user.role == 'mosque_admin':
+            # Their own mosque when not given, never another one
+            if attrs.get('place_id') not in (None, user.place_id):
+                raise ValidationError({'place_id': 'Place id does not belong to your area'})
+            attrs['place_id'] = user.place_id
+            return attrs
+
+        place = self.context['places'].get(attrs.get('place_id'))
+        if place is None:
+            raise ValidationError({'place_id': 'Specify place id'})
+        if not place.is_mosque:
+            raise ValidationError({'place_id': 'Place type should be MOSQUE'})
+        if user is not None and user.place_id is not None and not self.context['tree'].is_descendant(place.id, user.place_id):
+            raise ValidationError({'place_id': 'Place id does not belong to your area'})
+
+        return attrs
+
+class PlaceProfitSerializer(serializers.Serializer):
+    """A place annotated by PlaceManager.with_profit"""
+    id = serializers.IntegerField()
+    name = serializers.CharField()
+    is_mosque = serializers.BooleanField()
+    income = serializers.DecimalField(max_digits=18, decimal_places=2)
+    expense = serializers.DecimalField(max_digits=18, decimal_places=2)
+    net = serializers.DecimalField(max_digits=18, decimal_places=2)
+
 class ReportValueSerializer(serializers.Serializer):
     category_id = serializers.IntegerField()
     category_name = serializers.CharField(source='category__name')
@@ -16,7 +16,10 @@ urlpatterns = [
     path('', include(router.urls)),
     path('report/<str:period>/', views.RecordReportView.as_view(), name="report"),
     path('report-hierarchicallly/<str:period>/', views.RecordHierarchicallyReportView.as_view(), name="report"),
+    path('report-hierarchicallly/<str:period>/xlsx/', views.RecordHierarchicallyReportExcelView.as_view(), name="report-xlsx"),
     path('report-profit/<int:place_id>/', views.ReportProfitView.as_view(), name="profit"),
+    path('report-profit/<int:place_id>/children/', views.ReportProfitChildrenView.as_view(), name="profit-children"),
     path('report-value/<int:place_id>/', views.ReportValueView.as_view(), name="value"),
+    path('report-cache/stats/', views.ReportCacheStatsView.as_view(), name="report-cache-stats"),
 ]
 
@@ -1,62 +1,71 @@
 from drf_spectacular.types import OpenApiTypes
 from rest_framework import permissions, viewsets
+from rest_framework.decorators import action
 from rest_framework.exceptions import ValidationError, NotFound
 from rest_framework.generics import RetrieveAPIView
+from rest_framework.parsers import MultiPartParser
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from drf_spectacular.utils import extend_schema, OpenApiParameter, OpenApiExample, OpenApiResponse
 
-from core.models import Record, Place, Category
-from core.pagination import CustomPagination
-from record.serializers import RecordSerializer, ReportValueSerializer
+from core.models import Record, Place, Category, CalendarDay, RecordDailyRollup, PlaceBalance, Job
+from core import jobs, report_cache
+from core.place_tree import get_place_tree
+from core.replica import ReplicaReadsMixin
+from core.pagination import CustomPagination, KeysetPagination
+from core.records import bulk_create_records
+from django.conf import settings
+from django.core.files.storage import default_storage
+from record.exporter import export_rows, iter_csv, write_xlsx
+from record.importer import import_records
+from job.serializers import JobSerializer
+from record.renderers import CompactJSONRenderer
+from record.report_excel import write_hierarchical_report
+from record.report_matrix import ReportMatrix, to_tiyin
+from record.serializers import (
+    RecordSerializer, RecordCompactSerializer, RecordBulkItemSerializer, PlaceProfitSerializer, ReportValueSerializer
+)
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from django.db.models import Sum, Case, When, F, FloatField
-from django.db.models.functions import TruncDay, TruncWeek, TruncMonth
+from rest_framework.settings import api_settings
+from django.db.models import Exists, F, OuterRef, Sum
+from django.http import FileResponse, StreamingHttpResponse
 from collections import defaultdict
-from datetime import datetime, timedelta
+from datetime import datetime
 from django.utils.dateparse import parse_date
 
-class RecordView(viewsets.ModelViewSet):
+class RecordView(ReplicaReadsMixin, viewsets.ModelViewSet):
     authentication_classes = [JWTAuthentication]
     queryset = Record.objects.all()
     serializer_class = RecordSerializer
     pagination_class = CustomPagination
     permission_classes = [permissions.IsAuthenticated]
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [CompactJSONRenderer]
+    BULK_MAX_ITEMS = 1000
+
+    def get_queryset(self):
+        # Everything the nested serializers touch comes with the records in one query
+        return Record.objects.select_related('category__unit', 'place', 'created_by__position')
 
     @extend_schema(
         parameters=[
             OpenApiParameter(name='from', description='Date From YYYY-MM-DD', required=False, type=str),
             OpenApiParameter(name='to', description='Date To YYYY-MM-DD', required=False, type=str),
             OpenApiParameter(name='place_id', description='PlaceId', required=False, type=int),
+            OpenApiParameter(name='pagination', description="'cursor' to page by cursor instead of page number", required=False, type=str, enum=['cursor']),
+            OpenApiParameter(name='cursor', description='Cursor of the page, taken from the "next" link', required=False, type=str),
+            OpenApiParameter(name='format', description="'compact' to return related objects as ids plus side tables", required=False, type=str, enum=['compact']),
         ],
         responses={200: RecordSerializer}
     )
     def list(self, request, *args, **kwargs):
-        qp_place_id = request.query_params.get('place_id')
-        user = request.user
-
-        if qp_place_id is None and user.role != 'mosque_admin':
-            raise ValidationError('Specify place id for not mosque admins')
-
-        place_id = qp_place_id or user.place.id
-        found = Place.objects.get(pk=place_id)
-
-        if found is None:
-            raise ValidationError('Provide a valid place id')
-
-        ids = []
-
-        ids.append(found.id)
-        if found.parent is not None:
-            ids.append(found.parent.id)
-            if found.parent.parent is not None:
-                ids.append(found.parent.parent.id)
-
+        place_id = self._get_place_id(request)
 
-        if user.place is not None and user.place.id not in ids:
-            raise ValidationError('Place id does not belong to your area')
+        records = self.get_queryset().filter(place_id=place_id)
 
-        records = Record.objects.filter(place_id=place_id)
+        if KeysetPagination.is_requested(request):
+            paginator = KeysetPagination()
+            page = paginator.paginate_queryset(records, request, view=self)
+            return self._get_paginated_response(paginator, page)
 
         paginator = self.pagination_class()
 
@@ -64,8 +73,7 @@ class RecordView(viewsets.ModelViewSet):
             # Paginate the queryset
             page = paginator.paginate_queryset(records, request)
             if page is not None:
-                serializer = self.get_serializer(page, many=True)
-                return paginator.get_paginated_response(serializer.data)
+                return self._get_paginated_response(paginator, page)
         except NotFound:
             # Handle the invalid page case, return an empty result set
             return Response(
@@ -81,6 +89,214 @@ class RecordView(viewsets.ModelViewSet):
         serializer = self.get_serializer(page, many=True)
         return Response(serializer.data)
 
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(name='format', description="'compact' to return related objects as ids plus side tables", required=False, type=str, enum=['compact']),
+        ],
+        responses={200: RecordSerializer}
+    )
+    def retrieve(self, request, *args, **kwargs):
+        if request.accepted_renderer.format != CompactJSONRenderer.format:
+            return super().retrieve(request, *args, **kwargs)
+
+        record = self.get_object()
+        return Response({**RecordCompactSerializer(record).data, **RecordCompactSerializer.side_tables([record])})
+
+    @extend_schema(
+        summary="Create records in bulk",
+        description=(
+                "Validates every record against the caller's places and inserts the valid ones in one transaction. "
+                "Invalid records are reported by their index and do not stop the others."
+        ),
+        request=RecordBulkItemSerializer(many=True),
+        responses={
+            201: OpenApiResponse(
+                description="Records created",
+                examples=[
+                    OpenApiExample(
+                        "Partially created",
+                        value={"created": [101, 102], "errors": [{"index": 2, "errors": {"amount": ["This field is required."]}}]}
+                    )
+                ],
+            ),
+        }
+    )
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk(self, request, *args, **kwargs):
+        items = request.data
+        if not isinstance(items, list) or not items:
+            raise ValidationError('Expected a non-empty list of records')
+        if len(items) > self.BULK_MAX_ITEMS:
+            raise ValidationError(f'At most {self.BULK_MAX_ITEMS} records can be created at once')
+
+        # Everything the items refer to is loaded once for the whole batch
+        context = {
+            'user': request.user,
+            'categories': Category.objects.in_bulk(_int_values(items, 'category_id')),
+            'places': Place.objects.only('id', 'is_mosque').in_bulk(_int_values(items, 'place_id')),
+            'tree': get_place_tree(),
+        }
+
+        records, errors = [], []
+        for index, item in enumerate(items):
+            serializer = RecordBulkItemSerializer(data=item, context=context)
+            if not serializer.is_valid():
+                errors.append({'index': index, 'errors': serializer.errors})
+                continue
+            data = serializer.validated_data
+            records.append(Record(
+                category=context['categories'][data['category_id']],
+                place_id=data['place_id'],
+                date=data.get('date') or Record._meta.get_field('date').get_default(),
+                amount=data['amount'],
+                quantity=data.get('quantity'),
+                description=data.get('description'),
+                created_by=request.user,
+            ))
+
+        records = bulk_create_records(records, user=request.user, ip_address=request.META.get('REMOTE_ADDR'))
+
+        return Response(
+            {'created': [record.pk for record in records], 'errors': errors},
+            status=201 if records else 400
+        )
+
+    @extend_schema(
+        summary="Import historical records",
+        description=(
+                "Imports an XLSX or CSV file with a header row and the columns: mosque INN, date, category name, "
+                "amount, quantity, description. Valid rows are written in batches, the rejected ones are listed "
+                "in a CSV file that can be downloaded from `errors_file`. With `background=true` the import "
+                "runs as a job, see /api/job/."
+        ),
+        parameters=[
+            OpenApiParameter(name='background', description="'true' to run as a job, see /api/job/", required=False, type=bool),
+        ],
+        request={
+            'multipart/form-data': {
+                'type': 'object',
+                'properties': {'file': {'type': 'string', 'format': 'binary'}},
+                'required': ['file'],
+            }
+        },
+        responses={
+            201: OpenApiResponse(
+                description="Records imported",
+                examples=[
+                    OpenApiExample(
+                        "Imported with errors",
+                        value={"imported": 1200, "failed": 3, "errors_file": "http://localhost/media/imports/errors/records-20240901120000-1a2b3c4d.csv"}
+                    )
+                ],
+            ),
+        }
+    )
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=[MultiPartParser])
+    def import_file(self, request, *args, **kwargs):
+        file_obj = request.FILES.get('file')
+        if not file_obj:
+            raise ValidationError('No file provided')
+        if not file_obj.name.lower().endswith(('.csv', '.xlsx')):
+            raise ValidationError('Expected an .xlsx or .csv file')
+
+        if jobs.is_requested(request):
+            job = jobs.submit(
+                Job.Kind.RECORD_IMPORT, user=request.user, input_file=file_obj,
+                params={'ip_address': request.META.get('REMOTE_ADDR')},
+            )
+            return Response(JobSerializer(job, context={'request': request}).data, status=202)
+
+        imported, failed, errors_file = import_records(
+            file_obj, file_obj.name, user=request.user, ip_address=request.META.get('REMOTE_ADDR')
+        )
+
+        return Response(
+            {
+                'imported': imported,
+                'failed': failed,
+                'errors_file': request.build_absolute_uri(default_storage.url(errors_file)) if errors_file else None,
+            },
+            status=201 if imported else 400
+        )
+
+    @extend_schema(
+        summary="Export records as CSV",
+        description="Streams every record of the place and the places under it, optionally limited to a date range.",
+        parameters=[
+            OpenApiParameter(name='place_id', description='PlaceId', required=False, type=int),
+            OpenApiParameter(name='start', description="Start date in 'YYYY-MM-DD' format", required=False, type=str),
+            OpenApiParameter(name='end', description="End date in 'YYYY-MM-DD' format", required=False, type=str),
+            OpenApiParameter(name='background', description="'true' to run as a job, see /api/job/", required=False, type=bool),
+        ],
+        responses={(200, 'text/csv'): OpenApiTypes.BINARY}
+    )
+    @action(detail=False, methods=['get'], url_path='export/csv')
+    def export_csv(self, request, *args, **kwargs):
+        if jobs.is_requested(request):
+            return self._submit_export_job(request, Job.Kind.RECORD_EXPORT_CSV)
+
+        rows = export_rows(self._get_place_id(request), *_get_date_range(request))
+        response = StreamingHttpResponse(iter_csv(rows), content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename="records.csv"'
+        return response
+
+    @extend_schema(
+        summary="Export records as XLSX",
+        description="Every record of the place and the places under it as an Excel workbook, optionally limited to a date range.",
+        parameters=[
+            OpenApiParameter(name='place_id', description='PlaceId', required=False, type=int),
+            OpenApiParameter(name='start', description="Start date in 'YYYY-MM-DD' format", required=False, type=str),
+            OpenApiParameter(name='end', description="End date in 'YYYY-MM-DD' format", required=False, type=str),
+            OpenApiParameter(name='background', description="'true' to run as a job, see /api/job/", required=False, type=bool),
+        ],
+        responses={(200, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'): OpenApiTypes.BINARY}
+    )
+    @action(detail=False, methods=['get'], url_path='export/xlsx')
+    def export_xlsx(self, request, *args, **kwargs):
+        if jobs.is_requested(request):
+            return self._submit_export_job(request, Job.Kind.RECORD_EXPORT_XLSX)
+
+        rows = export_rows(self._get_place_id(request), *_get_date_range(request))
+        return FileResponse(write_xlsx(rows), as_attachment=True, filename='records.xlsx')
+
+    def _submit_export_job(self, request, kind):
+        place_id = self._get_place_id(request)
+        start, end = _get_date_range(request)
+        job = jobs.submit(kind, user=request.user, params={
+            'place_id': int(place_id),
+            'start': start and start.isoformat(),
+            'end': end and end.isoformat(),
+        })
+        return Response(JobSerializer(job, context={'request': request}).data, status=202)
+
+    def _get_place_id(self, request):
+        """The place_id parameter (mosque admins default to their place), checked against the user's area"""
+        qp_place_id = request.query_params.get('place_id')
+        user = request.user
+
+        if qp_place_id is None and user.role != 'mosque_admin':
+            raise ValidationError('Specify place id for not mosque admins')
+
+        place_id = qp_place_id or user.place_id
+        tree = get_place_tree()
+
+        if not tree.contains(place_id):
+            raise ValidationError('Provide a valid place id')
+
+        if user.place_id is not None and not tree.is_descendant(place_id, user.place_id):
+            raise ValidationError('Place id does not belong to your area')
+
+        return place_id
+
+    def _get_paginated_response(self, paginator, page):
+        if self.request.accepted_renderer.format == CompactJSONRenderer.format:
+            response = paginator.get_paginated_response(RecordCompactSerializer(page, many=True).data)
+            response.data.update(RecordCompactSerializer.side_tables(page))
+            return response
+
+        serializer = self.get_serializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
     def get_serializer_context(self):
         context = super(type(self), self).get_serializer_context()
         context['request'] = self.request
@@ -91,39 +307,79 @@ class RecordView(viewsets.ModelViewSet):
         serializer.delete(instance)
 
 
-class AbstractRecordReportView(APIView):
-    def _generate_date_range(self, start, end, period):
-        current = start
-        date_range = []
+def _parse_date(value):
+    """parse_date() that gives None for impossible dates (e.g. 2025-02-30) too"""
+    try:
+        return parse_date(value)
+    except ValueError:
+        return None
 
-        if period == 'daily':
-            while current <= end:
-                date_range.append(current.strftime('%Y-%m-%d'))
-                current += timedelta(days=1)
-        elif period == 'weekly':
-            while current <= end:
-                date_range.append(current.strftime('%Y-%W'))
-                current += timedelta(weeks=1)
-        elif period == 'monthly':
-            while current <= end:
-                date_range.append(current.strftime('%Y-%m'))
-                next_month = current.replace(day=28) + timedelta(days=4)
-                current = next_month.replace(day=1)
 
-        return date_range
+def _get_date_range(request):
+    """The optional start and end query parameters, ValidationError when malformed, impossible or reversed"""
+    dates = []
+    for name in ('start', 'end'):
+        value = request.query_params.get(name)
+        date = _parse_date(value) if value else None
+        if value and date is None:
+            raise ValidationError(f'Invalid {name} date')
+        dates.append(date)
+    if None not in dates and dates[0] > dates[1]:
+        raise ValidationError('Start date should not be after end date')
+    return dates
 
-    def get_descendant_place_ids(self, place_id):
-        place_ids = [place_id]
-        queue = [place_id]
-        while queue:
-            current_place_id = queue.pop(0)
-            child_places = Place.objects.filter(parent_id=current_place_id)
-            for child in child_places:
-                place_ids.append(child.id)
-                queue.append(child.id)
-        return place_ids
 
+def _int_values(items, key):
+    values = set()
+    for item in items:
+        try:
+            values.add(int(item.get(key)))
+        except (AttributeError, TypeError, ValueError):
+            continue
+    return values
+
+
+class AbstractRecordReportView(ReplicaReadsMixin, APIView):
+    PERIODS = tuple(CalendarDay.PERIOD_FIELDS)
+
+    def _get_period_options(self, period, start, end):
+        """
+        The calendar field that buckets the rollup dates of a period, and the labels
+        of its gap-filled buckets from start to end by their start date
+        """
+        labels = {
+            bucket: CalendarDay.period_label(period, bucket)
+            for bucket in CalendarDay.objects.periods(period, start, end)
+        }
+        return F(f'calendar__{CalendarDay.PERIOD_FIELDS[period]}'), labels
+
+    def _get_uncovered_expenses(self, period, **filters):
+        """
+        Rollup amounts of the days the calendar has no row for yet, which the report queries group
+        under a None period, by place and category with the bucket of their period worked out in Python
+        """
+        expenses = defaultdict(int)
+        rows = (
+            RecordDailyRollup.objects
+            .filter(~Exists(CalendarDay.objects.filter(date=OuterRef('date'))), **filters)
+            .values_list('place_id', 'category__name', 'date')
+            .annotate(total_amount=Sum('amount'))
+        )
+        for place_id, category, day, amount in rows:
+            expenses[place_id, category, CalendarDay.bucket(period, day)] += amount
+        return [
+            {'period': bucket, 'category__name': category, 'place_id': place_id, 'total_amount': amount}
+            for (place_id, category, bucket), amount in expenses.items()
+        ]
+
+    def _check_span(self, start_date, end_date):
+        """Error response for a report longer than REPORT_MAX_DAYS, None otherwise"""
+        if (end_date - start_date).days + 1 > settings.REPORT_MAX_DAYS:
+            return Response({"error": f"A report can span at most {settings.REPORT_MAX_DAYS} days."}, status=400)
+        return None
 
+    def get_descendant_place_ids(self, place_id):
+        return get_place_tree().descendants(place_id)
 
 
 class RecordReportView(AbstractRecordReportView):
@@ -131,15 +387,15 @@ class RecordReportView(AbstractRecordReportView):
 
     @extend_schema(
         summary="Get Expense Report",
-        description="Retrieve the expense report grouped by categories and by the selected period (supports 'daily', 'weekly', or 'monthly'). Fill gaps with zero if no data exists for a particular period.",
+        description="Retrieve the expense report grouped by categories and by the selected period (supports 'daily', 'weekly', 'monthly', 'quarterly', 'yearly', 'hijri_monthly' or 'hijri_yearly'). Fill gaps with zero if no data exists for a particular period.",
         parameters=[
             OpenApiParameter(
                 name='period',
                 location=OpenApiParameter.PATH,
-                description="The period for grouping the report ('daily', 'weekly', or 'monthly').",
+                description="The period for grouping the report ('daily', 'weekly', 'monthly', 'quarterly', 'yearly', 'hijri_monthly' or 'hijri_yearly').",
                 required=True,
                 type=str,
-                enum=['daily', 'weekly', 'monthly']
+                enum=list(CalendarDay.PERIOD_FIELDS)
             ),
             OpenApiParameter(
                 name='place_id',
@@ -196,92 +452,69 @@ class RecordReportView(AbstractRecordReportView):
         if not end_date:
             end_date = datetime.now().strftime('%Y-%m-%d')
 
-        start_date = parse_date(start_date)
-        end_date = parse_date(end_date)
+        start_date = _parse_date(start_date)
+        end_date = _parse_date(end_date)
 
         if not start_date or not end_date or start_date > end_date:
             return Response({"error": "Invalid start or end date."}, status=400)
+        span_error = self._check_span(start_date, end_date)
+        if span_error:
+            return span_error
 
-        # Choose the correct truncation method based on the period
-        if period == 'daily':
-            trunc_period = TruncDay('date')
-            date_range = self._generate_date_range(start_date, end_date, 'daily')
-            date_format = '%Y-%m-%d'
-        elif period == 'weekly':
-            trunc_period = TruncWeek('date')
-            date_range = self._generate_date_range(start_date, end_date, 'weekly')
-            date_format = '%Y-%W'
-        elif period == 'monthly':
-            trunc_period = TruncMonth('date')
-            date_range = self._generate_date_range(start_date, end_date, 'monthly')
-            date_format = '%Y-%m'
-        else:
-            return Response({"error": "Invalid period. Choose from 'daily', 'weekly', or 'monthly'."}, status=400)
+        if period not in self.PERIODS:
+            return Response({"error": "Invalid period. Choose from 'daily', 'weekly', 'monthly', 'quarterly', 'yearly', 'hijri_monthly' or 'hijri_yearly'."}, status=400)
 
-        # Group by period and category
-        expenses = Record.objects.filter(place_id=place_id).annotate(period=trunc_period).values('period',
-                                                                                                 'category__name',
-                                                                                                 'category__operation_type').annotate(
-            total_amount=Sum('amount')).order_by('period')
+        response_data = report_cache.get_or_compute(
+            'report', place_id, (period, start_date, end_date),
+            lambda: self.build_report(place_id, period, start_date, end_date),
+        )
 
-        report_data = defaultdict(lambda: defaultdict(float))
+        return Response(response_data)
 
-        for expense in expenses:
-            category = expense['category__name']
-            period_label = expense['period'].strftime(date_format)
+    def build_report(self, place_id, period, start_date, end_date):
+        period_field, labels = self._get_period_options(period, start_date, end_date)
 
-            # Adjust total_amount based on the category's operation_type (income or expense)
-            if expense['category__operation_type'] == 'income':
-                report_data[category][period_label] = expense['total_amount']
-            else:
-                report_data[category][period_label] = -expense['total_amount']
-
-        table_data = []
-        category_totals = defaultdict(float)
-        column_totals = defaultdict(float)
-
-        for category, period_data in report_data.items():
-            row = [category]
-            category_sum = 0
-            for period_label in date_range:
-                amount = period_data.get(period_label, 0)
-                row.append(amount)
-                category_sum += amount
-                column_totals[period_label] += float(amount)
-            row.append(category_sum)
-            table_data.append(row)
-
-        total_row = ['Жами']
-        overall_total = 0
-        for period_label in date_range:
-            col_sum = column_totals[period_label]
-            total_row.append(col_sum)
-            overall_total += col_sum
-        total_row.append(overall_total)
-        table_data.append(total_row)
-
-        response_data = {
-            "periods": date_range,
-            "data": table_data,
-        }
+        # Every cell and subtotal comes from the database, rollup amounts are already signed
+        cells, category_totals, period_totals, total = RecordDailyRollup.objects.category_period_totals(
+            period_field, place_id=place_id, date__range=(start_date, end_date)
+        )
 
-        return Response(response_data)
+        # Days the calendar has no row for yet come without a bucket, move them into theirs
+        if None in period_totals:
+            del period_totals[None]
+            cells = {key: amount for key, amount in cells.items() if key[1] is not None}
+            for expense in self._get_uncovered_expenses(period, place_id=place_id, date__range=(start_date, end_date)):
+                key = (expense['category__name'], expense['period'])
+                cells[key] = cells.get(key, 0) + expense['total_amount']
+                period_totals[expense['period']] = period_totals.get(expense['period'], 0) + expense['total_amount']
+
+        # Place them into the gap-filled grid, categories in the order they first appear
+        matrix = ReportMatrix(list(labels.values()))
+        for (category, bucket), amount in sorted(cells.items(), key=lambda item: (item[0][1], item[0][0])):
+            matrix.add(category, labels[bucket], amount)
+
+        return matrix.to_table(
+            category_totals={category: to_tiyin(amount) for category, amount in category_totals.items()},
+            period_totals={labels[bucket]: to_tiyin(amount) for bucket, amount in period_totals.items()},
+            total=to_tiyin(total),
+        )
 
 class RecordHierarchicallyReportView(AbstractRecordReportView):
     @extend_schema(
         summary="Get Hierarchical Expense Report",
         description=(
                 "Retrieve the expense report grouped by categories and by the selected period "
-                "(supports 'daily', 'weekly', or 'monthly'). Fill gaps with zero if no data exists for a particular period."
+                "(supports 'daily', 'weekly', 'monthly', 'quarterly', 'yearly', 'hijri_monthly' or 'hijri_yearly'). Fill gaps with zero if no data exists for a particular period. "
+                "Every place in the tree carries the totals of its whole subtree under 'data'."
         ),
         parameters=[
             OpenApiParameter(
                 name='period',
                 location=OpenApiParameter.PATH,
-                description="The period for grouping the report ('daily', 'weekly', or 'monthly').",
+                description="The period for grouping the report ('daily', 'weekly', 'monthly', 'quarterly', 'yearly', 'hijri_monthly' or 'hijri_yearly').",
                 required=True,
                 type=str,
-                enum=['daily', 'weekly', 'monthly']
+                enum=list(CalendarDay.PERIOD_FIELDS)
             ),
             OpenApiParameter(
                 name='place_id',
@@ -333,7 +566,22 @@ class RecordHierarchicallyReportView(AbstractRecordReportView):
         }
     )
     def get(self, request, period, *args, **kwargs):
+        place_hierarchy, error_response = self.get_report(request, period)
+        if error_response is not None:
+            return error_response
+
+        return Response(place_hierarchy)
 
+    def get_report(self, request, period):
+        """(report, None), or (None, error response) when the parameters are invalid"""
+        params, error_response = self.get_report_params(request, period)
+        if error_response is not None:
+            return None, error_response
+
+        return self.get_cached_report(period, *params), None
+
+    def get_report_params(self, request, period):
+        """((place_id, start_date, end_date), None), or (None, error response) when the parameters are invalid"""
         place_id = request.query_params.get('place_id')
         current_user = request.user
 
@@ -350,122 +598,302 @@ class RecordHierarchicallyReportView(AbstractRecordReportView):
         if not end_date:
             end_date = datetime.now().strftime('%Y-%m-%d')
 
-        start_date = parse_date(start_date)
-        end_date = parse_date(end_date)
+        start_date = _parse_date(start_date)
+        end_date = _parse_date(end_date)
 
         if not start_date or not end_date or start_date > end_date:
-            return Response({"error": "Invalid start or end date."}, status=400)
+            return None, Response({"error": "Invalid start or end date."}, status=400)
+        span_error = self._check_span(start_date, end_date)
+        if span_error:
+            return None, span_error
 
-        # Choose the correct truncation method based on the period
-        if period == 'daily':
-            trunc_period = TruncDay('date')
-            date_range = self._generate_date_range(start_date, end_date, 'daily')
-            date_format = '%Y-%m-%d'
-        elif period == 'weekly':
-            trunc_period = TruncWeek('date')
-            date_range = self._generate_date_range(start_date, end_date, 'weekly')
-            date_format = '%Y-%W'
-        elif period == 'monthly':
-            trunc_period = TruncMonth('date')
-            date_range = self._generate_date_range(start_date, end_date, 'monthly')
-            date_format = '%Y-%m'
-        else:
-            return Response({"error": "Invalid period. Choose from 'daily', 'weekly', or 'monthly'."}, status=400)
+        if period not in self.PERIODS:
+            return None, Response({"error": "Invalid period. Choose from 'daily', 'weekly', 'monthly', 'quarterly', 'yearly', 'hijri_monthly' or 'hijri_yearly'."}, status=400)
 
-        # Get all descendant place IDs
-        place_ids = self.get_descendant_place_ids(place_id)
+        return (place_id, start_date, end_date), None
+
+    def get_cached_report(self, period, place_id, start_date, end_date):
+        return report_cache.get_or_compute(
+            'report-hierarchically', place_id, (period, start_date, end_date),
+            lambda: self.build_report(place_id, period, start_date, end_date),
+        )
+
+    def build_report(self, place_id, period, start_date, end_date):
+        period_field, labels = self._get_period_options(period, start_date, end_date)
+
+        # Load the whole subtree in one query
+        places = list(
+            Place.objects.descendants_of(place_id).values('id', 'name', 'parent_id').order_by('id')
+        )
+        if not places:
+            raise NotFound('Place not found')
 
         # Fetch expenses
         expenses = (
-            Record.objects.filter(place_id__in=place_ids, date__range=(start_date, end_date))
-            .annotate(period=trunc_period)
+            RecordDailyRollup.objects
+            .filter(place_id__in=[place['id'] for place in places], date__range=(start_date, end_date))
+            .annotate(period=period_field)
             .values(
                 'period',
                 'category__name',
-                'category__operation_type',
-                'place__id'
+                'place_id'
             )
             .annotate(total_amount=Sum('amount'))
             .order_by('period')
         )
 
-        # Collect expenses by place
+        # Collect expenses by place, days the calendar has no row for yet come without a period
         expenses_by_place = defaultdict(list)
+        uncovered = False
         for expense in expenses:
-            expenses_by_place[expense['place__id']].append(expense)
+            if expense['period'] is None:
+                uncovered = True
+                continue
+            expenses_by_place[expense['place_id']].append(expense)
+        if uncovered:
+            for expense in self._get_uncovered_expenses(
+                period, place_id__in=[place['id'] for place in places], date__range=(start_date, end_date)
+            ):
+                expenses_by_place[expense['place_id']].append(expense)
+
+        # Build place hierarchy, every node gets the totals of its subtree
+        children_by_parent = defaultdict(list)
+        root_place = None
+        for place in places:
+            if place['id'] == int(place_id):
+                root_place = place
+            else:
+                children_by_parent[place['parent_id']].append(place)
 
-        # Build place hierarchy and attach data at leaf nodes
-        root_place = Place.objects.get(id=place_id)
-        place_hierarchy = {
-            root_place.name: self.build_place_hierarchy(root_place, expenses_by_place, date_range, date_format)
+        place_dict, _ = self.build_place_hierarchy(
+            root_place, children_by_parent, expenses_by_place, labels
+        )
+        return {
+            root_place['name']: place_dict
         }
 
-        return Response(place_hierarchy)
-
-    def build_place_hierarchy(self, place, expenses_by_place, date_range, date_format):
+    def build_place_hierarchy(self, place, children_by_parent, expenses_by_place, labels):
+        """
+        Returns the node dict for `place` and the ReportMatrix of its subtree:
+        its own records plus the matrices of its children.
+        labels: {bucket start date: period label} of the report columns
+        """
         place_dict = {}
-        children = Place.objects.filter(parent_id=place.id)
-        if children.exists():
-            # If the place has children, recursively build the hierarchy
-            for child in children:
-                place_dict[child.name] = self.build_place_hierarchy(child, expenses_by_place, date_range,
-                                                                    date_format)
-        else:
-            # Leaf node, attach data
-            place_expenses = expenses_by_place.get(place.id, [])
-            data = self.build_data_for_place(place_expenses, date_range, date_format)
-            place_dict['data'] = data
-        return place_dict
-
-    def build_data_for_place(self, expenses, date_range, date_format):
-        # Build the data as per the desired format
-        report_data = defaultdict(lambda: defaultdict(float))
+        matrix = self.build_matrix(expenses_by_place.get(place['id'], []), labels)
+        for child in children_by_parent.get(place['id'], []):
+            place_dict[child['name']], child_matrix = self.build_place_hierarchy(
+                child, children_by_parent, expenses_by_place, labels
+            )
+            matrix.add_matrix(child_matrix)
+
+        place_dict['data'] = matrix.to_table()
+        return place_dict, matrix
+
+    def build_data_for_place(self, expenses, labels):
+        return self.build_matrix(expenses, labels).to_table()
+
+    def build_matrix(self, expenses, labels):
+        matrix = ReportMatrix(list(labels.values()))
         for expense in expenses:
-            category = expense['category__name']
-            period_label = expense['period'].strftime(date_format)
-            amount = expense['total_amount']
-            if expense['category__operation_type'] == 'expense':
-                amount = -amount
-            report_data[category][period_label] += float(amount)
-
-        # Build the 'data' list
-        data_table = []
-        column_totals = defaultdict(float)
-        for category, period_data in report_data.items():
-            row = [category]
-            category_sum = 0
-            for period_label in date_range:
-                amount = period_data.get(period_label, 0)
-                row.append(amount)
-                category_sum += amount
-                column_totals[period_label] += float(amount)
-            row.append(category_sum)
-            data_table.append(row)
-        # Add total row
-        total_row = ['Жами']
-        overall_total = 0
-        for period_label in date_range:
-            col_sum = column_totals[period_label]
-            total_row.append(col_sum)
-            overall_total += float(col_sum)
-        total_row.append(overall_total)
-        data_table.append(total_row)
-
-        return {'periods': date_range, 'data': data_table}
-
-
-class ReportProfitView(RetrieveAPIView):
+            matrix.add(expense['category__name'], labels[expense['period']], expense['total_amount'])
+        return matrix
+
+
+class RecordHierarchicallyReportExcelView(RecordHierarchicallyReportView):
+    @extend_schema(
+        summary="Get Hierarchical Expense Report as Excel",
+        description=(
+                "The hierarchical report as an xlsx workbook: one sheet per region with the cities and mosques "
+                "grouped under it, a column per period, subtotals per place and a grand total. "
+                "With `background=true` the workbook is built by a job, see /api/job/."
+        ),
+        parameters=[
+            OpenApiParameter(
+                name='period',
+                location=OpenApiParameter.PATH,
+                description="The period for grouping the report ('daily', 'weekly', 'monthly', 'quarterly', 'yearly', 'hijri_monthly' or 'hijri_yearly').",
+                required=True,
+                type=str,
+                enum=list(CalendarDay.PERIOD_FIELDS)
+            ),
+            OpenApiParameter(
+                name='place_id',
+                location=OpenApiParameter.QUERY,
+                description="Place Id",
+                type=OpenApiTypes.INT,
+            ),
+            OpenApiParameter(
+                name='start',
+                location=OpenApiParameter.QUERY,
+                description="Start date for the report in 'YYYY-MM-DD' format.",
+                required=True,
+                type=OpenApiTypes.DATE,
+            ),
+            OpenApiParameter(
+                name='end',
+                location=OpenApiParameter.QUERY,
+                description="End date for the report in 'YYYY-MM-DD' format.",
+                required=True,
+                type=OpenApiTypes.DATE,
+            ),
+            OpenApiParameter(
+                name='background',
+                location=OpenApiParameter.QUERY,
+                description="'true' to run as a job, see /api/job/",
+                type=OpenApiTypes.BOOL,
+            )
+        ],
+        responses={(200, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'): OpenApiTypes.BINARY}
+    )
+    def get(self, request, period, *args, **kwargs):
+        if jobs.is_requested(request):
+            params, error_response = self.get_report_params(request, period)
+            if error_response is not None:
+                return error_response
+            place_id, start_date, end_date = params
+            job = jobs.submit(Job.Kind.REPORT_HIERARCHICALLY_XLSX, user=request.user, params={
+                'period': period, 'place_id': place_id, 'start': start_date.isoformat(), 'end': end_date.isoformat(),
+            })
+            return Response(JobSerializer(job, context={'request': request}).data, status=202)
+
+        # The same (cached) report as the JSON endpoint
+        place_hierarchy, error_response = self.get_report(request, period)
+        if error_response is not None:
+            return error_response
+
+        return FileResponse(
+            write_hierarchical_report(place_hierarchy), as_attachment=True, filename=f'report-{period}.xlsx'
+        )
+
+
+class ReportProfitView(ReplicaReadsMixin, RetrieveAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
+    @extend_schema(
+        summary="Get Balance",
+        description=(
+                "Net balance (income minus expense) of the place, read from the running balances. "
+                "With `subtree=true` the balances of every place under it are summed as well."
+        ),
+        parameters=[
+            OpenApiParameter(
+                name='subtree',
+                location=OpenApiParameter.QUERY,
+                description="'true' to include the places under the place",
+                type=OpenApiTypes.BOOL,
+            ),
+        ],
+        responses={
+            200: OpenApiResponse(
+                description="Successful Response",
+                examples=[
+                    OpenApiExample(
+                        "Successful Response",
+                        value={"total": 1500.0, "income": 2000.0, "expense": 500.0, "record_count": 12}
+                    )
+                ],
+            ),
+        }
+    )
     def retrieve(self, request, *args, **kwargs):
-        result = Record.objects.filter(place=kwargs.get('place_id')).aggregate(total=Sum(Case(
-            When(category__operation_type=Category.OperationType.EXPENSE, then=F('amount') * -1),
-            default=F('amount'),
-            output_field=FloatField()
-        )))
-        return Response(result)
-
-class ReportValueView(RetrieveAPIView):
+        place_id = kwargs.get('place_id')
+        if request.query_params.get('subtree', '').lower() in ('1', 'true'):
+            balance = PlaceBalance.objects.subtree_total(place_id)
+        else:
+            balance = PlaceBalance.objects.filter(place_id=place_id).values(
+                'income', 'expense', 'net', 'record_count'
+            ).first() or {'income': 0, 'expense': 0, 'net': 0, 'record_count': 0}
+
+        return Response({
+            # No records, no total, as when it was summed from the records
+            'total': float(balance['net']) if balance['record_count'] else None,
+            'income': float(balance['income']),
+            'expense': float(balance['expense']),
+            'record_count': balance['record_count'],
+        })
+
+class ReportProfitChildrenView(ReplicaReadsMixin, APIView):
+    permission_classes = [permissions.IsAuthenticated]
+    ORDERING_FIELDS = ('name', 'income', 'expense', 'net')
+
+    @extend_schema(
+        summary="Get Balances of the Children",
+        description=(
+                "Income, expense and net of the place and of each of its children (with everything under them), "
+                "optionally within a date range. Children are paginated and ordered by `ordering`."
+        ),
+        parameters=[
+            OpenApiParameter(
+                name='place_id',
+                location=OpenApiParameter.PATH,
+                description="Place Id",
+                type=OpenApiTypes.INT,
+            ),
+            OpenApiParameter(
+                name='start',
+                location=OpenApiParameter.QUERY,
+                description="Start date in 'YYYY-MM-DD' format.",
+                type=OpenApiTypes.DATE,
+            ),
+            OpenApiParameter(
+                name='end',
+                location=OpenApiParameter.QUERY,
+                description="End date in 'YYYY-MM-DD' format.",
+                type=OpenApiTypes.DATE,
+            ),
+            OpenApiParameter(
+                name='ordering',
+                location=OpenApiParameter.QUERY,
+                description="One of name, income, expense, net, prefixed with '-' for descending order.",
+                type=str,
+            ),
+            OpenApiParameter(name='page', location=OpenApiParameter.QUERY, type=OpenApiTypes.INT),
+            OpenApiParameter(name='page_size', location=OpenApiParameter.QUERY, type=OpenApiTypes.INT),
+        ],
+        responses={
+            200: OpenApiResponse(
+                description="Successful Response",
+                examples=[
+                    OpenApiExample(
+                        "Successful Response",
+                        value={
+                            "place": {"id": 1, "name": "Region", "is_mosque": False, "income": "2000.00", "expense": "500.00", "net": "1500.00"},
+                            "count": 1,
+                            "next": None,
+                            "previous": None,
+                            "results": [
+                                {"id": 2, "name": "Mosque", "is_mosque": True, "income": "2000.00", "expense": "500.00", "net": "1500.00"}
+                            ]
+                        }
+                    )
+                ],
+            ),
+        }
+    )
+    def get(self, request, place_id, *args, **kwargs):
+        tree = get_place_tree()
+        if not tree.contains(place_id):
+            raise NotFound('Place not found')
+        if request.user.place_id is not None and not tree.is_descendant(place_id, request.user.place_id):
+            raise ValidationError('Place id does not belong to your area')
+
+        start, end = _get_date_range(request)
+
+        ordering = request.query_params.get('ordering') or 'name'
+        if ordering.lstrip('-') not in self.ORDERING_FIELDS:
+            raise ValidationError(f'Ordering should be one of {", ".join(self.ORDERING_FIELDS)}')
+
+        places = Place.objects.with_profit(start, end)
+        children = places.filter(parent_id=place_id).order_by(ordering, 'id')
+
+        paginator = CustomPagination()
+        page = paginator.paginate_queryset(children, request, view=self)
+        response = paginator.get_paginated_response(PlaceProfitSerializer(page, many=True).data)
+        response.data = {'place': PlaceProfitSerializer(places.get(pk=place_id)).data, **response.data}
+        return response
+
+
+class ReportValueView(ReplicaReadsMixin, RetrieveAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
     @extend_schema(
@@ -526,34 +954,53 @@ class ReportValueView(RetrieveAPIView):
 
         start_date = request.query_params.get('start')
         end_date = request.query_params.get('end')
-        categories_with_units = Category.objects.filter(unit__isnull=False)
+
+        data = report_cache.get_or_compute(
+            'report-value', place_id, (start_date, end_date),
+            lambda: self.build_report(place_id, start_date, end_date),
+        )
+
+        return Response(data)
+
+    def build_report(self, place_id, start_date, end_date):
         places = self._get_leaf_places(place_id)
 
-        data = (Record.objects
-                .filter(place_id__in=places, date__range=(start_date, end_date), category__in=categories_with_units)
+        data = (RecordDailyRollup.objects
+                .filter(place_id__in=places, date__range=(start_date, end_date), category__unit__isnull=False)
                 .values('category_id', 'category__name', 'category__unit__name' )
                 .annotate(total_quantity=Sum('quantity')))
 
         serializer = ReportValueSerializer(data, many=True)
 
-
-
-        return Response(serializer.data)
+        return list(serializer.data)
 
     def _get_leaf_places(self, place_id: int):
-        # Start by getting the place for the given place_id
-        place = Place.objects.get(id=place_id)
-
-        # Find children of the current place
-        children = Place.objects.filter(parent=place)
-
-        # If there are no children, this place is a leaf node
-        if not children.exists():
-            return [place]
+        return get_place_tree().leaves(place_id)
 
-        # Otherwise, recursively find leaf nodes in all children
-        leaf_places = []
-        for child in children:
-            leaf_places.extend(self._get_leaf_places(child.id))
+class ReportCacheStatsView(APIView):
+    permission_classes = [permissions.IsAdminUser]
 
-        return leaf_places
\ No newline at end of file
+    @extend_schema(
+        summary="Report coalescing counters",
+        description=(
+                "Reports computed, coalesced into an identical request in progress, and waits for one that "
+                "timed out: counts of the process that serves the request and of every process sharing the cache. "
+                "Staff only."
+        ),
+        responses={
+            200: OpenApiResponse(
+                description="Counters",
+                examples=[
+                    OpenApiExample(
+                        "Counters",
+                        value={
+                            "process": {"computed": 120, "coalesced": 35, "timed_out": 0},
+                            "total": {"computed": 410, "coalesced": 96, "timed_out": 2},
+                        }
+                    )
+                ],
+            ),
+        }
+    )
+    def get(self, request, *args, **kwargs):
+        return Response(report_cache.coalescing_stats())
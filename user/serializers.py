@@ -6,7 +6,7 @@ from django.utils.translation import gettext as _
 from rest_framework import serializers
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 
-from core.models import ActivityLog
+from core.audit import audit_log
 from core.serializers import PositionSerializer
 from core.utils import get_client_ip
 
@@ -72,7 +72,7 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
 
         remote_addr = get_client_ip(request)
 
-        ActivityLog.objects.create(
+        audit_log.log(
             user=user,  # Pass request from view
             action='login',
             object_id=None,
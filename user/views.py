@@ -7,7 +7,7 @@ from rest_framework import generics, permissions
 from rest_framework.generics import ListAPIView
 
 
-from core.models import ActivityLog
+from core.audit import audit_log
 from core.utils import get_client_ip
 from user.serializers import UserSerializer, CustomTokenObtainPairSerializer
 from .dto.me import MeSerializer
@@ -52,7 +52,7 @@ class LogoutView(APIView):
 
             # Log the logout activity
             remote_addr = get_client_ip(request)
-            ActivityLog.objects.create(
+            audit_log.log(
                 user=request.user,  # Pass request from view
                 action='logout',
                 object_id=None,